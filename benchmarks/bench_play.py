@@ -0,0 +1,240 @@
+##############################
+# End-to-end benchmark of Bardo.play on CPU
+#
+# Runs a template over a synthetic transcript with an in-process OllamaStub, and reports
+# segments/minute, real-time factor, peak RSS and the per-stage latencies of the session trace.
+#
+#   python benchmarks/bench_play.py run --save my_change
+#   python benchmarks/bench_play.py run --compare benchmarks/baselines/main.json
+#   python benchmarks/bench_play.py compare benchmarks/baselines/main.json benchmarks/baselines/my_change.json
+##############################
+import os
+import sys
+import json
+import random
+import resource
+import platform
+import argparse
+import tempfile
+import subprocess
+from pathlib import Path
+from datetime import datetime
+from time import perf_counter
+
+import torch
+
+from babel_bardo import Bardo
+from babel_bardo.templates import Bardo0, Bardo1, Bardo2, Bardo3
+from babel_bardo.model_registry import get_model
+from babel_bardo.ollama_stub import OllamaStub
+from babel_bardo.constants import MODEL
+
+BENCHMARKS_PATH = Path(__file__).parent.resolve()
+BASELINES_PATH = BENCHMARKS_PATH.joinpath('baselines')
+VIDEO_ID = 'benchmark'
+WINDOW = 30 # TranscriptIter window, in seconds
+
+TEMPLATES = {
+    'bardo_0': lambda root: Bardo0('Benchmark', root, VIDEO_ID),
+    'bardo_1': lambda root: Bardo1('Benchmark', root, VIDEO_ID, translate=False),
+    'bardo_2': lambda root: Bardo2('Benchmark', root, VIDEO_ID),
+    'bardo_3': lambda root: Bardo3('Benchmark', root, VIDEO_ID),
+}
+
+# Metrics compared against the baselines, and whether higher values are better
+METRICS = {
+    'segments_per_minute': True,
+    'rtf': False,
+    'peak_rss_mb': False,
+}
+# Trace values that aren't latencies, left out of the comparison
+NOT_LATENCIES = ('audio', 'tokens_per_second', 'llm_tokens', 'llm_tokens_per_second', 'llm_prompt_tokens')
+
+WORDS = ["the", "dragon", "party", "sword", "forest", "we", "attack", "roll", "initiative", "door", "opens",
+         "quietly", "gold", "tavern", "wizard", "casts", "a", "spell", "on", "goblin", "run", "now"]
+
+def synthetic_transcript(windows:int, seed:int=0) -> list[dict]:
+    "A transcript with a frase every ~3s covering windows*WINDOW seconds, in the YouTube API format"
+    rand = random.Random(seed)
+    transcript = []
+    start = 0.0
+
+    while start < windows * WINDOW - 3:
+        duration = rand.uniform(1.5, 3.0)
+        text = ' '.join(rand.choice(WORDS) for _ in range(rand.randint(4, 12)))
+        # TranscriptIter unpacks the values in this order
+        transcript.append({'text': text, 'start': round(start, 2), 'duration': round(duration, 2)})
+        start += duration + rand.uniform(0.1, 0.5)
+
+    return transcript
+
+def git_commit() -> str|None:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARKS_PATH, text=True).strip()
+    except Exception:
+        return None
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == 'darwin' else rss / 2**10
+
+def run(args) -> dict:
+    if args.threads != None:
+        torch.set_num_threads(args.threads)
+
+    root = tempfile.mkdtemp(prefix='bardo_bench_')
+
+    template = TEMPLATES[args.template](root)
+    template.transcripts_cache = Path(root).joinpath('transcripts')
+    # Cached answers would skip the fake Ollama latency
+    template.llm_cache = False
+    os.makedirs(template.transcripts_cache)
+
+    with open(template.transcripts_cache.joinpath(f"{VIDEO_ID}.json"), 'w') as json_file:
+        json.dump(synthetic_transcript(args.windows), json_file)
+
+    load_start = perf_counter()
+    model = get_model(args.model, device='cpu', duration=args.duration, extend_stride=args.extend_stride)
+    model_load_time = perf_counter() - load_start
+
+    with OllamaStub(latency=args.llm_latency, jitter=args.llm_jitter, distribution=args.llm_distribution,
+                    tokens_per_second=args.llm_tokens_per_second, error_rate=args.llm_error_rate) as ollama:
+        os.environ['OLLAMA_ADDRES'] = ollama.address
+
+        bardo = Bardo(template, model)
+
+        play_start = perf_counter()
+        bardo.play(pipelined=args.pipelined, offline=args.offline, checkpoint_every=args.checkpoint_every, warmup=args.warmup)
+        wall_time = perf_counter() - play_start
+
+    with open(template.trace_file, 'r') as trace_file:
+        windows = [json.loads(line) for line in trace_file if line.strip() != '']
+
+    audio_seconds = sum(window['audio'] for window in windows)
+    stages = {stage: stats for stage, stats in bardo.trace_summary.items() if isinstance(stats, dict)}
+
+    return {
+        'name': args.save,
+        'commit': git_commit(),
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'platform': platform.platform(),
+        'torch': torch.__version__,
+        'threads': torch.get_num_threads(),
+        'config': {
+            'template': args.template,
+            'model': args.model,
+            'windows': args.windows,
+            'duration': args.duration,
+            'extend_stride': args.extend_stride,
+            'llm_latency': args.llm_latency,
+            'llm_jitter': args.llm_jitter,
+            'llm_distribution': args.llm_distribution,
+            'llm_tokens_per_second': args.llm_tokens_per_second,
+            'llm_error_rate': args.llm_error_rate,
+            'pipelined': args.pipelined,
+            'offline': args.offline,
+            'checkpoint_every': args.checkpoint_every,
+            'warmup': args.warmup,
+        },
+        'model_load_seconds': model_load_time,
+        'wall_seconds': wall_time,
+        'segments': len(windows),
+        'audio_seconds': audio_seconds,
+        'segments_per_minute': len(windows) / (wall_time / 60),
+        'rtf': wall_time / audio_seconds,
+        'peak_rss_mb': peak_rss_mb(),
+        'llm_requests': ollama.stats,
+        'warmup': getattr(bardo, 'warmup_report', None),
+        'stages': stages,
+    }
+
+def print_result(result:dict):
+    print(f"\n{result['segments']} segments, {result['audio_seconds']:.1f}s of audio in {result['wall_seconds']:.1f}s "
+          f"(model load {result['model_load_seconds']:.1f}s)")
+    print(f"segments/min: {result['segments_per_minute']:.3f}   rtf: {result['rtf']:.3f}   peak rss: {result['peak_rss_mb']:.0f} MB")
+    print(f"{'stage':<20} {'p50':>10} {'p95':>10} {'max':>10}")
+
+    for stage, stats in result['stages'].items():
+        print(f"{stage:<20} {stats['p50']:>10.3f} {stats['p95']:>10.3f} {stats['max']:>10.3f}")
+
+def compare(baseline:dict, current:dict, tolerance:float) -> bool:
+    """Prints the change of each metric and stage p50 from baseline to current.
+    Returns False if any of them got worse by more than tolerance (a fraction)"""
+    if baseline['config'] != current['config']:
+        print("Warning: the runs have different configs, the comparison may not be meaningful")
+
+    rows = [(metric, baseline[metric], current[metric], higher_is_better) for metric, higher_is_better in METRICS.items()]
+
+    for stage, stats in current['stages'].items():
+        if stage in baseline['stages'] and stage not in NOT_LATENCIES:
+            rows.append((f"{stage} p50", baseline['stages'][stage]['p50'], stats['p50'], False))
+
+    ok = True
+    print(f"\n{'metric':<24} {baseline['commit'] or 'baseline':>12} {current['commit'] or 'current':>12} {'change':>9}")
+
+    for metric, base_value, value, higher_is_better in rows:
+        change = (value - base_value) / base_value if base_value != 0 else 0
+        regression = -change > tolerance if higher_is_better else change > tolerance
+        ok = ok and not regression
+
+        flag = '  REGRESSION' if regression else ''
+        print(f"{metric:<24} {base_value:>12.3f} {value:>12.3f} {change:>+9.1%}{flag}")
+
+    return ok
+
+def load_result(path:str) -> dict:
+    with open(path, 'r') as json_file:
+        return json.load(json_file)
+
+def save_result(result:dict, path:str|Path):
+    os.makedirs(Path(path).parent, exist_ok=True)
+
+    with open(path, 'w') as json_file:
+        json.dump(result, json_file, indent=4)
+
+    print("Saved", path)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="End-to-end CPU benchmark of Bardo.play")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="Runs the benchmark")
+    run_parser.add_argument("-t", "--template", choices=TEMPLATES.keys(), default='bardo_2')
+    run_parser.add_argument("-m", "--model", help="MusicGen pretrained name", default=MODEL)
+    run_parser.add_argument("-w", "--windows", help="Number of 30s transcript windows", type=int, default=4)
+    run_parser.add_argument("-d", "--duration", help="MusicGen generation duration", type=int, default=10)
+    run_parser.add_argument("-es", "--extend-stride", help="MusicGen extend stride", type=int, default=5)
+    run_parser.add_argument("-l", "--llm-latency", help="Mean latency of the Ollama stub, in seconds", type=float, default=0.5)
+    run_parser.add_argument("-j", "--llm-jitter", help="Latency standard deviation of the Ollama stub", type=float, default=0.1)
+    run_parser.add_argument("--llm-distribution", choices=OllamaStub.DISTRIBUTIONS, default='normal')
+    run_parser.add_argument("--llm-tokens-per-second", type=float, default=20)
+    run_parser.add_argument("--llm-error-rate", help="Probability of a failed Ollama request", type=float, default=0)
+    run_parser.add_argument("-p", "--pipelined", help="Plays in pipelined mode", action='store_true')
+    run_parser.add_argument("-o", "--offline", help="Plays in offline mode", action='store_true')
+    run_parser.add_argument("-ce", "--checkpoint-every", help="Checkpoint interval, <= 0 disables them", type=int, default=1)
+    run_parser.add_argument("-wu", "--warmup", help="Warms the models up before the first window", action='store_true')
+    run_parser.add_argument("--threads", help="torch CPU threads", type=int, default=None)
+    run_parser.add_argument("--save", help="Saves the result as benchmarks/baselines/<SAVE>.json", default=None)
+    run_parser.add_argument("--compare", help="Baseline JSON to compare the result with", default=None)
+    run_parser.add_argument("--tolerance", help="Allowed relative regression", type=float, default=0.1)
+
+    compare_parser = subparsers.add_parser('compare', help="Compares two saved results")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--tolerance", help="Allowed relative regression", type=float, default=0.1)
+
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        result = run(args)
+        print_result(result)
+
+        if args.save != None:
+            save_result(result, BASELINES_PATH.joinpath(f"{args.save}.json"))
+
+        ok = compare(load_result(args.compare), result, args.tolerance) if args.compare != None else True
+    else:
+        ok = compare(load_result(args.baseline), load_result(args.current), args.tolerance)
+
+    sys.exit(0 if ok else 1)
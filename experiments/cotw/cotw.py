@@ -6,8 +6,8 @@ import shutil
 from pytubefix import Playlist
 
 from babel_bardo.templates import *
-from babel_bardo import Bardo, fit_audio_in_video
-from babel_bardo.eval_metrics import get_kld, get_kld_for_transitions, get_fad_vggish, get_kld_for_segments_transitions
+from babel_bardo import Bardo, MultiBardo, fit_audio_in_video
+from babel_bardo.eval_metrics import EpisodeEvaluator, get_fad_vggish
 
 
 RPGNAME = 'Call Of The Wild'
@@ -15,6 +15,7 @@ PLAYLIST = 'https://www.youtube.com/playlist?list=PLMZlu4rxEyKKl-Ecgca3bbVDMZ89S
 EXCERPT_LENGTH = 60 * 30
 BARDO_ROOT_PATH = pathlib.Path(__file__).parent.joinpath('results').resolve()
 SOUNDTRACK_PATH = None # path for FAD background statistics 
+MULTI_BARDO = False # generates the templates in a single MusicGen batch, but without checkpoints
 
 playlist = Playlist(PLAYLIST)
 playlist = [(video.video_id, video.length) for video in playlist.videos]
@@ -65,6 +66,8 @@ def load_metrics(path_to_file:str) -> dict:
     return metrics
 
 wav_background_path = ''
+evaluator = EpisodeEvaluator()
+KLD_NAMES = {'kld': 'KLD', 's_t_kld': 'SEGMENT TRANSITION KLD', 't_kld': 'TRANSITION KLD'}
 
 for idx_v, video in enumerate(playlist):
     video_id, video_length = video
@@ -79,9 +82,7 @@ for idx_v, video in enumerate(playlist):
     if video_id in no_sub_vids:
         continue
 
-    for idx_t, template in enumerate(bardo_templates):
-        is_last_template = idx_t == len(bardo_templates) -1
-
+    for template in bardo_templates:
         # Set the same start for the same episode in set_random_excerpt
         eps_start = load_eps_start(template, playlist)
 
@@ -93,50 +94,51 @@ for idx_v, video in enumerate(playlist):
         print(f"\n Video {video_id} is starting at {eps_start[video_id]}")
         write_eps_start(template, eps_start)
 
-        print(template.log_header)
+    # Bardo Play
+    to_generate = [template for template in bardo_templates if not os.path.isfile(template.generated_audio_file)]
 
-        # Bardo Play
-        if not os.path.isfile(template.generated_audio_file):
-            bardo = Bardo(template)
-            bardo.play()
-        else:
+    for template in bardo_templates:
+        if template not in to_generate:
             print("Skipping generating", template.generated_audio_file)
 
-        fit_audio_in_video(template, video_id)
-
-        # Get Metrics
-        # KLD
-        kld_metrics = load_metrics(template.kld_file)
-
-        if kld_metrics.get(template.bardo_name) == None:
-            kld_data = get_kld(template.original_audios_path, template.original_audio_file, template.generated_audio_file)
-
-            print(f"\n MEAN KLD for {template.bardo_name}, video {video_id} = {kld_data['mean']} \n")
-
-            kld_metrics[template.bardo_name] = {k:str(v) for k,v in kld_data.items()}
-            write_metrics(template, kld_metrics, 'kld')
+    if MULTI_BARDO and len(to_generate) > 0:
+        # The templates that weren't generated yet are played together, in a single batch
+        for template in to_generate:
+            print(template.log_header)
 
-        # KLD for segments transitions
-        s_t_kld_metrics = load_metrics(template.segments_transitions_kld_metrics_file)
-
-        if s_t_kld_metrics.get(template.bardo_name) == None:
-            s_t_kld_data = get_kld_for_segments_transitions(template.generated_audio_file)
-
-            print(f"\n MEAN SEGMENT TRANSITION KLD for {template.bardo_name}, video {video_id} = {s_t_kld_data['mean']} \n")
-
-            s_t_kld_metrics[template.bardo_name] = {k:str(v) for k,v in s_t_kld_data.items()}
-            write_metrics(template, s_t_kld_metrics, 's_t_kld')
+        multi_bardo = MultiBardo(to_generate)
+        multi_bardo.play()
+    else:
+        # One at a time, with checkpoints to resume them after a crash
+        for template in to_generate:
+            print(template.log_header)
 
-        # KLD for transitions
-        t_kld_metrics = load_metrics(template.transitions_kld_metrics_file)
+            bardo = Bardo(template)
+            bardo.play(offline=True, resume=True)
 
-        if t_kld_metrics.get(template.bardo_name) == None:
-            t_kld_data = get_kld_for_transitions(template.original_audios_path, template.original_audio_file, template.generated_audio_file, template.transitions_eval_audios_path)
+    for idx_t, template in enumerate(bardo_templates):
+        is_last_template = idx_t == len(bardo_templates) -1
 
-            print(f"\n MEAN TRANSITION KLD for {template.bardo_name}, video {video_id} = {t_kld_data['mean']} \n")
+        fit_audio_in_video(template, video_id)
 
-            t_kld_metrics[template.bardo_name] = {k:str(v) for k,v in t_kld_data.items()}
-            write_metrics(template, t_kld_metrics, 't_kld')
+        # Get Metrics
+        # KLD, KLD for segments transitions and KLD for transitions, reading the audios once
+        kld_metrics = {
+            'kld': load_metrics(template.kld_file),
+            's_t_kld': load_metrics(template.segments_transitions_kld_metrics_file),
+            't_kld': load_metrics(template.transitions_kld_metrics_file),
+        }
+        missing = tuple(metric for metric, metrics in kld_metrics.items() if metrics.get(template.bardo_name) == None)
+
+        if len(missing) > 0:
+            kld_data = evaluator.evaluate(template.original_audios_path, template.original_audio_file, template.generated_audio_file,
+                                          template.transitions_eval_audios_path, metrics=missing)
+
+            for metric in missing:
+                print(f"\n MEAN {KLD_NAMES[metric]} for {template.bardo_name}, video {video_id} = {kld_data[metric]['mean']} \n")
+
+                kld_metrics[metric][template.bardo_name] = {k:str(v) for k,v in kld_data[metric].items()}
+                write_metrics(template, kld_metrics[metric], metric)
 
         #FAD
         if SOUNDTRACK_PATH != None:
@@ -1,7 +1,10 @@
 from babel_bardo.constants import *
 from babel_bardo.transcript_iter import TranscriptIter
 from babel_bardo.bardo import Bardo
+from babel_bardo.multi_bardo import MultiBardo
 from babel_bardo.ollama_api import OllamaChat, OllamaType, PromptConfig
+from babel_bardo.prompt_engine import PromptEngine, OllamaEngine, DialogEngine, ClassifierEngine
+from babel_bardo.emotion_classifier import EmotionClassifier
 from babel_bardo.video_manager import fit_audio_in_video
 from babel_bardo.templates import *
 from babel_bardo.eval_metrics import *
\ No newline at end of file
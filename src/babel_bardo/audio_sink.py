@@ -0,0 +1,173 @@
+import os
+
+import numpy as np
+import soundfile as sf
+import torch
+from audiocraft.data.audio_utils import normalize_audio
+
+class AudioSink():
+    # soundfile formats and the subtype used for the raw (not normalized) audio
+    _SUBTYPES = {
+        'wav': 'FLOAT',
+        'flac': 'PCM_24',
+    }
+
+    def __init__(self, file_no_ext:str, sample_rate:int, channels:int=1, format:str='wav', max_file_duration:float|None=None) -> None:
+        """Appends each generated segment to disk as soon as it is produced, so the memory used by
+        Bardo.play doesn't grow with the session length.
+
+        Segments are written raw to "<file_no_ext>.partial.<format>" and only get normalized by close().
+        If max_file_duration (in seconds) is given, the session is rotated into
+        "<file_no_ext>_000", "<file_no_ext>_001", ... files of at most that duration each.
+        """
+        assert format in self._SUBTYPES, f"format must be one of {list(self._SUBTYPES.keys())}"
+
+        self.file_no_ext = str(file_no_ext)
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.format = format
+        self.max_file_frames = None if max_file_duration == None else int(max_file_duration * sample_rate)
+
+        self.part = 0 # index of the file being written
+        self.part_frames = 0 # frames written in the current file
+        self.total_frames = 0 # frames written in the whole session
+
+        self._file = None
+
+    @property
+    def rotates(self) -> bool:
+        return self.max_file_frames != None
+
+    def _part_no_ext(self, part:int) -> str:
+        if self.rotates:
+            return f"{self.file_no_ext}_{part:03d}"
+
+        return self.file_no_ext
+
+    def partial_file(self, part:int) -> str:
+        return f"{self._part_no_ext(part)}.partial.{self.format}"
+
+    def final_file(self, part:int) -> str:
+        return f"{self._part_no_ext(part)}.{self.format}"
+
+    @property
+    def files(self) -> list[str]:
+        "Final files of the session, in order"
+        return [self.final_file(part) for part in range(self.part + 1)]
+
+    @property
+    def duration(self) -> float:
+        "Duration in seconds written so far"
+        return self.total_frames / self.sample_rate
+
+    def _open(self):
+        self._file = sf.SoundFile(
+            self.partial_file(self.part),
+            mode='w',
+            samplerate=self.sample_rate,
+            channels=self.channels,
+            format=self.format.upper(),
+            subtype=self._SUBTYPES[self.format]
+        )
+        self.part_frames = 0
+
+    def _rotate(self):
+        self._file.close()
+        self.part += 1
+        self._open()
+
+    def write(self, wav:torch.Tensor):
+        """Appends a segment of shape [B=1, C, T] or [C, T] to the session"""
+        if wav.dim() == 3:
+            assert wav.shape[0] == 1, "AudioSink only writes one session at a time (B=1)"
+            wav = wav[0]
+
+        # soundfile expects [frames, channels]
+        frames = wav.detach().float().cpu().numpy().T
+        frames = np.ascontiguousarray(frames)
+
+        if self._file == None:
+            self._open()
+
+        while len(frames) > 0:
+            if self.rotates and self.part_frames >= self.max_file_frames:
+                self._rotate()
+
+            n_frames = len(frames)
+            if self.rotates:
+                n_frames = min(n_frames, self.max_file_frames - self.part_frames)
+
+            self._file.write(frames[:n_frames])
+            self.part_frames += n_frames
+            self.total_frames += n_frames
+
+            frames = frames[n_frames:]
+
+    def state_dict(self) -> dict:
+        "What was written so far, to resume the session with load_state_dict after a crash"
+        return {
+            'max_file_frames': self.max_file_frames,
+            'part': self.part,
+            'part_frames': self.part_frames,
+            'total_frames': self.total_frames,
+        }
+
+    def load_state_dict(self, state:dict):
+        """Reopens the partial file of a crashed session, dropping anything written after state was taken"""
+        assert state['max_file_frames'] == self.max_file_frames, "The session must be resumed with the same max_file_duration"
+
+        self.part = state['part']
+        self.part_frames = state['part_frames']
+        self.total_frames = state['total_frames']
+
+        # Files rotated after the checkpoint will be written again
+        next_part = self.part + 1
+        while os.path.isfile(self.partial_file(next_part)):
+            os.remove(self.partial_file(next_part))
+            next_part += 1
+
+        if self.total_frames == 0:
+            # Nothing was written before the checkpoint, the file gets opened by the next write
+            return
+
+        self._file = sf.SoundFile(self.partial_file(self.part), mode='r+')
+        self._file.truncate(self.part_frames)
+        self._file.seek(self.part_frames)
+
+    def flush(self):
+        "Makes what was written so far readable from disk. Costs O(segment), not O(session)"
+        if self._file != None:
+            self._file.flush()
+
+    def close(self, strategy:str|None="loudness", loudness_compressor:bool=True, loudness_headroom_db:float=14) -> list[str]:
+        """Closes the session, moving the partial files to their final names.
+        If strategy isn't None, each file is normalized (as audiocraft's audio_write does) and
+        saved as 16 bits PCM, loading one file at a time.
+
+        Returns:
+            The final files of the session.
+        """
+        if self._file == None:
+            return []
+
+        self._file.close()
+        self._file = None
+
+        for part in range(self.part + 1):
+            partial_file = self.partial_file(part)
+
+            if strategy == None:
+                os.replace(partial_file, self.final_file(part))
+                continue
+
+            wav, _ = sf.read(partial_file, dtype='float32', always_2d=True)
+            wav = torch.from_numpy(wav.T)
+
+            wav = normalize_audio(wav, strategy=strategy, loudness_headroom_db=loudness_headroom_db,
+                                  loudness_compressor=loudness_compressor, sample_rate=self.sample_rate)
+            wav = wav.clamp(-1, 1)
+
+            sf.write(self.final_file(part), wav.numpy().T, self.sample_rate, subtype='PCM_16')
+            os.remove(partial_file)
+
+        return self.files
@@ -3,29 +3,43 @@ from copy import deepcopy
 import random
 
 import argparse
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor
 
 from .transcript_iter import TranscriptIter
-from .music_gen_bypass import generate_bypass, generate_continuation_bypass, encodec_tailfade
+from .prompt_pipeline import PromptPipeline, sequential_prompts
+from .audio_sink import AudioSink
+from .token_archive import TokenArchiveWriter, TokenArchive
+from .model_registry import get_model
+from .conditioning_cache import conditioning_cache
+from .session_trace import SessionTrace, synchronize, format_summary
+from .scheduler import DeadlineScheduler
+from .checkpoint import get_rng_state, set_rng_state, save_checkpoint, load_checkpoint, clear_checkpoint
+from .music_gen_bypass import generate_bypass, generate_continuation_bypass, encodec_tailfade, encodec_tailfade_batch, generation_duration
 from .ollama_api import OllamaChat, OllamaType
+from .llm_cache import LLMCache
+from .prompt_engine import PromptEngine, OllamaEngine, DialogEngine
 from .constants import *
-from.log import clear_log, write_log_header, write_log_description
+from.log import clear_log, write_log_header, open_log, write_log_description, write_log_deadline_report, log_offset, truncate_log
 from .templates import BardoTemplate
 
 import numpy as np
 import torch
 from audiocraft.models import MusicGen
-from audiocraft.data.audio import audio_write
 
 from tqdm import tqdm
 
 class Bardo():
-    def __init__(self, template:BardoTemplate, model:MusicGen|None=None) -> None:
+    def __init__(self, template:BardoTemplate, model:MusicGen|None=None, prompt_engine:PromptEngine|None=None) -> None:
+        """
+            model: MusicGen to use, by default it's taken from the model registry
+            prompt_engine: what turns the dialogs into prompts, by default an OllamaEngine or a
+                DialogEngine, depending on the template ollama_type
+        """
         self.t = template
 
         self._create_dir_structure()
 
-        clear_log(self.t.log_file)
-        write_log_header(self.t.log_file, self.t.log_header, self.t.prompt_config)
         print(str(self.t.prompt_config))
 
         # Set seed
@@ -35,16 +49,15 @@ class Bardo():
         random.seed(self.seed)
         np.random.seed(self.seed)
 
-        # Setup Ollama
-        if self.t.ollama_type != OllamaType.NONE:
-            self.ollama_chat = OllamaChat(self.seed)
+        # Setup the prompt engine
+        if prompt_engine == None:
+            self._set_prompt_engine()
+        else:
+            self.prompt_engine = prompt_engine
 
         if self.t.prompt_config.setup != "":
-            # To set a setup prompt Ollama must be in CHAT mode
-            assert self.t.ollama_type == OllamaType.CHAT
-
-            self.ollama_chat.send(self.t.prompt_config.setup, setup=True)
-            print("Setted Ollama prompt")
+            self.prompt_engine.setup(self.t.prompt_config.setup)
+            print(f"Setted {self.prompt_engine} prompt")
 
         # Setup MusicGen
         if model == None:
@@ -52,9 +65,22 @@ class Bardo():
         else:
             self.model = model
 
+    def _set_prompt_engine(self):
+        if self.t.ollama_type == OllamaType.NONE:
+            # To set a setup prompt Ollama must be in CHAT mode
+            assert self.t.prompt_config.setup == ""
+
+            self.prompt_engine = DialogEngine()
+            return
+
+        ollama_chat = OllamaChat(self.seed, stream=True, cache=LLMCache() if self.t.llm_cache else None, history=self.t.chat_history,
+                                 models=self.t.llm_models, latency_budget=self.t.llm_latency_budget)
+        self.prompt_engine = OllamaEngine(ollama_chat)
+
     def _set_model(self):
-        self.model = MusicGen.get_pretrained(MODEL)
-        self.model.set_generation_params(
+        # The registry keeps the weights loaded between Bardo instances
+        self.model = get_model(
+            MODEL,
             duration=DURATION,
             extend_stride=EXTEND_STRIDE
         )
@@ -69,75 +95,370 @@ class Bardo():
 
         parser.add_argument("-cc", "--ClearCache", help = "Clears the transcripts cache", action='store_true')
 
-        args = parser.parse_args()
+        # Known args only, so scripts that call play can have their own arguments
+        args, _ = parser.parse_known_args()
 
         if args.ClearCache:
             TranscriptIter.clear_transcript_cache()
 
-    def play(self, save_every:int=-1):
+    def _text_prompt(self, frases:str) -> str|None:
+        "Turns the dialog of a window into the MusicGen text prompt, asking the prompt engine for it"
+        answer = self.prompt_engine.answer(frases, choices=self.t.prompt_config.choices)
+        text_prompt = self.t.prompt_config.start + answer + self.t.prompt_config.end
+
+        if text_prompt == "CONTINUE.":
+            tqdm.write('Received a "CONTINUE." command, sending text_prompt=None')
+            text_prompt=None
+
+        return text_prompt
+
+    def _scheduled_text_prompt(self, frases:str) -> str|None:
+        "Live mode version of _text_prompt, that skips the LLM when the scheduler says the deadline is at risk"
+        plan = self.scheduler.next_plan(has_llm=self.prompt_engine.uses_llm)
+
+        if plan.use_llm:
+            start = perf_counter()
+            text_prompt = self._text_prompt(frases)
+            self.scheduler.record_llm(perf_counter() - start)
+        elif plan.continue_only:
+            text_prompt = None
+        else:
+            text_prompt = self.scheduler.previous_prompt
+
+        tqdm.write(f"Live plan: {plan}")
+
+        return text_prompt
+
+    def _dummy_generation(self) -> dict:
+        "Generates and decodes a couple of seconds, going through the same paths as play"
+        timings = {}
+        description = [self.t.prompt_config.start + "warmup" + self.t.prompt_config.end]
+
+        start = perf_counter()
+        with generation_duration(self.model, 1):
+            tokens = generate_bypass(self.model, descriptions=description)
+        with generation_duration(self.model, 2):
+            tokens = generate_continuation_bypass(self.model, tokens, descriptions=description, prompt_sample_rate=self.model.sample_rate)
+        synchronize(self.model.device)
+        timings['generation'] = perf_counter() - start
+
+        start = perf_counter()
+        self.model.generate_audio(tokens)
+        synchronize(self.model.device)
+        timings['decode'] = perf_counter() - start
+
+        return timings
+
+    def warmup(self, t_iter:TranscriptIter|None=None) -> dict:
+        """Pays the first call costs before the first window: loads the transcript and the prompt engine
+        model (e.g. Ollama's) while T5, the LM and EnCodec run a tiny dummy generation twice.
+        The RNG state is restored afterwards, so warming up doesn't change the generated music.
+
+        Parameters:
+            t_iter (TranscriptIter or None): If given it's iterated (which loads its transcript),
+                otherwise the transcript is loaded into the cache for play.
+
+        Returns:
+            The seconds spent in each step, with the cold and warm timings of the dummy generation.
+        """
+        if t_iter == None:
+            t_iter = TranscriptIter(self.t.video_id, start_time=self.t.start_time, end_time=self.t.end_time, language=self.t.language, cache_dir=self.t.transcripts_cache)
+
+        def timed(fn):
+            start = perf_counter()
+            fn()
+            return perf_counter() - start
+
+        rng_state = get_rng_state()
+        warmup_start = perf_counter()
+
+        # The transcript and the prompt engine wait on the network, not on the model
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            transcript = executor.submit(timed, lambda: iter(t_iter))
+            prompt_engine = executor.submit(timed, self.prompt_engine.warmup)
+
+            with torch.no_grad():
+                cold = self._dummy_generation()
+                warm = self._dummy_generation()
+
+            report = {
+                'transcript': transcript.result(),
+                'prompt_engine': prompt_engine.result(),
+            }
+
+        set_rng_state(rng_state)
+
+        report['generation'] = {'cold': cold['generation'], 'warm': warm['generation']}
+        report['decode'] = {'cold': cold['decode'], 'warm': warm['decode']}
+        report['total'] = perf_counter() - warmup_start
+
+        print(f"Warmup took {report['total']:.2f}s: transcript {report['transcript']:.2f}s, {self.prompt_engine} {report['prompt_engine']:.2f}s")
+        print(f"Dummy generation cold {cold['generation']:.2f}s, warm {warm['generation']:.2f}s. Decode cold {cold['decode']:.2f}s, warm {warm['decode']:.2f}s")
+
+        self.warmup_report = report
+
+        return report
+
+    def _with_window_state(self, prompt_fn, t_iter:TranscriptIter):
+        """Wraps prompt_fn so each prompt comes with the state needed to resume right after its window.
+        It's taken together with the prompt because the pipelined worker runs ahead of the play loop"""
+        def window_prompt(frases:str):
+            # Live mode may skip the LLM, don't report the stats of a previous window
+            self.prompt_engine.last_stats = {}
+
+            start = perf_counter()
+            text_prompt = prompt_fn(frases)
+            prompt_time = perf_counter() - start
+
+            return text_prompt, {
+                'transcript': t_iter.state_dict(),
+                'prompt_engine': self.prompt_engine.state_dict(),
+                'prompt_time': prompt_time,
+                'llm_stats': dict(self.prompt_engine.last_stats),
+            }
+
+        return window_prompt
+
+    def play(self, save_every:int=-1, pipelined:bool=False, lookahead:int=1, max_file_duration:float|None=None,
+             live:bool=False, window_budget:float|None=None, resume:bool=False, checkpoint_every:int=1,
+             offline:bool=False, decode_batch_size:int=8, warmup:bool=False):
+        """
+            save_every: flushes the audio generated so far to disk every save_every windows, if > 0
+            pipelined: if True the text prompt of the next windows is requested in a background worker
+                while MusicGen generates the current one, so each window costs about max(LLM, TTM)
+                instead of LLM + TTM
+            lookahead: how many prompts the pipelined worker may compute ahead of MusicGen
+            max_file_duration: if given, the generated audio is rotated into files of at most
+                max_file_duration seconds, see AudioSink
+            live: if True each window has a wall-clock deadline, and the LLM and MusicGen steps get
+                degraded when it is at risk, see DeadlineScheduler
+            window_budget: seconds available for each window in live mode. Defaults to the model duration
+            resume: if True and a checkpoint of a crashed session exists, continues it from the window
+                after the checkpoint instead of starting from idx 0
+            checkpoint_every: saves a checkpoint every checkpoint_every windows, if > 0
+            offline: if True no audio is decoded during the generation. The archived tokens are decoded
+                at the end, decode_batch_size segments at a time, with the same crossfade
+            warmup: if True runs warmup before the first window, loading the transcript meanwhile
+        """
+        assert not (live and pipelined), "live and pipelined modes can't be used together"
+        assert not (live and offline), "live mode needs the audio of each window, it can't be offline"
+
         self._parser()
 
-        t_iter = TranscriptIter(self.t.video_id, start_time=self.t.start_time, end_time=self.t.end_time, language=self.t.language)
+        t_iter = TranscriptIter(self.t.video_id, start_time=self.t.start_time, end_time=self.t.end_time, language=self.t.language, cache_dir=self.t.transcripts_cache)
+
+        if warmup:
+            # The transcript is loaded while the models warm up
+            self.warmup(t_iter)
+        else:
+            iter(t_iter)
+
         overlap = self.model.duration - self.model.extend_stride
 
         previous_tokens = None
-        previous_wav = None
-
-        tqdm_iter = tqdm(enumerate(t_iter), total=len(t_iter), desc=f"Generating Songs For Video {t_iter.video_id}")
-
-        for idx, description in tqdm_iter:
-            frases, _ = description
-
-            if self.t.ollama_type != OllamaType.NONE:
-                text_prompt = self.ollama_chat.send(frases)
-                text_prompt = text_prompt.strip('\"')
-                text_prompt = self.t.prompt_config.start + text_prompt + self.t.prompt_config.end
-            else:
-                text_prompt = self.t.prompt_config.start + frases + self.t.prompt_config.end
-            
-            if text_prompt == "CONTINUE.":
-                tqdm.write('Received a "CONTINUE." command, sending text_prompt=None')
-                text_prompt=None
-
-            tqdm.write(f"\nGenerating idx {idx} \nText Prompt: {text_prompt}")
-
-            if idx == 0:
-                current_tokens = generate_bypass(
-                    self.model,
-                    descriptions=[text_prompt],
-                    progress=True
-                )
-            else:
-                previous_overlap = previous_tokens[:, :, -overlap*self.model.frame_rate:]
-
-                current_tokens = generate_continuation_bypass(
-                    self.model,
-                    previous_overlap,
-                    descriptions=[text_prompt],
-                    prompt_sample_rate = self.model.sample_rate,
-                    progress=True
+        previous_prompt = None
+        start_idx = 0
+
+        # Each segment is appended to disk as soon as it is decoded
+        sink = AudioSink(self.t.generated_audio_file_no_ext, self.model.sample_rate, channels=self.model.audio_channels, max_file_duration=max_file_duration)
+        # And its tokens are kept, to re-render the session without the language model
+        archive = TokenArchiveWriter(self.t.token_archive_no_ext, self.model.name, self.model.sample_rate, self.model.frame_rate, self.seed)
+
+        checkpoint = load_checkpoint(self.t.checkpoint_file) if resume else None
+
+        if checkpoint == None:
+            clear_log(self.t.log_file)
+            write_log_header(self.t.log_file, self.t.log_header, self.t.prompt_config)
+        else:
+            start_idx = checkpoint['idx'] + 1
+            print(f"Resuming {self.t.bardo_name} for video {self.t.video_id} at idx {start_idx}")
+
+            t_iter.load_state_dict(checkpoint['transcript'])
+            previous_tokens = checkpoint['tokens'].to(self.model.device)
+            previous_prompt = checkpoint['text_prompt']
+
+            self.prompt_engine.load_state_dict(checkpoint['prompt_engine'])
+
+            set_rng_state(checkpoint['rng'])
+            sink.load_state_dict(checkpoint['sink'])
+            archive.load_state_dict(checkpoint['archive'])
+
+            # Drop the log of the windows that ran after the checkpoint, they run again
+            if checkpoint.get('log_offset') != None:
+                truncate_log(self.t.log_file, checkpoint['log_offset'])
+
+        if live:
+            window_budget = self.model.duration if window_budget == None else window_budget
+            self.scheduler = DeadlineScheduler(window_budget, self.model.duration, overlap)
+            self.scheduler.previous_prompt = previous_prompt
+            self.prompt_engine.set_latency_budget(window_budget)
+
+            prompt_fn = self._scheduled_text_prompt
+        else:
+            prompt_fn = self._text_prompt
+
+        prompt_fn = self._with_window_state(prompt_fn, t_iter)
+
+        if pipelined:
+            prompts = PromptPipeline(t_iter, prompt_fn, lookahead=lookahead, start_idx=start_idx)
+        else:
+            prompts = sequential_prompts(t_iter, prompt_fn, start_idx=start_idx)
+
+        tqdm_iter = tqdm(prompts, total=len(t_iter), initial=start_idx, desc=f"Generating Songs For Video {t_iter.video_id}")
+
+        trace = SessionTrace(self.t.trace_file, self.t.trace_summary_file, resume_idx=checkpoint['idx'] if checkpoint != None else None)
+        cache = conditioning_cache(self.model)
+
+        if live:
+            self.scheduler.start(start_idx)
+
+        # One handle for the whole session, flushed at each checkpoint
+        log = open_log(self.t.log_file)
+        window_start = perf_counter()
+
+        try:
+            for idx, frases, (text_prompt, window_state) in tqdm_iter:
+                tqdm.write(f"\nGenerating idx {idx} \nText Prompt: {text_prompt}")
+
+                conditioning_seconds = cache.seconds if cache != None else 0
+                ttm_start = perf_counter()
+                duration = self.scheduler.plan.duration if live else None
+
+                with generation_duration(self.model, duration):
+                    if idx == 0:
+                        current_tokens = generate_bypass(
+                            self.model,
+                            descriptions=[text_prompt],
+                            progress=True
+                        )
+                    else:
+                        previous_overlap = previous_tokens[:, :, -int(overlap*self.model.frame_rate):]
+
+                        current_tokens = generate_continuation_bypass(
+                            self.model,
+                            previous_overlap,
+                            descriptions=[text_prompt],
+                            prompt_sample_rate = self.model.sample_rate,
+                            progress=True
+                        )
+
+                synchronize(self.model.device)
+                generation_time = perf_counter() - ttm_start
+                conditioning_time = (cache.seconds if cache != None else 0) - conditioning_seconds
+
+                log_start = perf_counter()
+                write_log_description(self.model, log, frases, text_prompt, idx, self.t.start_time, tqdm_iter)
+
+                log_time = perf_counter() - log_start
+
+                # Decode outputs
+                decode_start = perf_counter()
+                current_wav = None
+
+                if offline:
+                    # Decoded after the loop from the token archive
+                    pass
+                elif idx == 0:
+                    # We're gonna play 29s and save 1s as crossfade
+                    current_wav = self.model.generate_audio(current_tokens)[:, :, :-CROSSFADE_DURATION*self.model.sample_rate]
+                else:
+                    # Decode the current tokens with tailfade, getting context from the previous ones
+                    current_wav = encodec_tailfade(self.model, CROSSFADE_DURATION, previous_tokens, current_tokens)
+
+                synchronize(self.model.device)
+                decode_time = perf_counter() - decode_start
+
+                # Append the audio from previous_tokens+current_tokens to the session on disk
+                write_start = perf_counter()
+
+                if current_wav != None:
+                    sink.write(current_wav)
+
+                if save_every > 0 and (idx+1) % save_every == 0:
+                    sink.flush()
+
+                window_duration = self.model.duration if duration == None else duration
+                timings = {
+                    'llm': window_state['prompt_time'],
+                    'conditioning': conditioning_time,
+                    'generation': generation_time - conditioning_time,
+                    'decode': decode_time,
+                }
+
+                archive.append(current_tokens, idx, text_prompt, window_duration, timings=timings)
+                write_time = perf_counter() - write_start + log_time
+
+                if live:
+                    self.scheduler.record_ttm(perf_counter() - ttm_start, window_duration, text=text_prompt != None)
+
+                    if not self.scheduler.finish(text_prompt):
+                        tqdm.write(f"Window {idx} missed its deadline")
+
+                checkpoint_start = perf_counter()
+
+                if checkpoint_every > 0 and (idx+1) % checkpoint_every == 0:
+                    # The checkpoint can only point to audio and log that are already on disk
+                    sink.flush()
+                    log.flush()
+                    save_checkpoint(self.t.checkpoint_file, {
+                        'idx': idx,
+                        'tokens': current_tokens.cpu(),
+                        'text_prompt': text_prompt,
+                        'transcript': window_state['transcript'],
+                        'prompt_engine': window_state['prompt_engine'],
+                        'rng': get_rng_state(),
+                        'sink': sink.state_dict(),
+                        'archive': archive.state_dict(),
+                        'log_offset': log_offset(self.t.log_file),
+                    })
+
+                checkpoint_time = perf_counter() - checkpoint_start
+
+                # Update previous tokens
+                previous_tokens = deepcopy(current_tokens)
+
+                # New audio of the window, the continuations include their prompt
+                new_frames = current_tokens.shape[-1] if idx == 0 else current_tokens.shape[-1] - previous_overlap.shape[-1]
+                audio_seconds = current_wav.shape[-1] / self.model.sample_rate if current_wav != None else window_duration
+                window_time = perf_counter() - window_start
+                window_start = perf_counter()
+
+                trace.record(idx, **timings,
+                    write=write_time,
+                    checkpoint=checkpoint_time,
+                    tokens_per_second=new_frames / timings['generation'] if timings['generation'] > 0 else None,
+                    window=window_time,
+                    audio=audio_seconds,
+                    rtf=window_time / audio_seconds,
+                    text_prompt=text_prompt,
+                    **{f"llm_{stat}": value for stat, value in window_state['llm_stats'].items()},
                 )
+        finally:
+            # Stops the pipelined worker if the loop is interrupted
+            prompts.close()
+            log.close()
+
+        archive.close()
+
+        if offline:
+            tokens_iter = (tokens.to(self.model.device) for tokens in TokenArchive(self.t.token_archive_no_ext))
+
+            for current_wav in tqdm(encodec_tailfade_batch(self.model, CROSSFADE_DURATION, tokens_iter, batch_size=decode_batch_size), total=len(t_iter), desc="Decoding"):
+                sink.write(current_wav)
+
+        # Normalize and move the session files to their final names
+        sink.close(strategy="loudness", loudness_compressor=True)
+        clear_checkpoint(self.t.checkpoint_file)
+
+        if cache != None:
+            print(str(cache))
+
+        print(str(self.prompt_engine))
+
+        self.trace_summary = trace.close()
+        print(f"Timings (s) per window: \n{format_summary(self.trace_summary)}")
 
-            write_log_description(self.model, self.t.log_file, frases, text_prompt, idx, self.t.start_time, tqdm_iter)
-
-            # Concatenate outputs
-            if previous_wav == None:
-                # We're gonna play 29s and save 1s as crossfade
-                previous_wav = self.model.generate_audio(current_tokens)[:, :, :-CROSSFADE_DURATION*self.model.sample_rate]
-            else:
-                # Decode the current tokens with tailfade, getting context from the previous ones
-                current_wav = encodec_tailfade(self.model, CROSSFADE_DURATION, previous_tokens, current_tokens)
-                # Join the wav generated until now with the audio from previous_tokens+current_tokens
-                previous_wav = torch.cat((previous_wav, current_wav), dim=2)
-
-            if save_every > 0 and (idx+1) % save_every == 0:
-                partial_wav = torch.squeeze(previous_wav, 0)
-                save_every_path = os.path.join(self.t.generated_audio_file_no_ext+'_partial', str(idx))
-                audio_write(save_every_path, partial_wav.cpu(), self.model.sample_rate, strategy="loudness", loudness_compressor=True)
-
-            # Update previous tokens
-            previous_tokens = deepcopy(current_tokens)
-
-        # Save concatenated outputs
-        previous_wav = torch.squeeze(previous_wav, 0)
-        audio_write(self.t.generated_audio_file_no_ext, previous_wav.cpu(), self.model.sample_rate, strategy="loudness", loudness_compressor=True)
+        if live:
+            self.deadline_report = self.scheduler.report()
+            print(str(self.scheduler))
+            write_log_deadline_report(self.t.log_file, str(self.scheduler))
@@ -0,0 +1,45 @@
+import os
+import random
+
+import numpy as np
+import torch
+
+def get_rng_state() -> dict:
+    "RNG states of every generator used by Bardo (MusicGen sampling, python and numpy)"
+    return {
+        'torch': torch.get_rng_state(),
+        'cuda': torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+        'random': random.getstate(),
+        'numpy': np.random.get_state(),
+    }
+
+def set_rng_state(state:dict):
+    torch.set_rng_state(state['torch'])
+
+    if state['cuda'] != None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+    random.setstate(state['random'])
+    np.random.set_state(state['numpy'])
+
+def save_checkpoint(checkpoint_file:str, checkpoint:dict):
+    """Writes the checkpoint to a temporary file and then renames it, so a crash while saving
+    never leaves a half written checkpoint behind"""
+    tmp_file = checkpoint_file + '.tmp'
+
+    with open(tmp_file, 'wb') as file:
+        torch.save(checkpoint, file)
+        file.flush()
+        os.fsync(file.fileno())
+
+    os.replace(tmp_file, checkpoint_file)
+
+def load_checkpoint(checkpoint_file:str) -> dict|None:
+    if not os.path.isfile(checkpoint_file):
+        return None
+
+    return torch.load(checkpoint_file, map_location='cpu')
+
+def clear_checkpoint(checkpoint_file:str):
+    if os.path.isfile(checkpoint_file):
+        os.remove(checkpoint_file)
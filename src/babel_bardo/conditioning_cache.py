@@ -0,0 +1,128 @@
+import threading
+from collections import OrderedDict
+from time import perf_counter
+
+import torch
+from audiocraft.models import MusicGen
+from audiocraft.modules.conditioners import T5Conditioner
+
+class ConditioningCache():
+    def __init__(self, conditioner:T5Conditioner, max_size:int=256) -> None:
+        """LRU cache of the T5 embeddings of each description, so repeated descriptions (Bardo0 emotions,
+        PromptConfig start/end wrappers, the empty CFG description) skip the text encoder.
+
+        It wraps the tokenize and forward methods of the conditioner: tokenize remembers the texts of
+        each batch and forward only runs T5 for the texts that aren't cached, padding the cached
+        embeddings back into a batch just like the tokenizer padding does.
+        """
+        self.conditioner = conditioner
+        self.max_size = max_size
+
+        self.entries = OrderedDict() # text -> (embeds [T, D], mask [T])
+        self.hits = 0
+        self.misses = 0
+        self.seconds = 0.0 # time spent building conditions, cached or not
+
+        self._batches = {} # id(input_ids) -> (input_ids, texts) of the batches waiting for forward
+        self._lock = threading.Lock()
+
+        self._tokenize = conditioner.tokenize
+        self._forward = conditioner.forward
+        conditioner.tokenize = self.tokenize
+        conditioner.forward = self.forward
+
+    def tokenize(self, x:list[str|None]) -> dict:
+        inputs = self._tokenize(x)
+        # T5Conditioner replaces missing descriptions with ""
+        texts = [xi if xi != None else "" for xi in x]
+
+        with self._lock:
+            # Keep input_ids alive with the texts so its id isn't reused
+            self._batches[id(inputs['input_ids'])] = (inputs['input_ids'], texts)
+
+        return inputs
+
+    def _encode(self, texts:list[str]):
+        "Runs T5 for texts and caches each embedding without its padding"
+        inputs = self._tokenize(texts)
+        embeds, mask = self._forward(inputs)
+
+        lengths = (inputs['input_ids'] != self.conditioner.t5_tokenizer.pad_token_id).sum(dim=1)
+
+        for text, text_embeds, text_mask, length in zip(texts, embeds, mask, lengths):
+            self.entries[text] = (text_embeds[:length], text_mask[:length])
+
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def forward(self, inputs:dict) -> tuple[torch.Tensor, torch.Tensor]:
+        start = perf_counter()
+        embeds, mask = self._cached_forward(inputs)
+
+        if embeds.is_cuda:
+            torch.cuda.synchronize(embeds.device)
+        self.seconds += perf_counter() - start
+
+        return embeds, mask
+
+    def _cached_forward(self, inputs:dict) -> tuple[torch.Tensor, torch.Tensor]:
+        with self._lock:
+            batch = self._batches.pop(id(inputs['input_ids']), None)
+
+            if batch == None:
+                # Not tokenized by this cache, can't tell which texts it holds
+                return self._forward(inputs)
+
+            _, texts = batch
+
+            missing = [text for text in dict.fromkeys(texts) if text not in self.entries]
+            self.misses += len(missing)
+            self.hits += len(texts) - len(missing)
+
+            if len(missing) > 0:
+                self._encode(missing)
+
+            rows = []
+            for text in texts:
+                self.entries.move_to_end(text)
+                rows.append(self.entries[text])
+
+        max_length = max(text_embeds.shape[0] for text_embeds, _ in rows)
+        first_embeds, first_mask = rows[0]
+
+        embeds = first_embeds.new_zeros((len(rows), max_length, first_embeds.shape[-1]))
+        mask = first_mask.new_zeros((len(rows), max_length))
+
+        for i, (text_embeds, text_mask) in enumerate(rows):
+            embeds[i, :text_embeds.shape[0]] = text_embeds
+            mask[i, :text_mask.shape[0]] = text_mask
+
+        return embeds, mask
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.seconds = 0.0
+
+    def __str__(self):
+        return f"T5 conditioning cache: {self.hits} hits, {self.misses} misses, {len(self.entries)} entries"
+
+def conditioning_cache(model:MusicGen, max_size:int=256) -> ConditioningCache|None:
+    """Returns the conditioning cache of the model, installing it the first time.
+    Models without a T5 description conditioner aren't cached and return None."""
+    # conditioners is an nn.ModuleDict, which has no get
+    conditioners = model.lm.condition_provider.conditioners
+    conditioner = conditioners['description'] if 'description' in conditioners else None
+
+    if not isinstance(conditioner, T5Conditioner):
+        return None
+
+    cache = getattr(conditioner, '_bardo_conditioning_cache', None)
+
+    if cache == None:
+        cache = ConditioningCache(conditioner, max_size)
+        conditioner._bardo_conditioning_cache = cache
+
+    return cache
@@ -1,6 +1,15 @@
 import pathlib
 
 TRANSCRIPTS_CACHE = pathlib.Path(__file__).parent.joinpath("cache", "transcripts").resolve()
+LLM_CACHE = pathlib.Path(__file__).parent.joinpath("cache", "llm").resolve()
+PASST_CACHE = pathlib.Path(__file__).parent.joinpath("cache", "passt").resolve()
+WAV_CACHE = pathlib.Path(__file__).parent.joinpath("cache", "wav").resolve()
+EMOTION_CLASSIFIER = pathlib.Path(__file__).parent.joinpath("cache", "emotion_classifier.joblib").resolve()
+
+OLLAMA_MODEL = 'llama3.1:70b'
+OLLAMA_FALLBACK_MODEL = 'llama3.1:8b' # used when OLLAMA_MODEL is too slow, see ModelTiers
+
+EMOTIONS = ["Happy", "Calm", "Agitated", "Suspenseful"] # Bardo0 answers
 
 MODEL = 'facebook/musicgen-small' # facebook/musicgen-large
 EXTEND_STRIDE = 10
@@ -0,0 +1,103 @@
+import os
+import argparse
+from pathlib import Path
+
+import joblib
+from sklearn.pipeline import Pipeline
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import cross_val_score
+
+from .llm_cache import LLMCache
+from .constants import EMOTIONS, LLM_CACHE, EMOTION_CLASSIFIER
+
+class EmotionClassifier():
+    def __init__(self, labels:list[str]=EMOTIONS, max_features:int=20000, C:float=4.0) -> None:
+        """CPU-only replacement for the Bardo0 LLM: TF-IDF of the dialog words and word pairs, followed by
+        a logistic regression over labels. It answers in milliseconds, see ClassifierEngine.
+
+        It is trained on labeled dialogs (fit), e.g. distilled from the Ollama answers of previous
+        Bardo0 runs (from_llm_cache).
+        """
+        self.labels = labels
+        self.pipeline = Pipeline([
+            ('tfidf', TfidfVectorizer(ngram_range=(1, 2), sublinear_tf=True, max_features=max_features)),
+            ('linear', LogisticRegression(C=C, max_iter=1000, class_weight='balanced')),
+        ])
+
+    def fit(self, texts:list[str], labels:list[str]) -> 'EmotionClassifier':
+        unknown = set(labels).difference(self.labels)
+        assert len(unknown) == 0, f"Unknown labels {unknown}"
+        assert len(set(labels)) > 1, "At least two different labels are needed"
+
+        self.pipeline.fit(texts, labels)
+
+        return self
+
+    def predict(self, text:str) -> str:
+        return str(self.pipeline.predict([text])[0])
+
+    def predict_proba(self, text:str) -> dict[str, float]:
+        probs = self.pipeline.predict_proba([text])[0]
+        return {label: float(prob) for label, prob in zip(self.pipeline.classes_, probs)}
+
+    @staticmethod
+    def dataset_from_llm_cache(cache_dir:str|Path=LLM_CACHE, labels:list[str]=EMOTIONS) -> tuple[list[str], list[str]]:
+        "Dialogs and answers of the cached LLM answers that are one of labels"
+        texts, answers = [], []
+
+        for entry in LLMCache(cache_dir).entries():
+            answer = entry['answer'].strip().strip('\"\'.!')
+
+            # Entries cached before the prompts were kept, or answers of other templates
+            if entry.get('prompt') == None or answer not in labels:
+                continue
+
+            texts.append(entry['prompt'])
+            answers.append(answer)
+
+        return texts, answers
+
+    @classmethod
+    def from_llm_cache(cls, cache_dir:str|Path=LLM_CACHE, labels:list[str]=EMOTIONS, **kwargs) -> 'EmotionClassifier':
+        "Distills the cached Ollama answers into a classifier"
+        texts, answers = cls.dataset_from_llm_cache(cache_dir, labels)
+        return cls(labels, **kwargs).fit(texts, answers)
+
+    def save(self, path:str|Path=EMOTION_CLASSIFIER):
+        os.makedirs(Path(path).parent, exist_ok=True)
+
+        tmp_path = str(path) + '.tmp'
+        joblib.dump(self, tmp_path)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(path:str|Path=EMOTION_CLASSIFIER) -> 'EmotionClassifier':
+        return joblib.load(path)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Trains the Bardo0 emotion classifier on the cached Ollama answers")
+
+    parser.add_argument("-c", "--cache", help="LLM cache directory", default=LLM_CACHE)
+    parser.add_argument("-o", "--out", help="Where the classifier is saved", default=EMOTION_CLASSIFIER)
+
+    args = parser.parse_args()
+
+    texts, answers = EmotionClassifier.dataset_from_llm_cache(args.cache)
+    print(f"{len(texts)} labeled dialogs:", {label: answers.count(label) for label in EMOTIONS})
+
+    if len(texts) == 0:
+        parser.error(f"no labeled dialogs in the LLM cache {args.cache}, run some Bardo0 sessions with the cache on first")
+    if len(set(answers)) < 2:
+        parser.error("the LLM cache only has dialogs of one emotion, the classifier needs at least two")
+
+    classifier = EmotionClassifier()
+
+    # Agreement with the LLM on unseen dialogs, when every class has enough of them
+    folds = min(5, *(answers.count(label) for label in set(answers)))
+    if folds >= 2:
+        scores = cross_val_score(classifier.pipeline, texts, answers, cv=folds)
+        print(f"{folds}-fold agreement with the LLM: {scores.mean():.3f} +- {scores.std():.3f}")
+
+    classifier.fit(texts, answers).save(args.out)
+    print("Saved", args.out)
@@ -1,6 +1,6 @@
 import os
 import shutil
-from typing import Generator
+from typing import Generator, Iterable
 from pathlib import Path
 import math
 
@@ -8,12 +8,15 @@ from tqdm import tqdm
 
 import ffmpeg
 import numpy as np
+import psutil
 import torch
 import torchaudio
 
 from frechet_audio_distance import FrechetAudioDistance
 
 from .passt.passt import get_passt
+from .passt_cache import PasstCache
+from .wav_cache import WavCache
 
 def _audio_dir_to_mono_sr_wav(audios_dir:str, sr:int=32000, ident:str='', segment:int=0):
     folder_name = f"{ident}_wav_{sr}_mono_{segment}"
@@ -112,8 +115,9 @@ def get_fad_vggish(background_path:str, eval_path:str, eval_ep_file:str|None, re
 
     return overall_fad, ep_fad, wav_background_path
 
-def _audio_iter(audio_path:str|Path, sr:int=32000, seconds:int=10) -> Generator[torch.Tensor, None, None]:
+def _audio_iter(audio_path:str|Path, sr:int=32000, seconds:int=10) -> Generator[tuple[int, torch.Tensor], None, None]:
     """
+        Yields the start (in samples) and audio of each window
         sr: sample rate
     """
     # Get audio tensor
@@ -123,16 +127,17 @@ def _audio_iter(audio_path:str|Path, sr:int=32000, seconds:int=10) -> Generator[
         frames_per_chunk=sr*seconds,
     )
 
-    for chunk in streamer.stream():
+    for i, chunk in enumerate(streamer.stream()):
         # audio_wave needs shape of [batch, seconds*sample_rate]
         # since we have only one channel and one batch, the channel
         # dim is beeing being repurposed as the batch one
-        audio = chunk[0].transpose(1,0).cuda()
+        audio = chunk[0].transpose(1,0)
 
-        yield audio
+        yield i*sr*seconds, audio
 
-def _transition_audio_iter(audio_file:str|Path, save_path:str|Path|None, sr:int=32000) -> Generator[torch.Tensor, None, None]:
+def _transition_audio_iter(audio_file:str|Path, save_path:str|Path|None, sr:int=32000) -> Generator[tuple[int, torch.Tensor], None, None]:
     """
+        Yields the start (in samples) and audio of each window
         sr: sample rate
     """
     # Get audio tensor
@@ -155,13 +160,14 @@ def _transition_audio_iter(audio_file:str|Path, save_path:str|Path|None, sr:int=
         # audio_wave needs shape of [batch, seconds*sample_rate]
         # since we have only one channel and one batch, the channel
         # dim is beeing being repurposed as the batch one
-        yield audio.cuda()
+        yield current_time*sr, audio
 
         current_time+=30
         streamer.seek(current_time)
 
-def _transition_segment_iter(audio_file:str|Path, sr:int=32000) -> Generator[torch.Tensor, None, None]:
+def _transition_segment_iter(audio_file:str|Path, sr:int=32000) -> Generator[tuple[tuple[int, torch.Tensor], tuple[int, torch.Tensor]], None, None]:
     """
+        Yields the start (in samples) and audio of the segments before and after each transition
         sr: sample rate
     """
     # Get audio tensor
@@ -186,172 +192,382 @@ def _transition_segment_iter(audio_file:str|Path, sr:int=32000) -> Generator[tor
         # audio_wave needs shape of [batch, seconds*sample_rate]
         # since we have only one channel and one batch, the channel
         # dim is beeing being repurposed as the batch one
-        yield segment_1.cuda(), segment_2.cuda()
+        yield (current_time*sr, segment_1), ((current_time+10)*sr, segment_2)
 
         current_time+=30
         streamer.seek(current_time)
 
-def _calculate_kld(background:torch.Tensor, eval:torch.Tensor) -> float:
+def _binary_kld(background:torch.Tensor, eval:torch.Tensor, eps:float=1e-6) -> torch.Tensor:
     """
-        Calculates KL-divergence as in https://pytorch.org/docs/stable/generated/torch.nn.KLDivLoss.html
+        KL-divergence as in https://pytorch.org/docs/stable/generated/torch.nn.KLDivLoss.html between the
+        Bernoulli distributions [p, 1-p] of each class, for whole [windows, classes] probability matrices.
+        Probabilities are clamped to [eps, 1-eps], so a class with probability 0 or 1 doesn't give nan or inf.
+
+        Returns the [windows, classes] KLDs.
     """
-    return torch.sum(background * (background.log() - eval.log())).item()
+    p = background.double().clamp(eps, 1 - eps)
+    q = eval.double().clamp(eps, 1 - eps)
 
-def get_kld_for_segments_transitions(eval_audio:str|Path) -> dict:
+    return p * (p.log() - q.log()) + (1 - p) * (torch.log1p(-p) - torch.log1p(-q))
+
+def _kld_stats(background_probs:list[torch.Tensor], eval_probs:list[torch.Tensor]) -> dict:
     """
-        KLD for 10s windows centered in 30s intervals, when the transitions happen, comparing
-        the generated segment before the transition with the one after the transition.
-        Only works for audios in mono at 32KHz.
+        Sums the class KLDs of each window and returns their statistics.
+        background_probs, eval_probs: PaSSt probabilities [classes] of each window
+    """
+    kld_array = _binary_kld(torch.stack(background_probs), torch.stack(eval_probs)).sum(dim=1).cpu().numpy()
 
-        sr: sample rate
+    return {
+        'list': kld_array.tolist(),
+        'sum': kld_array.sum(),
+        'mean': kld_array.mean(),
+        'std': kld_array.std(),
+        'min': kld_array.min(),
+        'max': kld_array.max()
+    }
+
+# Rough peak memory of a PaSSt forward pass per 10s window, used to size the batches
+PASST_WINDOW_BYTES = 128 * 2**20
+
+def _is_oom(e:Exception) -> bool:
+    return isinstance(e, torch.cuda.OutOfMemoryError) or (isinstance(e, RuntimeError) and "memory" in str(e))
+
+def _auto_batch_size(device:torch.device, batch_size:int) -> int:
+    "Caps batch_size to the windows that fit in half of the free memory of device"
+    if device.type == 'cuda':
+        free, _ = torch.cuda.mem_get_info(device)
+    else:
+        free = psutil.virtual_memory().available
+
+    return max(1, min(batch_size, int(free * 0.5 // PASST_WINDOW_BYTES)))
+
+def _passt_forward(model:torch.nn.Module, windows:torch.Tensor, state:dict) -> torch.Tensor:
     """
-    duration = float(ffmpeg.probe(eval_audio)['streams'][0]['duration'])
+        PaSSt probabilities [B, classes] of windows [B, samples], state['batch_size'] windows at a time.
+        Out of memory errors halve state['batch_size'] and retry, so the next batches use the new size.
+    """
+    outputs = []
+    start = 0
 
-    total = math.ceil(duration/30)
-    kld_list = [] # list with mean class klds for each 10s segment
+    while start < len(windows):
+        size = state['batch_size']
 
-    with torch.no_grad():
-        # passt
-        model = get_passt()
-        model.eval()
-        model = model.cuda()
+        try:
+            outputs.append(model(windows[start:start+size]).cpu())
+            start += size
+        except Exception as e:
+            if size == 1 or not _is_oom(e):
+                raise
 
-        # For each 10s segment
-        for first_segment, second_segment in tqdm(_transition_segment_iter(eval_audio, sr=32000), total=total, desc='Segment Transitions KLD'):
-            first__sig = model(first_segment).squeeze()
-            second_sig = model(second_segment).squeeze()
+            state['batch_size'] = size // 2
+            tqdm.write(f"PaSSt out of memory with {size} windows, retrying with {state['batch_size']}")
 
-            # KLD for each label
-            class_klds = np.zeros(183)
-            count = 0
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
 
-            for first_prob, second_prob in zip(first__sig, second_sig):
-                first_distrib = torch.tensor([first_prob, 1 - first_prob])
-                second_distrib = torch.tensor([second_prob, 1 - second_prob])
+    return torch.cat(outputs)
 
-                class_kld = _calculate_kld(first_distrib, second_distrib)
+_Window = tuple[int, torch.Tensor] # start in samples, audio [1, samples]
 
-                class_klds[count] = class_kld
-                count += 1
+def _passt_windows(model:torch.nn.Module, windows:Iterable[tuple[str|Path, int, torch.Tensor]], sr:int=32000,
+                   batch_size:int=32, cache:PasstCache|None=None, total:int|None=None,
+                   desc:str|None=None) -> list[torch.Tensor]:
+    """
+        Runs PaSSt on the (audio file, start in samples, audio [1, samples]) windows, collecting batch_size
+        windows for each forward pass. Consecutive windows with the same length are batched together, so the
+        shorter last windows get their own pass. The batch size shrinks if the free memory or an OOM ask for it.
+        Windows already in cache skip PaSSt, and the new ones are added to it.
 
-            kld_list.append(class_klds.sum())
+        Returns the PaSSt probabilities [classes] of each window.
+    """
+    device = next(model.parameters()).device
+    state = {'batch_size': _auto_batch_size(device, batch_size)}
 
-    kld_array = np.array(kld_list)
+    probs = [] # None until their forward pass
+    pending = [] # (index in probs, file, start, audio) waiting for a forward pass
 
-    return {
-        'list': kld_list,
-        'sum': kld_array.sum(),
-        'mean': kld_array.mean(),
-        'std': kld_array.std(),
-        'min': kld_array.min(),
-        'max': kld_array.max()
-    }
+    def flush():
+        start = 0
+
+        while start < len(pending):
+            # Run of windows with the same length
+            end = start + 1
+            while end < len(pending) and pending[end][3].shape == pending[start][3].shape:
+                end += 1
+
+            batch = torch.cat([audio for _, _, _, audio in pending[start:end]]).to(device)
+
+            for (index, file, window_start, audio), window_probs in zip(pending[start:end], _passt_forward(model, batch, state)):
+                if cache != None:
+                    window_probs = cache.put(file, sr, window_start, audio.shape[-1], window_probs)
+
+                probs[index] = window_probs
+
+            start = end
+
+        pending.clear()
+
+    for file, window_start, audio in tqdm(windows, total=total, desc=desc):
+        cached = cache.get(file, sr, window_start, audio.shape[-1]) if cache != None else None
+        probs.append(cached)
+
+        if cached is None:
+            pending.append((len(probs) - 1, file, window_start, audio))
+
+        if len(pending) >= state['batch_size']:
+            flush()
+
+    flush()
 
-def get_kld_for_transitions(background_path:str, background_audio:str|Path, eval_audio:str|Path, save_path:str|Path) -> dict:
+    if cache != None:
+        cache.flush()
+
+    return probs
+
+def _passt_pairs(model:torch.nn.Module, pairs:Iterable[tuple[_Window, _Window]], files:tuple[str|Path, str|Path],
+                 sr:int=32000, batch_size:int=32, cache:PasstCache|None=None, total:int|None=None,
+                 desc:str|None=None) -> tuple[list[torch.Tensor], list[torch.Tensor]]:
     """
-        KLD for 10s windows centered in 30s intervals, when the transitions happen, of
-        generated vs original audios.
+        _passt_windows for pairs of windows.
+        files: audio files of the first and of the second windows, for the cache keys
+
+        Returns the PaSSt probabilities [classes] of the first and of the second window of each pair.
+    """
+    windows = ((file, window_start, audio) for pair in pairs for file, (window_start, audio) in zip(files, pair))
+    probs = _passt_windows(model, windows, sr, batch_size, cache, total=total*2 if total != None else None, desc=desc)
+
+    return probs[0::2], probs[1::2]
+
+def get_kld_for_segments_transitions(eval_audio:str|Path, batch_size:int=32, device:str='auto', num_threads:int|None=None,
+                                     cache:bool=True) -> dict:
+    """
+        KLD for 10s windows centered in 30s intervals, when the transitions happen, comparing
+        the generated segment before the transition with the one after the transition.
         Only works for audios in mono at 32KHz.
 
         sr: sample rate
+        batch_size: max number of 10s windows in each PaSSt forward pass
+        device: where PaSSt runs, 'cpu', 'cuda' or 'auto'
+        num_threads: torch threads for the CPU inference, None keeps torch's
+        cache: reuses the PaSSt outputs of windows already evaluated, see PasstCache
     """
-    wav_background_path = _audio_dir_to_mono_sr_wav(background_path)
-    background_audio = os.path.join(wav_background_path, background_audio.split('/')[-1])
-
-    duration = float(ffmpeg.probe(background_audio)['streams'][0]['duration'])
+    duration = float(ffmpeg.probe(eval_audio)['streams'][0]['duration'])
 
     total = math.ceil(duration/30)
-    kld_list = [] # list with mean class klds for each 10s segment
 
     with torch.no_grad():
         # passt
-        model = get_passt()
-        model.eval()
-        model = model.cuda()
-
-        # For each 10s segment
-        for back_segment, eval_segment in tqdm(zip(_transition_audio_iter(background_audio, None, sr=32000), _transition_audio_iter(eval_audio, save_path, sr=32000)), total=total, desc='Transitions KLD'):
-            background_sig = model(back_segment).squeeze()
-            eval_sig = model(eval_segment).squeeze()
+        model = get_passt(device=device, num_threads=num_threads)
 
-            # KLD for each label
-            class_klds = np.zeros(183)
-            count = 0
+        # PaSSt probabilities of each 10s segment
+        segments = _transition_segment_iter(eval_audio, sr=32000)
+        first_probs, second_probs = _passt_pairs(model, segments, (eval_audio, eval_audio), batch_size=batch_size,
+                                                 cache=PasstCache() if cache else None, total=total, desc='Segment Transitions KLD')
 
-            for back_prob, eval_prob in zip(background_sig, eval_sig):
-                back_distrib = torch.tensor([back_prob, 1 - back_prob])
-                eval_distrib = torch.tensor([eval_prob, 1 - eval_prob])
+    # KLD for each label of every segment at once
+    return _kld_stats(first_probs, second_probs)
 
-                class_kld = _calculate_kld(back_distrib, eval_distrib)
+def get_kld_for_transitions(background_path:str, background_audio:str|Path, eval_audio:str|Path, save_path:str|Path, batch_size:int=32,
+                            device:str='auto', num_threads:int|None=None, cache:bool=True) -> dict:
+    """
+        KLD for 10s windows centered in 30s intervals, when the transitions happen, of
+        generated vs original audios.
+        Only works for audios in mono at 32KHz.
 
-                class_klds[count] = class_kld
-                count += 1
+        sr: sample rate
+        batch_size: max number of 10s windows in each PaSSt forward pass
+        device: where PaSSt runs, 'cpu', 'cuda' or 'auto'
+        num_threads: torch threads for the CPU inference, None keeps torch's
+        cache: reuses the PaSSt outputs of windows already evaluated, see PasstCache
+    """
+    background_audio = WavCache().get(os.path.join(background_path, background_audio.split('/')[-1]))
 
-            kld_list.append(class_klds.sum())
+    duration = float(ffmpeg.probe(background_audio)['streams'][0]['duration'])
 
-    kld_array = np.array(kld_list)
+    total = math.ceil(duration/30)
+    with torch.no_grad():
+        # passt
+        model = get_passt(device=device, num_threads=num_threads)
 
-    shutil.rmtree(wav_background_path)
+        # PaSSt probabilities of each 10s segment
+        segments = zip(_transition_audio_iter(background_audio, None, sr=32000), _transition_audio_iter(eval_audio, save_path, sr=32000))
+        background_probs, eval_probs = _passt_pairs(model, segments, (background_audio, eval_audio), batch_size=batch_size,
+                                                     cache=PasstCache() if cache else None, total=total, desc='Transitions KLD')
 
-    return {
-        'list': kld_list,
-        'sum': kld_array.sum(),
-        'mean': kld_array.mean(),
-        'std': kld_array.std(),
-        'min': kld_array.min(),
-        'max': kld_array.max()
-    }
+    # KLD for each label of every segment at once
+    return _kld_stats(background_probs, eval_probs)
 
-def get_kld(background_path:str|Path, background_audio:str|Path, eval_audio:str|Path) -> dict:
+def get_kld(background_path:str|Path, background_audio:str|Path, eval_audio:str|Path, batch_size:int=32, device:str='auto',
+            num_threads:int|None=None, cache:bool=True) -> dict:
     """
         KLD for 10s windows of generated vs original audios. 
         Only works for audios in mono at 32KHz.
 
         sr: sample rate
+        batch_size: max number of 10s windows in each PaSSt forward pass
+        device: where PaSSt runs, 'cpu', 'cuda' or 'auto'
+        num_threads: torch threads for the CPU inference, None keeps torch's
+        cache: reuses the PaSSt outputs of windows already evaluated, see PasstCache
     """
-    wav_background_path = _audio_dir_to_mono_sr_wav(str(background_path))
-    background_audio = os.path.join(wav_background_path, background_audio.split('/')[-1])
+    background_audio = WavCache().get(os.path.join(background_path, background_audio.split('/')[-1]))
 
     duration = float(ffmpeg.probe(background_audio)['streams'][0]['duration'])
 
     total = math.ceil(duration/10)
-    kld_list = [] # list with mean class klds for each 10s segment
-
     with torch.no_grad():
         # passt
-        model = get_passt()
-        model.eval()
-        model = model.cuda()
-
-        # For each 10s segment
-        for back_segment, eval_segment in tqdm(zip(_audio_iter(background_audio, sr=32000), _audio_iter(eval_audio, sr=32000)), total=total, desc='KLD'):
-            background_sig = model(back_segment).squeeze()
-            eval_sig = model(eval_segment).squeeze()
-
-            # KLD for each label
-            class_klds = np.zeros(183)
-            count = 0
+        model = get_passt(device=device, num_threads=num_threads)
 
-            for back_prob, eval_prob in zip(background_sig, eval_sig):
-                back_distrib = torch.tensor([back_prob, 1 - back_prob])
-                eval_distrib = torch.tensor([eval_prob, 1 - eval_prob])
+        # PaSSt probabilities of each 10s segment
+        segments = zip(_audio_iter(background_audio, sr=32000), _audio_iter(eval_audio, sr=32000))
+        background_probs, eval_probs = _passt_pairs(model, segments, (background_audio, eval_audio), batch_size=batch_size,
+                                                     cache=PasstCache() if cache else None, total=total, desc='KLD')
 
-                class_kld = _calculate_kld(back_distrib, eval_distrib)
+    # KLD for each label of every segment at once
+    return _kld_stats(background_probs, eval_probs)
 
-                class_klds[count] = class_kld
-                count += 1
-
-            kld_list.append(class_klds.sum())
-
-    kld_array = np.array(kld_list)
+def _decode(audio_file:str|Path, sr:int=32000) -> torch.Tensor:
+    "Whole audio [1, samples]. Only works for audios in mono at sr"
+    streamer = torchaudio.io.StreamReader(str(audio_file))
 
-    shutil.rmtree(wav_background_path)
+    streamer.add_basic_audio_stream(
+        frames_per_chunk=sr*60,
+    )
 
-    return {
-        'list': kld_list,
-        'sum': kld_array.sum(),
-        'mean': kld_array.mean(),
-        'std': kld_array.std(),
-        'min': kld_array.min(),
-        'max': kld_array.max()
-    }
\ No newline at end of file
+    chunks = [chunk[0].transpose(1,0) for chunk in streamer.stream()]
+
+    return torch.cat(chunks, dim=1)
+
+def _grid_windows(samples:int, sr:int=32000) -> list[tuple[int, int]]:
+    "(start, end) of the 10s windows read by _audio_iter"
+    return [(start, min(start + sr*10, samples)) for start in range(0, samples, sr*10)]
+
+def _transition_windows(samples:int, sr:int=32000) -> list[tuple[int, int]]:
+    "(start, end) of the windows read by _transition_audio_iter, 25s to 35s of every 30s"
+    return [(start, min(start + sr*10, samples)) for start in range(sr*25, samples, sr*30)]
+
+def _segment_transition_windows(samples:int, sr:int=32000) -> list[tuple[tuple[int, int], tuple[int, int]]]:
+    "(start, end) of the window pairs read by _transition_segment_iter, 20s to 30s and 30s to 40s of every 30s"
+    return [((start, start + sr*10), (start + sr*10, min(start + sr*20, samples)))
+            for start in range(sr*20, samples - sr*10, sr*30)]
+
+class EpisodeEvaluator():
+    METRICS = ('kld', 't_kld', 's_t_kld')
+
+    def __init__(self, batch_size:int=32, device:str='auto', num_threads:int|None=None, cache:bool=True,
+                 fad_embeddings:bool=False) -> None:
+        """Computes the metrics of a generated episode in a single pass: each audio is decoded once, and
+        the windows of every metric are cut from it and run through PaSSt together. Windows shared by
+        the metrics (the segment transitions are on the KLD 10s grid) are evaluated once.
+
+        Gives the same results as get_kld, get_kld_for_transitions and get_kld_for_segments_transitions.
+
+        Parameters:
+            batch_size, device, num_threads, cache: as in get_kld
+            fad_embeddings (bool): also returns the VGGish embeddings of the generated audio 30s segments,
+                as get_fad_vggish computes them (see frechet_distance)
+        """
+        self.sr = 32000
+        self.batch_size = batch_size
+        self.device = device
+        self.num_threads = num_threads
+        self.cache = cache
+        self.fad_embeddings = fad_embeddings
+
+        self._frechet = None
+
+    @property
+    def frechet(self) -> FrechetAudioDistance:
+        if self._frechet == None:
+            self._frechet = FrechetAudioDistance(
+                ckpt_dir="../checkpoints/vggish",
+                model_name="vggish",
+                sample_rate=16000,
+                use_pca=False,
+                use_activation=False,
+                verbose=False,
+            )
+
+        return self._frechet
+
+    def _vggish_embeddings(self, audio:torch.Tensor) -> np.ndarray:
+        SAMPLE_RATE = 16000
+        audio = torchaudio.functional.resample(audio, self.sr, SAMPLE_RATE)[0]
+        segments = [segment.numpy() for segment in torch.split(audio, SAMPLE_RATE*30)]
+
+        return self.frechet.get_embeddings(segments, sr=SAMPLE_RATE)
+
+    def evaluate(self, background_path:str|Path, background_audio:str|Path, eval_audio:str|Path,
+                 transitions_save_path:str|Path|None=None, metrics:tuple[str]=METRICS) -> dict:
+        """
+            Returns the stats of the KLD ('kld'), transitions KLD ('t_kld') and segments transitions KLD ('s_t_kld')
+            in metrics, and the 'fad_embeddings' [segments, 128] if enabled.
+
+            background_path, background_audio: as in get_kld, only used by 'kld' and 't_kld'
+            transitions_save_path: where the generated transition windows are saved, as in get_kld_for_transitions
+        """
+        unknown = set(metrics).difference(self.METRICS)
+        assert len(unknown) == 0, f"Unknown metrics {unknown}"
+
+        sr = self.sr
+        eval_file = str(eval_audio)
+        eval_wave = _decode(eval_file, sr)
+        eval_samples = eval_wave.shape[-1]
+
+        background_file = None
+        if 'kld' in metrics or 't_kld' in metrics:
+            background_file = str(WavCache().get(os.path.join(background_path, str(background_audio).split('/')[-1])))
+            background_wave = _decode(background_file, sr)
+
+        # (file, start, end) of the first and second windows compared by each metric
+        pairs = {}
+
+        if 'kld' in metrics:
+            pairs['kld'] = [((background_file, *back), (eval_file, *ev))
+                            for back, ev in zip(_grid_windows(background_wave.shape[-1], sr), _grid_windows(eval_samples, sr))]
+
+        if 't_kld' in metrics:
+            pairs['t_kld'] = [((background_file, *back), (eval_file, *ev))
+                              for back, ev in zip(_transition_windows(background_wave.shape[-1], sr), _transition_windows(eval_samples, sr))]
+
+            if transitions_save_path != None:
+                for _, (_, start, end) in pairs['t_kld']:
+                    current_time = start // sr
+                    transition_file = os.path.join(str(transitions_save_path), eval_file.split('/')[-1][:-4] + f"_{current_time}_{current_time+10}.wav")
+                    torchaudio.save(transition_file, eval_wave[:, start:end], sample_rate=sr)
+
+        if 's_t_kld' in metrics:
+            pairs['s_t_kld'] = [((eval_file, *first), (eval_file, *second))
+                                for first, second in _segment_transition_windows(eval_samples, sr)]
+
+        # Each window once, even when more than one metric uses it
+        waves = {eval_file: eval_wave}
+        if background_file != None:
+            waves[background_file] = background_wave
+
+        windows = list(dict.fromkeys(window for metric_pairs in pairs.values() for pair in metric_pairs for window in pair))
+
+        with torch.no_grad():
+            model = get_passt(device=self.device, num_threads=self.num_threads)
+
+            passt_windows = ((file, start, waves[file][:, start:end]) for file, start, end in windows)
+            probs = _passt_windows(model, passt_windows, sr, self.batch_size, PasstCache() if self.cache else None,
+                                   total=len(windows), desc='Episode PaSSt')
+
+        probs = dict(zip(windows, probs))
+
+        result = {}
+        for metric, metric_pairs in pairs.items():
+            result[metric] = _kld_stats([probs[first] for first, _ in metric_pairs], [probs[second] for _, second in metric_pairs])
+
+        if self.fad_embeddings:
+            result['fad_embeddings'] = self._vggish_embeddings(eval_wave)
+
+        return result
+
+    def frechet_distance(self, background_embeddings:np.ndarray, eval_embeddings:np.ndarray) -> float:
+        "FAD between two sets of embeddings [segments, features], e.g. the fad_embeddings of two episodes"
+        mu_background, sigma_background = self.frechet.calculate_embd_statistics(background_embeddings)
+        mu_eval, sigma_eval = self.frechet.calculate_embd_statistics(eval_embeddings)
+
+        return self.frechet.calculate_frechet_distance(mu_background, sigma_background, mu_eval, sigma_eval)
@@ -0,0 +1,27 @@
+import os
+import hashlib
+import threading
+from pathlib import Path
+
+# Content hashes of the files already hashed in this process, keyed by (path, size, mtime)
+_hashes:dict[tuple, str] = {}
+_hashes_lock = threading.Lock()
+
+def content_hash(path:str|Path) -> str:
+    "sha256 of the file content, computed once per process while the file doesn't change"
+    stat = os.stat(path)
+    key = (os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+
+    with _hashes_lock:
+        if key in _hashes:
+            return _hashes[key]
+
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as audio_file:
+        for block in iter(lambda: audio_file.read(2**20), b''):
+            sha256.update(block)
+
+    with _hashes_lock:
+        _hashes[key] = sha256.hexdigest()
+
+    return _hashes[key]
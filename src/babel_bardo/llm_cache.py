@@ -0,0 +1,129 @@
+import os
+import json
+import hashlib
+import threading
+from pathlib import Path
+
+from .constants import LLM_CACHE
+
+class LLMCache():
+    def __init__(self, cache_dir:str|Path=LLM_CACHE, max_bytes:int=256 * 2**20) -> None:
+        """On-disk cache of the LLM answers. Ollama answers deterministically for the same model, options
+        (seed included) and messages, so reruns of an experiment can reuse the answers of the first run.
+
+        Each answer is a <sha256>.json file in cache_dir, written atomically. When the cache gets bigger
+        than max_bytes the least recently used answers are removed.
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # Running size of the cache, so put doesn't stat every entry. Other processes sharing the
+        # cache aren't counted until the next eviction rescans it
+        self._bytes = sum(entry.stat().st_size for entry in self._scan())
+
+    def _scan(self) -> list[os.DirEntry]:
+        return [entry for entry in os.scandir(self.cache_dir) if entry.name.endswith('.json')]
+
+    @staticmethod
+    def key(model:str, options:dict, messages:list[dict], choices:list[str]|None=None) -> str:
+        request = {'model': model, 'options': options, 'messages': messages, 'choices': choices}
+        # sort_keys so the same request always has the same hash
+        return hashlib.sha256(json.dumps(request, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def _file(self, key:str) -> Path:
+        return self.cache_dir.joinpath(f"{key}.json")
+
+    def get(self, key:str) -> str|None:
+        file = self._file(key)
+
+        try:
+            with open(file, 'r') as json_file:
+                answer = json.load(json_file)['answer']
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.misses += 1
+            return None
+
+        # The modification time tells the eviction which answers were used last
+        try:
+            os.utime(file)
+        except FileNotFoundError:
+            # Evicted by another process since it was read
+            pass
+
+        self.hits += 1
+
+        return answer
+
+    def put(self, key:str, answer:str, prompt:str|None=None):
+        """
+            prompt: the message that got the answer, kept to train local models on the LLM answers
+                (see EmotionClassifier.from_llm_cache)
+        """
+        file = self._file(key)
+        # Other caches on the same directory may write the same key, in this process or another one
+        tmp_file = file.with_name(file.name + f".{os.getpid()}.{threading.get_ident()}.tmp")
+
+        with self._lock:
+            with open(tmp_file, 'w') as json_file:
+                json.dump({'answer': answer, 'prompt': prompt}, json_file)
+
+            size = os.path.getsize(tmp_file)
+            replaced = os.path.getsize(file) if file.exists() else 0
+
+            os.replace(tmp_file, file)
+            self._bytes += size - replaced
+
+            if self._bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Removes the least recently used answers until the cache takes 90% of max_bytes, so the
+        next puts don't have to evict again"""
+        entries = self._scan()
+        total = sum(entry.stat().st_size for entry in entries)
+        self._bytes = total
+        target = 0.9 * self.max_bytes
+
+        if total <= self.max_bytes:
+            return
+
+        for entry in sorted(entries, key=lambda entry: entry.stat().st_mtime):
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+            except FileNotFoundError:
+                # Already evicted by another process
+                continue
+
+            total -= size
+            self._bytes = total
+            if total <= target:
+                return
+
+    def entries(self):
+        "Yields every cached {'answer', 'prompt'}"
+        for entry in os.scandir(self.cache_dir):
+            if not entry.name.endswith('.json'):
+                continue
+
+            try:
+                with open(entry.path, 'r') as json_file:
+                    yield json.load(json_file)
+            except (FileNotFoundError, json.JSONDecodeError):
+                continue
+
+    def clear(self):
+        with self._lock:
+            for entry in self._scan():
+                os.remove(entry.path)
+
+            self._bytes = 0
+
+    def __str__(self):
+        return f"LLM cache: {self.hits} hits, {self.misses} misses"
@@ -1,8 +1,8 @@
 import os
 import datetime
 from pathlib import Path
+from typing import TextIO
 from tqdm import tqdm
-from copy import deepcopy
 from .ollama_api import PromptConfig
 from audiocraft.models import MusicGen
 
@@ -12,27 +12,49 @@ def clear_log(log_file:str|Path):
     if os.path.isfile(log_file):
         os.remove(log_file)
 
+def log_offset(log_file:str|Path) -> int:
+    "Size of the log, to truncate it back there when a session is resumed"
+    log_file = str(log_file)
+
+    return os.path.getsize(log_file) if os.path.isfile(log_file) else 0
+
+def truncate_log(log_file:str|Path, offset:int):
+    log_file = str(log_file)
+
+    if os.path.isfile(log_file):
+        with open(log_file, 'r+') as file:
+            file.truncate(offset)
+
 def write_log_header(log_file:str|Path, description:str, prompt_cfg:PromptConfig):
     log_file = str(log_file)
 
     with open(log_file, 'a') as file:
         file.write(f"{description} \n{str(prompt_cfg)} \n")
 
-def write_log_description(model:MusicGen, log_file:str|Path, frases:str, text_prompt:str, idx:int, start_time:int, tqdm_iter:tqdm):
-    log_file = str(log_file)
+def open_log(log_file:str|Path) -> TextIO:
+    "Opens the log once for a whole session. The caller flushes it at checkpoints and closes it"
+    return open(str(log_file), 'a')
 
-    with open(log_file, 'a') as file:
-        time = str(datetime.timedelta(seconds=start_time + idx*model.duration))
+def write_log_description(model:MusicGen, log:TextIO, frases:str, text_prompt:str, idx:int, start_time:int, tqdm_iter:tqdm):
+    "log: handle returned by open_log"
+    time = str(datetime.timedelta(seconds=start_time + idx*model.duration))
+
+    # format_dict is built on each access, a shallow copy is enough
+    f_dict = dict(tqdm_iter.format_dict)
+    f_dict.update(total=False, bar_format=False, desc='')
 
-        f_dict = deepcopy(tqdm_iter.format_dict)
-        f_dict.update(total=False, bar_format=False, desc='')
+    to_write = ""
+    try:
+        tqdm_str = tqdm.format_meter(**f_dict)
+        to_write = f"time: {time} \n" + f"dialog: \n {frases} \n" + f"text_prompt:\n {text_prompt}\n" + f"tqdm: {tqdm_str} \n" + '\n\n'
+    except:
+        print("\n Failed to log with tqdm \n")
+        to_write = f"time: {time} \n" + f"dialog: \n {frases} \n" + f"text_prompt:\n {text_prompt}\n" + '\n\n'
 
-        to_write = ""
-        try:
-            tqdm_str = tqdm.format_meter(**f_dict)
-            to_write = f"time: {time} \n" + f"dialog: \n {frases} \n" + f"text_prompt:\n {text_prompt}\n" + f"tqdm: {tqdm_str} \n" + '\n\n'
-        except:
-            print("\n Failed to log with tqdm \n")
-            to_write = f"time: {time} \n" + f"dialog: \n {frases} \n" + f"text_prompt:\n {text_prompt}\n" + '\n\n'
+    log.write(to_write)
 
-        file.write(to_write)
\ No newline at end of file
+def write_log_deadline_report(log_file:str|Path, report:str):
+    log_file = str(log_file)
+
+    with open(log_file, 'a') as file:
+        file.write(f"Live session report: \n{report} \n")
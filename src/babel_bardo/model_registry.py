@@ -0,0 +1,89 @@
+import copy
+import threading
+from collections import OrderedDict
+
+import torch
+from audiocraft.models import MusicGen
+
+# Weights loaded in this process, keyed by (name, device), least recently used first
+_weights:OrderedDict[tuple, MusicGen] = OrderedDict()
+# Models handed out, keyed by (name, device, generation params). They share the weights above
+_models:dict[tuple, MusicGen] = {}
+
+_max_bytes:int|None = None
+_lock = threading.RLock()
+
+def _model_bytes(model:MusicGen) -> int:
+    modules = [model.lm, model.compression_model]
+    return sum(p.numel() * p.element_size() for module in modules for p in module.parameters())
+
+def loaded_bytes() -> int:
+    "Memory used by the weights in the registry"
+    with _lock:
+        return sum(_model_bytes(model) for model in _weights.values())
+
+def set_memory_cap(max_bytes:int|None):
+    """Caps the memory used by the registry weights. The least recently used weights are evicted
+    when a new model doesn't fit. None removes the cap"""
+    global _max_bytes
+
+    with _lock:
+        _max_bytes = max_bytes
+        _enforce_cap()
+
+def _enforce_cap(keep:tuple|None=None):
+    if _max_bytes == None:
+        return
+
+    for weights_key in list(_weights.keys()):
+        if loaded_bytes() <= _max_bytes:
+            return
+
+        if weights_key != keep:
+            evict(*weights_key)
+
+def get_model(name:str, device:str|None=None, **generation_params) -> MusicGen:
+    """Returns a MusicGen with the given generation params, loading its weights only the first time
+    they are used in the process. Models with the same name and device share the same weights.
+
+    Parameters:
+        name (str): MusicGen pretrained name, e.g. 'facebook/musicgen-large'.
+        device (str or None): Device of the weights, None lets audiocraft choose it.
+        generation_params: Passed to MusicGen.set_generation_params.
+    """
+    with _lock:
+        weights_key = (name, device)
+        key = (name, device, tuple(sorted(generation_params.items())))
+
+        if weights_key not in _weights:
+            _weights[weights_key] = MusicGen.get_pretrained(name, device=device)
+            _enforce_cap(keep=weights_key)
+
+        _weights.move_to_end(weights_key)
+
+        if key not in _models:
+            # A shallow copy shares the lm and compression model, but has its own generation params
+            model = copy.copy(_weights[weights_key])
+            model.set_generation_params(**generation_params)
+            _models[key] = model
+
+        return _models[key]
+
+def evict(name:str, device:str|None=None):
+    """Drops the weights of a model and every model using them from the registry.
+    The memory is only released once no one else holds a reference to them"""
+    with _lock:
+        _weights.pop((name, device), None)
+
+        for key in list(_models.keys()):
+            if key[:2] == (name, device):
+                del _models[key]
+
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+def clear():
+    "Evicts every model in the registry"
+    with _lock:
+        for weights_key in list(_weights.keys()):
+            evict(*weights_key)
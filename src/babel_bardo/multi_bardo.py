@@ -0,0 +1,137 @@
+import random
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+import numpy as np
+import torch
+
+from .bardo import Bardo
+from .transcript_iter import TranscriptIter
+from .prompt_pipeline import transcript_windows
+from .audio_sink import AudioSink
+from .token_archive import TokenArchiveWriter
+from .music_gen_bypass import generate_bypass, generate_continuation_bypass, encodec_tailfade
+from .constants import *
+from .log import clear_log, write_log_header, open_log, write_log_description
+from .templates import BardoTemplate
+
+from audiocraft.models import MusicGen
+
+from tqdm import tqdm
+
+class MultiBardo():
+    def __init__(self, templates:list[BardoTemplate], model:MusicGen|None=None) -> None:
+        """Plays several templates over the same episode in lock-step. Each window, every template asks
+        its own Ollama chat for a prompt (concurrently) and MusicGen continues all of them in a single
+        batch (B = number of templates), so comparing N templates takes about one generation pass.
+
+        The templates must share the video, the excerpt and the language.
+        All templates are sampled from the same RNG stream, seeded with the first template seed, so
+        the results aren't the same as running each template on its own with the same seed.
+
+        Unlike Bardo.play there are no checkpoints, session trace or offline decoding: a crash
+        loses every template of the batch.
+        """
+        assert len(templates) > 0
+
+        first = templates[0]
+        for template in templates[1:]:
+            assert (template.video_id, template.start_time, template.end_time, template.language) == \
+                (first.video_id, first.start_time, first.end_time, first.language), \
+                "MultiBardo templates must share the video, start_time, end_time and language"
+
+        self.bardos = [Bardo(first, model)]
+        self.model = self.bardos[0].model
+
+        for template in templates[1:]:
+            self.bardos.append(Bardo(template, self.model))
+
+        # Each Bardo seeds the global RNGs, the batch uses the first seed
+        self.seed = self.bardos[0].seed
+        torch.manual_seed(self.seed)
+        random.seed(self.seed)
+        np.random.seed(self.seed)
+
+    def play(self):
+        first = self.bardos[0]
+        first._parser()
+
+        t_iter = TranscriptIter(first.t.video_id, start_time=first.t.start_time, end_time=first.t.end_time, language=first.t.language, cache_dir=first.t.transcripts_cache)
+        iter(t_iter)
+        overlap = self.model.duration - self.model.extend_stride
+
+        sinks = []
+        archives = []
+
+        for bardo in self.bardos:
+            clear_log(bardo.t.log_file)
+            write_log_header(bardo.t.log_file, bardo.t.log_header, bardo.t.prompt_config)
+
+            sinks.append(AudioSink(bardo.t.generated_audio_file_no_ext, self.model.sample_rate, channels=self.model.audio_channels))
+            archives.append(TokenArchiveWriter(bardo.t.token_archive_no_ext, self.model.name, self.model.sample_rate, self.model.frame_rate, self.seed))
+
+        previous_tokens = None
+        names = ', '.join(bardo.t.bardo_name for bardo in self.bardos)
+
+        tqdm_iter = tqdm(transcript_windows(t_iter), total=len(t_iter), desc=f"Generating Songs For Video {t_iter.video_id} ({names})")
+
+        # One worker per template, so the LLM requests of a window run concurrently.
+        # Each log is opened once for the whole session
+        with ThreadPoolExecutor(max_workers=len(self.bardos)) as executor, ExitStack() as stack:
+            logs = [stack.enter_context(open_log(bardo.t.log_file)) for bardo in self.bardos]
+
+            for idx, frases in tqdm_iter:
+                prompt_start = perf_counter()
+                text_prompts = list(executor.map(lambda bardo: bardo._text_prompt(frases), self.bardos))
+                prompt_time = perf_counter() - prompt_start
+
+                for bardo, text_prompt in zip(self.bardos, text_prompts):
+                    tqdm.write(f"\nGenerating idx {idx} for {bardo.t.bardo_name} \nText Prompt: {text_prompt}")
+
+                generation_start = perf_counter()
+
+                if idx == 0:
+                    current_tokens = generate_bypass(
+                        self.model,
+                        descriptions=text_prompts,
+                        progress=True
+                    )
+                else:
+                    previous_overlap = previous_tokens[:, :, -int(overlap*self.model.frame_rate):]
+
+                    current_tokens = generate_continuation_bypass(
+                        self.model,
+                        previous_overlap,
+                        descriptions=text_prompts,
+                        prompt_sample_rate = self.model.sample_rate,
+                        progress=True
+                    )
+
+                generation_time = perf_counter() - generation_start
+
+                # Decode every template at once, with the same crossfade used by Bardo.play
+                decode_start = perf_counter()
+
+                if idx == 0:
+                    current_wavs = self.model.generate_audio(current_tokens)[:, :, :-CROSSFADE_DURATION*self.model.sample_rate]
+                else:
+                    current_wavs = encodec_tailfade(self.model, CROSSFADE_DURATION, previous_tokens, current_tokens)
+
+                decode_time = perf_counter() - decode_start
+
+                for b, bardo in enumerate(self.bardos):
+                    write_log_description(self.model, logs[b], frases, text_prompts[b], idx, bardo.t.start_time, tqdm_iter)
+
+                    sinks[b].write(current_wavs[b:b+1])
+                    archives[b].append(current_tokens[b:b+1], idx, text_prompts[b], self.model.duration, timings={
+                        'llm': prompt_time,
+                        'generation': generation_time,
+                        'decode': decode_time,
+                    })
+
+                previous_tokens = current_tokens
+
+        for sink, archive in zip(sinks, archives):
+            sink.close(strategy="loudness", loudness_compressor=True)
+            archive.close()
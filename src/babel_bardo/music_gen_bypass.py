@@ -1,9 +1,27 @@
 import typing as tp
+from contextlib import contextmanager
 
 import torch 
 
 from audiocraft.models import MusicGen
 
+from .conditioning_cache import conditioning_cache
+
+@contextmanager
+def generation_duration(model:MusicGen, duration:float|None):
+    """Temporarily changes the duration generated by the model. None keeps the current one."""
+    if duration == None:
+        yield
+        return
+
+    default_duration = model.duration
+    model.duration = duration
+
+    try:
+        yield
+    finally:
+        model.duration = default_duration
+
 def generate_bypass(model:MusicGen, descriptions: tp.List[str], progress: bool = False) -> torch.Tensor:
     """Generate tokens [B, K, T] conditioned on text.
 
@@ -11,6 +29,9 @@ def generate_bypass(model:MusicGen, descriptions: tp.List[str], progress: bool =
         descriptions (list of str): A list of strings used as text conditioning.
         progress (bool, optional): Flag to display progress of the generation process. Defaults to False.
     """
+    # Repeated descriptions reuse their T5 embeddings
+    conditioning_cache(model)
+
     attributes, prompt_tokens = model._prepare_tokens_and_attributes(descriptions, None)
     assert prompt_tokens is None
     tokens = model._generate_tokens(attributes, prompt_tokens, progress)
@@ -36,6 +57,9 @@ def generate_continuation_bypass(model:MusicGen, prompt_tokens: torch.Tensor, pr
     if descriptions is None:
         descriptions = [None] * len(prompt_tokens)
 
+    # Repeated descriptions reuse their T5 embeddings
+    conditioning_cache(model)
+
     attributes, _ = model._prepare_tokens_and_attributes(descriptions, None)
     assert prompt_tokens is not None
     tokens = model._generate_tokens(attributes, prompt_tokens, progress)
@@ -57,4 +81,45 @@ def encodec_tailfade(model:MusicGen, fade_duration:int, tokens1, tokens2):
     # Clip audio_fade duration from the beggining and end of tokens2_render
     tokens2_render = tokens2_render[:, :, audio_fade:-audio_fade]
 
-    return tokens2_render
\ No newline at end of file
+    return tokens2_render
+
+def encodec_tailfade_batch(model:MusicGen, fade_duration:int, tokens_iter:tp.Iterable[torch.Tensor], batch_size:int=8) -> tp.Iterator[torch.Tensor]:
+    """Decodes a sequence of segments ([1, K, T] each) yielding the same audio segments Bardo.play
+    gets in the generation loop: the first one without its last fade_duration seconds, and the
+    next ones with encodec_tailfade. The decoder inputs are batched along the batch dimension.
+
+    Consecutive decoder inputs with the same length (all of them, unless a window was shortened)
+    are decoded together, in batches of at most batch_size segments.
+    """
+    assert fade_duration * 2 <= model.duration # fade_duration * 2 can't be greater than model duration
+
+    tokens_fade = fade_duration * 2 * model.frame_rate
+    audio_fade = fade_duration * model.sample_rate
+
+    def decode(batch:list[torch.Tensor]) -> tp.Iterator[torch.Tensor]:
+        wavs = model.generate_audio(torch.cat([tokens for tokens, _ in batch], 0))
+
+        for wav, first in zip(wavs, [first for _, first in batch]):
+            wav = wav[None]
+            # The first segment has no context, the next ones clip the context and the crossfade
+            yield wav[:, :, :-audio_fade] if first else wav[:, :, audio_fade:-audio_fade]
+
+    previous_tokens = None
+    batch = [] # list of (decoder input, is first segment)
+
+    for tokens in tokens_iter:
+        if previous_tokens == None:
+            render = (tokens, True)
+        else:
+            # Same input as in encodec_tailfade
+            render = (torch.cat((previous_tokens[:, :, -tokens_fade:], tokens), 2), False)
+
+        if len(batch) > 0 and (len(batch) == batch_size or batch[-1][0].shape != render[0].shape):
+            yield from decode(batch)
+            batch = []
+
+        batch.append(render)
+        previous_tokens = tokens
+
+    if len(batch) > 0:
+        yield from decode(batch)
\ No newline at end of file
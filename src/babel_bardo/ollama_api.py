@@ -1,43 +1,363 @@
 import os
 import json
-import requests
+import math
+import random
 from enum import Enum
+from collections import deque
+from time import perf_counter, sleep
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+
+from .constants import OLLAMA_MODEL
+from .llm_cache import LLMCache
 
 class OllamaType(Enum):
     NONE = -1
     CHAT = 0
 
 class PromptConfig():
-    def __init__(self, setup:str="", start:str="", end:str="",) -> None:
+    def __init__(self, setup:str="", start:str="", end:str="", choices:list[str]|None=None) -> None:
         """
         "setup" will be sent to Ollama to teach it the task it needs to perform.
         "start" and "end" will be positioned at the beggining and end of the Ollama answer.
         If OllamaType.NONE, "start" and "end" will be positioned at the beggining and end of the dialog.
+        "choices" are the only valid answers, if the task has a closed set of them. A streamed answer
+        stops as soon as it matches one of them.
         """
         self.setup = setup
         self.start = start
         self.end = end
+        self.choices = choices
 
     def __str__(self):
-        return f"prompt start: {self.start}\nprompt setup:{self.setup}\nprompt end: {self.end}\n"
+        return f"prompt start: {self.start}\nprompt setup:{self.setup}\nprompt end: {self.end}\nprompt choices: {self.choices}\n"
+
+class CircuitBreaker():
+    def __init__(self, threshold:int=3, cooldown:float=60) -> None:
+        """Stops calling a server that keeps failing. After threshold failed requests in a row the
+        breaker opens and every call is refused for cooldown seconds. Then a single trial call is let
+        through (half-open): if it works the breaker closes, if it fails it opens again.
+        """
+        self.threshold = threshold
+        self.cooldown = cooldown
+
+        self.failures = 0
+        self.opened_at = None
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at != None and perf_counter() - self.opened_at < self.cooldown
+
+    def allow(self) -> bool:
+        return not self.is_open
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+
+        if self.failures >= self.threshold:
+            self.opened_at = perf_counter()
+
+class ModelTiers():
+    def __init__(self, models:list[str], budget:float|None=None, percentile:float=90, window:int=10,
+                 min_samples:int=3, probe_every:int=5, recover_ratio:float=0.8) -> None:
+        """Picks the model of each request from models, ordered from the best (and slowest) to the fastest.
+
+        When the percentile of the last window latencies of the current model is over budget (seconds),
+        the next model is used. While on a fallback, every probe_every requests go to the previous model,
+        and it is used again if the probe took at most recover_ratio * budget. With budget=None only
+        the first model is used.
+        """
+        self.models = list(models)
+        self.budget = budget
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.probe_every = probe_every
+        self.recover_ratio = recover_ratio
+
+        self.tier = 0
+        self.latencies = [deque(maxlen=window) for _ in models]
+        self._since_switch = 0
+
+    def choose(self) -> int:
+        "Tier of the next request"
+        if self.tier > 0 and self._since_switch > 0 and self._since_switch % self.probe_every == 0:
+            return self.tier - 1
+
+        return self.tier
+
+    def record(self, tier:int, seconds:float):
+        "Latency of an answered request of tier, math.inf for a failed one"
+        self.latencies[tier].append(seconds)
+        self._since_switch += 1
+
+        if self.budget == None:
+            return
+
+        if tier < self.tier:
+            # A probe of a better model
+            if seconds <= self.recover_ratio * self.budget:
+                self._switch(tier)
+            return
+
+        # Failures count as twice the budget, an infinite latency would make the percentile nan
+        latencies = np.minimum(self.latencies[tier], 2 * self.budget)
+        too_slow = len(latencies) >= self.min_samples and np.percentile(latencies, self.percentile) > self.budget
+
+        if too_slow and tier + 1 < len(self.models):
+            self._switch(tier + 1)
+
+    def _switch(self, tier:int):
+        print(f"OLLAMA SWITCHING FROM {self.models[self.tier]} TO {self.models[tier]}")
+        self.tier = tier
+        self._since_switch = 0
+        # Old latencies of the new tier don't tell how it is doing now
+        self.latencies[tier].clear()
 
 class OllamaChat():
-    def __init__(self, seed:int, window_size:int=20):
+    def __init__(self, seed:int, window_size:int=20, connect_timeout:float=5, read_timeout:float=300, deadline:float|None=None,
+                 max_retries:int=3, backoff:float=0.5, max_backoff:float=8, breaker_threshold:int=3, breaker_cooldown:float=60,
+                 stream:bool=False, cache:LLMCache|None=None, history:str='sliding', evict_block:int|None=None,
+                 models:list[str]|None=None, latency_budget:float|None=None):
         """
             window_size: size of the chat history (system role messages are not counted)
+            history: how the history is kept within window_size
+                sliding: drops the oldest message each time a new one doesn't fit
+                block: drops the evict_block oldest messages at once (half the window by default), so
+                    between evictions every request extends the previous one and Ollama can reuse the
+                    evaluated prompt instead of evaluating the whole history again
+            connect_timeout, read_timeout: seconds to wait for the connection and for each read of the answer.
+                The first read waits for Ollama to load the model, which takes minutes for the big ones
+            deadline: seconds each send may take, retries and streaming included, None for no limit.
+                Live mode sets it to the window budget, see OllamaEngine.set_latency_budget
+            max_retries: retries after the first failed request, waiting backoff*2^retry seconds
+                (with jitter, at most max_backoff) between them
+            breaker_threshold, breaker_cooldown: see CircuitBreaker
+            stream: if True the answer is read as Ollama's NDJSON chunks, so it can stop early (see send)
+                and the time to first token is known
+            cache: if given, answers are looked up there before calling Ollama, see LLMCache
+            models, latency_budget: the model tiers, the first one is the primary model (OLLAMA_MODEL alone
+                by default). When the requests take longer than latency_budget the next one is used, see ModelTiers
+
+        Requests go through a keep-alive session, so each window reuses the same connection.
+        When the server can't answer, send returns the previous answer instead of stalling the play loop.
         """
         self.seed = seed
         self.window_size = window_size +1 # +1 to accout for the system message (task prompt)
         self.ollama_addres = os.environ['OLLAMA_ADDRES']
         self.chat_state = [] #list of dicts containing the chat history
 
+        assert history in ('sliding', 'block'), f"Unknown history strategy {history}"
+        self.history = history
+        # Even, so questions and answers are evicted in pairs
+        self.evict_block = evict_block if evict_block != None else max(2, window_size // 2 // 2 * 2)
+
+        self.timeout = (connect_timeout, read_timeout)
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_cooldown)
+        self.last_answer = "" # returned when the server fails
+        self.stream = stream
+        self.last_stats = {} # latency stats of the last request, see _stats
+        self.cache = cache
+        self.tiers = ModelTiers([OLLAMA_MODEL] if models == None else models, latency_budget)
+
+        self.session = requests.Session()
+        # The pipelined worker and the play loop may share the chat, keep a couple of connections
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=2))
+
     def _append_message(self, message):
         self.chat_state.append(message)
 
         if len(self.chat_state) > self.window_size:
-            del self.chat_state[1] # Never delete the prompt message
+            # Never delete the prompt message
+            if self.history == 'block':
+                del self.chat_state[1:1+self.evict_block]
+            else:
+                del self.chat_state[1]
+
+    def _post(self, url:str, payload:dict, deadline_at:float|None=None, timeout:tuple|None=None) -> requests.Response|None:
+        """Posts with retries and exponential backoff, returns None if every try failed or
+        deadline_at (a perf_counter time) passed"""
+        timeout = self.timeout if timeout == None else timeout
+
+        for retry in range(self.max_retries + 1):
+            if not self.breaker.allow():
+                print("OLLAMA CIRCUIT BREAKER OPEN, skipping request")
+                return None
+
+            if deadline_at != None:
+                remaining = deadline_at - perf_counter()
+
+                if remaining <= 0:
+                    print("OLLAMA DEADLINE EXCEEDED, giving up")
+                    return None
 
-    def send(self, prompt:str, setup:bool=False) -> str:
+                # No single wait may outlive the deadline
+                try_timeout = (min(timeout[0], remaining), min(timeout[1], remaining))
+            else:
+                try_timeout = timeout
+
+            try:
+                res = self.session.post(url, json=payload, timeout=try_timeout, stream=self.stream)
+                res.raise_for_status()
+                self.breaker.record_success()
+                return res
+            except requests.RequestException as e:
+                print("OLLAMA REQUEST EXCEPTION: ", e)
+                self.breaker.record_failure()
+
+            if retry < self.max_retries:
+                # Exponential backoff with jitter, so retries don't hit a struggling server in lock-step
+                delay = min(self.max_backoff, self.backoff * 2**retry)
+                delay = random.uniform(delay / 2, delay)
+
+                if deadline_at != None and perf_counter() + delay >= deadline_at:
+                    print("OLLAMA DEADLINE EXCEEDED, giving up")
+                    return None
+
+                sleep(delay)
+
+        return None
+
+    def _stats(self, start:float, first_token:float|None, res_dict:dict, tokens:int, stopped_early:bool=False) -> dict:
+        end = perf_counter()
+
+        # Ollama's own counters are only in the final chunk, an early stop never gets it
+        tokens = res_dict.get('eval_count', tokens)
+        if 'eval_duration' in res_dict:
+            generation_time = res_dict['eval_duration'] / 1e9
+        else:
+            generation_time = end - first_token if first_token != None else 0
+
+        # Prompt tokens Ollama had to evaluate, the ones reused from its cache aren't counted
+        prompt_tokens = res_dict.get('prompt_eval_count', None)
+        prompt_eval = res_dict['prompt_eval_duration'] / 1e9 if 'prompt_eval_duration' in res_dict else None
+
+        return {
+            'ttft': first_token - start if first_token != None else None,
+            'prompt_tokens': prompt_tokens,
+            'prompt_eval': prompt_eval,
+            'tokens': tokens,
+            'tokens_per_second': tokens / generation_time if generation_time > 0 else None,
+            'total': end - start,
+            'stopped_early': stopped_early,
+        }
+
+    @staticmethod
+    def _complete_choice(content:str, choices:list[str]) -> str|None:
+        "Returns the choice content already answers, unless a longer choice could still follow"
+        answer = content.strip().strip('\"\'.!').lower()
+
+        if answer == "":
+            return None
+
+        longer = [choice for choice in choices if choice.lower().startswith(answer) and choice.lower() != answer]
+        matches = [choice for choice in choices if choice.lower() == answer]
+
+        return matches[0] if len(matches) > 0 and len(longer) == 0 else None
+
+    def _read_answer(self, res:requests.Response, start:float) -> str|None:
+        """Reads a whole answer. Returns None, as a failed request, if the body breaks or is malformed"""
+        try:
+            res_dict = json.loads(res.content.decode('utf-8'))
+            content = res_dict['message']['content']
+
+            if not isinstance(content, str):
+                raise ValueError(f"Unexpected content {content}")
+        except (requests.RequestException, ValueError, KeyError, TypeError) as e:
+            print("OLLAMA ANSWER EXCEPTION: ", e)
+            self.breaker.record_failure()
+            return None
+
+        self.last_stats = self._stats(start, None, res_dict, 0)
+
+        return content
+
+    def _read_stream(self, res:requests.Response, start:float, choices:list[str]|None, deadline_at:float|None=None) -> str|None:
+        """Reads the NDJSON chunks of a streamed answer. Returns None, as a failed request, if the stream
+        breaks, has a malformed chunk, ends without its final chunk or deadline_at passes"""
+        content = ""
+        first_token = None
+        chunks = 0
+        final = {}
+        stopped_early = False
+
+        try:
+            for line in res.iter_lines():
+                if deadline_at != None and perf_counter() > deadline_at:
+                    print("OLLAMA DEADLINE EXCEEDED while streaming")
+                    self.breaker.record_failure()
+                    return None
+
+                if not line:
+                    continue
+
+                chunk = json.loads(line)
+                if not isinstance(chunk, dict):
+                    raise ValueError(f"Unexpected chunk {line}")
+
+                piece = chunk.get('message', {}).get('content', "")
+
+                if piece != "":
+                    if first_token == None:
+                        first_token = perf_counter()
+
+                    content += piece
+                    chunks += 1
+
+                if chunk.get('done', False):
+                    final = chunk
+                    break
+
+                choice = self._complete_choice(content, choices) if choices != None else None
+                if choice != None:
+                    # Closing the response drops the connection, and Ollama stops generating
+                    content = choice
+                    stopped_early = True
+                    break
+        except (requests.RequestException, ValueError) as e:
+            print("OLLAMA STREAM EXCEPTION: ", e)
+            self.breaker.record_failure()
+            return None
+        finally:
+            res.close()
+
+        if not final.get('done', False) and not stopped_early:
+            # A truncated answer must not be used, nor cached
+            print("OLLAMA STREAM ENDED WITHOUT ITS FINAL CHUNK")
+            self.breaker.record_failure()
+            return None
+
+        self.last_stats = self._stats(start, first_token, final, chunks, stopped_early)
+
+        return content
+
+    def preload(self) -> bool:
+        """Loads the primary model in Ollama, so the first window doesn't pay for it.
+        A chat without messages only loads the model and keeps it for keep_alive"""
+        url = f"http://{self.ollama_addres}/api/chat"
+        payload = {"model": self.tiers.models[0], "messages": [], "stream": False, "keep_alive": 300}
+
+        # Loading a big model takes much longer than answering with it
+        res = self._post(url, payload, timeout=(self.timeout[0], max(self.timeout[1], 300)))
+
+        if res != None:
+            res.close()
+
+        return res != None
+
+    def send(self, prompt:str, setup:bool=False, choices:list[str]|None=None) -> str:
+        """Sends prompt and returns the answer. With stream=True and choices, the answer is cut as soon
+        as it matches one of the choices, e.g. Bardo0's emotion, without waiting for the trailing tokens.
+        """
 
         if setup:
             self.chat_state.append({"role": "system", "content": prompt})
@@ -45,9 +365,10 @@ class OllamaChat():
             self._append_message({"role": "user", "content": prompt})
 
         url = f"http://{self.ollama_addres}/api/chat"
+        tier = self.tiers.choose()
         payload = {
-            "model": "llama3.1:70b",
-            "stream": False,
+            "model": self.tiers.models[tier],
+            "stream": self.stream,
             "keep_alive":300,
             "options": {
                 "seed": self.seed,
@@ -56,26 +377,48 @@ class OllamaChat():
             },
             "messages": self.chat_state
         }
-        headers = {}
 
-        # Try calling the API at most 5 times
-        count = 0
-        fail = True
-        while fail == True and count < 5:
-            try:
-                res = requests.post(url, json=payload, headers=headers)
-                fail = False
-            except Exception as e:
-                print("OLLAMA REQUEST EXCEPTION: ", e)
-                fail == True
-                count += 1
+        start = perf_counter()
+        res_message = None
+        self.last_stats = {}
 
-        if fail == False:
-            res_dict = json.loads(res.content.decode('utf-8'))
-            res_message = res_dict['message']['content']
+        if self.cache != None:
+            # A streamed answer with choices may be cut short, so the choices are part of the request
+            cache_key = LLMCache.key(payload['model'], payload['options'], payload['messages'], choices if self.stream else None)
+            res_message = self.cache.get(cache_key)
+
+            if res_message != None:
+                self.last_stats = {'cached': True, 'total': perf_counter() - start}
+
+        if res_message == None:
+            # Requests refused by the open breaker never reach the model
+            reached_model = self.breaker.allow()
+            deadline_at = start + self.deadline if self.deadline != None else None
+            res = self._post(url, payload, deadline_at)
 
+            if res != None:
+                res_message = self._read_stream(res, start, choices, deadline_at) if self.stream else self._read_answer(res, start)
+
+            if res_message != None and self.cache != None:
+                self.cache.put(cache_key, res_message, prompt=prompt)
+
+            # Cached answers don't say anything about the model latency, and a failed request
+            # is as bad as one over any budget
+            if res_message != None:
+                self.tiers.record(tier, perf_counter() - start)
+            elif reached_model:
+                self.tiers.record(tier, math.inf)
+
+        self.last_stats['model'] = payload['model']
+        self.last_stats['tier'] = tier
+
+        if res_message != None:
             self._append_message({"role": "assistant", "content": res_message})
 
+            if not setup:
+                self.last_answer = res_message
+
             return res_message
         else:
-            return ""
\ No newline at end of file
+            print("OLLAMA FAILED, reusing the previous answer")
+            return self.last_answer
@@ -0,0 +1,317 @@
+import re
+import json
+import math
+import random
+import argparse
+import threading
+from time import sleep, perf_counter
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Keywords of the rule-based answers, checked in order. Calm when nothing matches
+EMOTION_KEYWORDS = {
+    "Agitated": ["attack", "fight", "run", "kill", "blood", "battle", "sword", "hit", "damage", "initiative"],
+    "Suspenseful": ["door", "dark", "quiet", "quietly", "hear", "shadow", "trap", "strange", "wait", "listen"],
+    "Happy": ["laugh", "tavern", "gold", "party", "drink", "friend", "song", "win", "reward", "celebrate"],
+}
+
+DESCRIPTIONS = {
+    "Happy": "A cheerful folk tune with a lively fiddle, bouncing lute and hand drums, for a festive tavern.",
+    "Calm": "A calm orchestral piece with soft strings and a gentle harp, for an adventure in a quiet forest.",
+    "Agitated": "A fast orchestral battle theme with pounding war drums, aggressive brass and racing strings.",
+    "Suspenseful": "A tense, dark ambient piece with low drones, sparse piano notes and distant metallic hits.",
+}
+
+class OllamaStub():
+    DISTRIBUTIONS = ('constant', 'normal', 'lognormal', 'uniform')
+
+    def __init__(self, host:str='127.0.0.1', port:int=0, latency:float=0.5, jitter:float=0.1, distribution:str='normal',
+                 tokens_per_second:float=20, prompt_tokens_per_second:float=500, error_rate:float=0, hang_rate:float=0,
+                 hang_seconds:float=300, drop_rate:float=0, answers:list[str]|None=None, seed:int=0) -> None:
+        """Local stand-in for the Ollama /api/chat endpoint, streaming and non-streaming, so the play loop
+        can be tested and load tested without an Ollama server.
+
+        Each request waits latency (sampled from distribution, with jitter as its standard deviation or
+        half range) plus the time to evaluate the prompt tokens that aren't a prefix of the previous
+        request, like Ollama's prompt cache does. Then the answer is generated at tokens_per_second.
+
+        Failures are injected with the given probabilities: error_rate answers HTTP 500, hang_rate waits
+        hang_seconds before answering (to hit the client timeouts) and drop_rate closes the connection
+        without an answer.
+
+        The answers are scripted (answers, in a loop) or rule-based on the template setup: an emotion
+        word for Bardo0, the dialog itself for the translation templates, a description for Bardo2 and
+        a description or 'CONTINUE.' for Bardo3.
+
+        Use it as a context manager and point OLLAMA_ADDRES to its address:
+            with OllamaStub(latency=2) as ollama:
+                os.environ['OLLAMA_ADDRES'] = ollama.address
+        """
+        assert distribution in self.DISTRIBUTIONS, f"Unknown latency distribution {distribution}"
+
+        self.latency = latency
+        self.jitter = jitter
+        self.distribution = distribution
+        self.tokens_per_second = tokens_per_second
+        self.prompt_tokens_per_second = prompt_tokens_per_second
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self.drop_rate = drop_rate
+        self.answers = answers
+        self.random = random.Random(seed)
+
+        self.stats = {'requests': 0, 'errors': 0, 'hangs': 0, 'drops': 0, 'cancelled': 0}
+
+        self._previous_messages = [] # prompt of the last request, to simulate the prompt cache
+        self._previous_emotion = None # to decide the Bardo3 'CONTINUE.' answers
+        self._lock = threading.Lock()
+
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def address(self) -> str:
+        host, port = self._server.server_address
+        return f"{host}:{port}"
+
+    def sample_latency(self) -> float:
+        if self.distribution == 'constant':
+            return self.latency
+
+        if self.distribution == 'normal':
+            return max(0, self.random.gauss(self.latency, self.jitter))
+
+        if self.distribution == 'uniform':
+            return max(0, self.random.uniform(self.latency - self.jitter, self.latency + self.jitter))
+
+        # lognormal with the given mean and standard deviation, a long right tail like real servers
+        sigma2 = math.log(1 + (self.jitter / self.latency)**2) if self.latency > 0 else 0
+        mu = math.log(self.latency) - sigma2 / 2 if self.latency > 0 else -math.inf
+        return self.random.lognormvariate(mu, math.sqrt(sigma2)) if self.latency > 0 else 0
+
+    @staticmethod
+    def count_tokens(text:str) -> int:
+        "Rough token count, about 4/3 tokens per word"
+        return math.ceil(len(text.split()) * 4 / 3)
+
+    def _prompt_tokens(self, messages:list[dict]) -> int:
+        "Tokens that need evaluation, the common prefix with the previous request is cached"
+        cached = 0
+        for previous, message in zip(self._previous_messages, messages):
+            if previous != message:
+                break
+            cached += 1
+
+        self._previous_messages = messages
+
+        return sum(self.count_tokens(message['content']) for message in messages[cached:])
+
+    @staticmethod
+    def emotion(text:str) -> str:
+        words = set(re.findall(r"[a-z]+", text.lower()))
+
+        for emotion, keywords in EMOTION_KEYWORDS.items():
+            if len(words.intersection(keywords)) > 0:
+                return emotion
+
+        return "Calm"
+
+    def answer(self, messages:list[dict]) -> str:
+        if self.answers != None:
+            return self.answers[self.stats['requests'] % len(self.answers)]
+
+        setup = messages[0]['content'] if len(messages) > 0 and messages[0]['role'] == 'system' else ""
+        last = messages[-1] if len(messages) > 0 else {'role': 'user', 'content': ""}
+
+        if last['role'] == 'system':
+            return "Understood."
+
+        emotion = self.emotion(last['content'])
+        previous_emotion = self._previous_emotion
+        self._previous_emotion = emotion
+
+        if "emotions" in setup:
+            return emotion
+
+        if "translate" in setup:
+            return last['content']
+
+        if "CONTINUE." in setup and emotion == previous_emotion:
+            return "CONTINUE."
+
+        return DESCRIPTIONS[emotion]
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1' # keep-alive, like Ollama
+
+            def _send_json(self, status:int, body:dict):
+                data = json.dumps(body).encode('utf-8')
+
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _write_chunk(self, chunk:dict):
+                data = (json.dumps(chunk) + '\n').encode('utf-8')
+                self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+                self.wfile.flush()
+
+            def do_POST(self):
+                if self.path != '/api/chat':
+                    self._send_json(404, {'error': f"{self.path} not found"})
+                    return
+
+                payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                messages = payload.get('messages', [])
+                stream = payload.get('stream', True) # Ollama streams by default
+
+                with stub._lock:
+                    failure = stub.random.random()
+                    latency = stub.sample_latency()
+
+                    if failure < stub.error_rate:
+                        stub.stats['errors'] += 1
+                        failure = 'error'
+                    elif failure < stub.error_rate + stub.hang_rate:
+                        stub.stats['hangs'] += 1
+                        failure = 'hang'
+                    elif failure < stub.error_rate + stub.hang_rate + stub.drop_rate:
+                        stub.stats['drops'] += 1
+                        failure = 'drop'
+                    else:
+                        failure = None
+
+                    prompt_tokens = stub._prompt_tokens(messages)
+                    answer = stub.answer(messages)
+                    stub.stats['requests'] += 1
+
+                if failure == 'error':
+                    self._send_json(500, {'error': "injected failure"})
+                    return
+
+                if failure == 'drop':
+                    self.close_connection = True
+                    return
+
+                if failure == 'hang':
+                    sleep(stub.hang_seconds)
+
+                start = perf_counter()
+                prompt_eval = prompt_tokens / stub.prompt_tokens_per_second
+                sleep(latency + prompt_eval)
+
+                # Words and the spaces before them, roughly the way Ollama streams tokens
+                pieces = re.findall(r"\s*\S+", answer)
+                token_time = 1 / stub.tokens_per_second
+
+                final = {
+                    'model': payload.get('model', ""),
+                    'created_at': datetime.now(timezone.utc).isoformat(),
+                    'message': {'role': 'assistant', 'content': ""},
+                    'done': True,
+                    'done_reason': 'stop',
+                    'prompt_eval_count': prompt_tokens,
+                    'prompt_eval_duration': int(prompt_eval * 1e9),
+                    'eval_count': len(pieces),
+                    'eval_duration': int(len(pieces) * token_time * 1e9),
+                }
+
+                if not stream:
+                    sleep(len(pieces) * token_time)
+                    final['message']['content'] = answer
+                    final['total_duration'] = int((perf_counter() - start) * 1e9)
+                    self._send_json(200, final)
+                    return
+
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+
+                try:
+                    for piece in pieces:
+                        sleep(token_time)
+                        self._write_chunk({
+                            'model': final['model'],
+                            'created_at': datetime.now(timezone.utc).isoformat(),
+                            'message': {'role': 'assistant', 'content': piece},
+                            'done': False,
+                        })
+
+                    final['created_at'] = datetime.now(timezone.utc).isoformat()
+                    final['total_duration'] = int((perf_counter() - start) * 1e9)
+                    self._write_chunk(final)
+                    self.wfile.write(b"0\r\n\r\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client stopped reading, e.g. an early stop on a choice
+                    with stub._lock:
+                        stub.stats['cancelled'] += 1
+                    self.close_connection = True
+
+            def log_message(self, format, *args):
+                # Keep the output of the play loop clean
+                pass
+
+        return Handler
+
+    def start(self):
+        "Serves in a background thread"
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local stand-in for the Ollama /api/chat endpoint")
+
+    parser.add_argument("--host", default='127.0.0.1')
+    parser.add_argument("-p", "--port", type=int, default=11434)
+    parser.add_argument("-l", "--latency", help="Mean latency before the first token, in seconds", type=float, default=0.5)
+    parser.add_argument("-j", "--jitter", help="Latency standard deviation (half range for uniform)", type=float, default=0.1)
+    parser.add_argument("-d", "--distribution", choices=OllamaStub.DISTRIBUTIONS, default='normal')
+    parser.add_argument("-tps", "--tokens-per-second", type=float, default=20)
+    parser.add_argument("-ptps", "--prompt-tokens-per-second", type=float, default=500)
+    parser.add_argument("--error-rate", help="Probability of an HTTP 500", type=float, default=0)
+    parser.add_argument("--hang-rate", help="Probability of hanging for --hang-seconds", type=float, default=0)
+    parser.add_argument("--hang-seconds", type=float, default=300)
+    parser.add_argument("--drop-rate", help="Probability of closing the connection without answering", type=float, default=0)
+    parser.add_argument("-a", "--answers", help="File with one scripted answer per line, used in a loop", default=None)
+    parser.add_argument("-s", "--seed", type=int, default=0)
+
+    args = parser.parse_args()
+
+    answers = None
+    if args.answers != None:
+        with open(args.answers, 'r') as answers_file:
+            answers = [line.strip() for line in answers_file if line.strip() != ""]
+
+    stub = OllamaStub(args.host, args.port, latency=args.latency, jitter=args.jitter, distribution=args.distribution,
+                      tokens_per_second=args.tokens_per_second, prompt_tokens_per_second=args.prompt_tokens_per_second,
+                      error_rate=args.error_rate, hang_rate=args.hang_rate, hang_seconds=args.hang_seconds,
+                      drop_rate=args.drop_rate, answers=answers, seed=args.seed)
+
+    print(f"Ollama stub listening on {stub.address}, use: export OLLAMA_ADDRES={stub.address}")
+
+    try:
+        stub.serve_forever()
+    except KeyboardInterrupt:
+        print(stub.stats)
@@ -1,10 +1,16 @@
 import pathlib
+import threading
 
 import torch.nn as nn
 import torch
 
 from hear21passt.base import get_basic_model, get_model_passt
 
+PASST_CHECKPOINT = pathlib.Path(__file__).parent.joinpath('passt_epoch_1_acc_0.975.pth').resolve()
+
+# PaSSt models loaded in this process, keyed by (n_classes, sigmoid, device)
+_models:dict[tuple, nn.Module] = {}
+_lock = threading.Lock()
 
 class PaSSTMTG(nn.Module):
     def __init__(self, n_classes=183, sigmoid=True):
@@ -22,12 +28,54 @@ class PaSSTMTG(nn.Module):
 
         return passt_logit
 
-def get_passt(n_classes=183, sigmoid=True):
+def resolve_device(device:str|torch.device='auto') -> torch.device:
+    "'auto' is cuda when there is a GPU and cpu otherwise"
+    if device == 'auto':
+        device = 'cuda' if torch.cuda.is_available() else 'cpu'
+
+    return torch.device(device)
+
+def load_passt(n_classes=183, sigmoid=True):
+    "A new PaSSt on the cpu with the fine-tuned weights, see get_passt for the cached one"
     passt = PaSSTMTG(n_classes, sigmoid)
 
-    state_dict = pathlib.Path(__file__).parent.joinpath('passt_epoch_1_acc_0.975.pth').resolve()
-    state_dict = torch.load(state_dict)
+    try:
+        # Maps the weights file instead of reading it to memory
+        state_dict = torch.load(PASST_CHECKPOINT, map_location='cpu', mmap=True)
+    except RuntimeError:
+        # Checkpoints saved in the legacy format can't be mapped
+        state_dict = torch.load(PASST_CHECKPOINT, map_location='cpu')
 
     passt.load_state_dict(state_dict)
 
-    return passt
\ No newline at end of file
+    return passt
+
+def get_passt(n_classes=183, sigmoid=True, device:str|torch.device='auto', num_threads:int|None=None):
+    """Returns PaSSt in eval mode on device, loading it only the first time it is used in the process.
+    The model is shared by every caller, so don't train or move it.
+
+    Parameters:
+        device (str): 'cpu', 'cuda' or 'auto' (cuda when there is a GPU).
+        num_threads (int or None): torch intra-op threads for the CPU inference, None keeps torch's.
+            It is a process-wide torch setting.
+    """
+    device = resolve_device(device)
+
+    if num_threads != None and device.type == 'cpu':
+        torch.set_num_threads(num_threads)
+
+    with _lock:
+        key = (n_classes, sigmoid, str(device))
+
+        if key not in _models:
+            _models[key] = load_passt(n_classes, sigmoid).to(device).eval()
+
+        return _models[key]
+
+def clear_passt():
+    "Drops the cached PaSSt models"
+    with _lock:
+        _models.clear()
+
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
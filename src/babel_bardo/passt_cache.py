@@ -0,0 +1,119 @@
+import os
+import threading
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from .constants import PASST_CACHE
+from .file_hash import content_hash
+from .passt.passt import PASST_CHECKPOINT
+
+def passt_model_id(n_classes:int=183, sigmoid:bool=True) -> str:
+    "Identifies the PaSSt outputs, they change with the checkpoint and the model head"
+    size = os.path.getsize(PASST_CHECKPOINT)
+    return f"{PASST_CHECKPOINT.stem}_{size}_{n_classes}_{'sigmoid' if sigmoid else 'logits'}"
+
+class PasstCache():
+    def __init__(self, cache_dir:str|Path=PASST_CACHE, model_id:str|None=None) -> None:
+        """On-disk cache of the PaSSt probabilities of each audio window, so the KLD metrics don't run
+        PaSSt again on windows already seen, e.g. the original audio compared against every template.
+
+        Windows are keyed by the audio content hash, sample rate, window start and length (in samples)
+        and the model (model_id). The windows of each audio are kept in a single
+        <model_id>/<content hash>_<sr>.npz file as float16 logits, which keep the precision of the
+        probabilities near 0 and 1 that float16 probabilities would lose.
+
+        get and put work in memory, call flush to write the new windows.
+        """
+        self.model_id = passt_model_id() if model_id == None else model_id
+        self.cache_dir = Path(cache_dir).joinpath(self.model_id)
+        self.hits = 0
+        self.misses = 0
+
+        self._audios:dict[tuple, dict[str, np.ndarray]] = {} # windows of each (content hash, sr)
+        self._dirty:set[tuple] = set()
+        self._lock = threading.Lock()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _file(self, audio:tuple) -> Path:
+        audio_hash, sr = audio
+        return self.cache_dir.joinpath(f"{audio_hash}_{sr}.npz")
+
+    def _load(self, audio:tuple) -> dict[str, np.ndarray]:
+        try:
+            with np.load(self._file(audio)) as npz:
+                return {window: npz[window] for window in npz.files}
+        except (FileNotFoundError, ValueError, OSError):
+            return {}
+
+    def _windows(self, audio_file:str|Path, sr:int) -> tuple[tuple, dict[str, np.ndarray]]:
+        audio = (content_hash(audio_file), sr)
+
+        if audio not in self._audios:
+            self._audios[audio] = self._load(audio)
+
+        return audio, self._audios[audio]
+
+    def get(self, audio_file:str|Path, sr:int, start:int, length:int) -> torch.Tensor|None:
+        "PaSSt probabilities [classes] of the window, None if it isn't cached"
+        with self._lock:
+            _, windows = self._windows(audio_file, sr)
+            logits = windows.get(f"{start}_{length}")
+
+        if logits is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return self.dequantize(logits)
+
+    @staticmethod
+    def quantize(probs:torch.Tensor) -> np.ndarray:
+        "float16 logits of the probabilities, as they are stored"
+        return torch.logit(probs.detach().double().cpu(), eps=1e-7).numpy().astype(np.float16)
+
+    @staticmethod
+    def dequantize(logits:np.ndarray) -> torch.Tensor:
+        return torch.sigmoid(torch.from_numpy(logits.astype(np.float32)))
+
+    def put(self, audio_file:str|Path, sr:int, start:int, length:int, probs:torch.Tensor) -> torch.Tensor:
+        """
+            Returns the probabilities as get will return them, so the results don't depend on whether
+            the windows were already cached
+        """
+        logits = self.quantize(probs)
+
+        with self._lock:
+            audio, windows = self._windows(audio_file, sr)
+            windows[f"{start}_{length}"] = logits
+            self._dirty.add(audio)
+
+        return self.dequantize(logits)
+
+    def flush(self):
+        "Writes the audios with new windows, merged with what other processes wrote meanwhile"
+        with self._lock:
+            for audio in self._dirty:
+                windows = {**self._load(audio), **self._audios[audio]}
+                self._audios[audio] = windows
+
+                file = self._file(audio)
+                tmp_file = file.with_name(file.name + f".{os.getpid()}.tmp.npz")
+                np.savez(tmp_file, **windows)
+                os.replace(tmp_file, file)
+
+            self._dirty.clear()
+
+    def clear(self):
+        with self._lock:
+            for entry in os.scandir(self.cache_dir):
+                if entry.name.endswith('.npz'):
+                    os.remove(entry.path)
+
+            self._audios.clear()
+            self._dirty.clear()
+
+    def __str__(self):
+        return f"PaSSt cache: {self.hits} hits, {self.misses} misses"
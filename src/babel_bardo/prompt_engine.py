@@ -0,0 +1,122 @@
+from abc import ABC, abstractmethod
+from copy import deepcopy
+from time import perf_counter
+
+from .ollama_api import OllamaChat
+from .emotion_classifier import EmotionClassifier
+
+from tqdm import tqdm
+
+class PromptEngine(ABC):
+    """
+        Turns the dialog of each window into the answer Bardo places between the PromptConfig start and end.
+        Bardo builds an OllamaEngine or a DialogEngine from the template, other engines can be passed to it.
+    """
+    def __init__(self) -> None:
+        self.last_stats = {} # stats of the last answer, added to the session trace
+
+    @property
+    def uses_llm(self) -> bool:
+        "False for engines fast enough to never be skipped by the live mode"
+        return True
+
+    def setup(self, prompt:str):
+        "Receives the PromptConfig setup. Engines that don't take instructions ignore it"
+        pass
+
+    @abstractmethod
+    def answer(self, frases:str, choices:list[str]|None=None) -> str:
+        pass
+
+    def state_dict(self) -> dict|None:
+        "State needed to resume the engine right after the current window"
+        return None
+
+    def load_state_dict(self, state:dict|None):
+        pass
+
+    def set_latency_budget(self, budget:float):
+        "Seconds available for each answer in live mode"
+        pass
+
+    def warmup(self):
+        "Loads whatever the first answer would load, see Bardo.warmup"
+        pass
+
+    def __str__(self):
+        return type(self).__name__
+
+class DialogEngine(PromptEngine):
+    "Answers the dialog itself, for the templates without an LLM (OllamaType.NONE)"
+    @property
+    def uses_llm(self) -> bool:
+        return False
+
+    def answer(self, frases:str, choices:list[str]|None=None) -> str:
+        return frases
+
+class OllamaEngine(PromptEngine):
+    def __init__(self, chat:OllamaChat) -> None:
+        "Asks an Ollama chat for the answers"
+        super().__init__()
+        self.chat = chat
+
+    def setup(self, prompt:str):
+        self.chat.send(prompt, setup=True)
+
+    def answer(self, frases:str, choices:list[str]|None=None) -> str:
+        answer = self.chat.send(frases, choices=choices)
+        self.last_stats = self.chat.last_stats
+
+        if self.last_stats.get('tier', 0) > 0:
+            tqdm.write(f"Answered by the fallback model {self.last_stats['model']}")
+
+        return answer.strip('\"')
+
+    def state_dict(self) -> dict:
+        return {'chat_state': deepcopy(self.chat.chat_state)}
+
+    def load_state_dict(self, state:dict):
+        self.chat.chat_state = state['chat_state']
+
+        answers = [message['content'] for message in state['chat_state'] if message['role'] == 'assistant']
+        self.chat.last_answer = answers[-1] if len(answers) > 0 else ""
+
+    def warmup(self):
+        if not self.chat.preload():
+            print("Couldn't preload the Ollama model")
+
+    def set_latency_budget(self, budget:float):
+        # Unless the template set its own budget
+        if self.chat.tiers.budget == None:
+            self.chat.tiers.budget = budget
+
+        # A late answer is useless in live mode, the previous one is returned instead
+        if self.chat.deadline == None or self.chat.deadline > budget:
+            self.chat.deadline = budget
+
+    def __str__(self):
+        cache = f", {self.chat.cache}" if self.chat.cache != None else ""
+        return f"OllamaEngine ({', '.join(self.chat.tiers.models)}){cache}"
+
+class ClassifierEngine(PromptEngine):
+    def __init__(self, classifier:EmotionClassifier) -> None:
+        """Answers with a local classifier instead of an LLM, e.g. the Bardo0 emotion:
+            Bardo(Bardo0(...), prompt_engine=ClassifierEngine(EmotionClassifier.load()))
+        """
+        super().__init__()
+        self.classifier = classifier
+
+    @property
+    def uses_llm(self) -> bool:
+        return False
+
+    def warmup(self):
+        self.classifier.predict("")
+
+    def answer(self, frases:str, choices:list[str]|None=None) -> str:
+        start = perf_counter()
+        answer = self.classifier.predict(frases)
+        self.last_stats = {'total': perf_counter() - start}
+
+        return answer
@@ -0,0 +1,106 @@
+import queue
+import threading
+from typing import Any, Callable, Iterator, Tuple
+
+from .transcript_iter import TranscriptIter
+
+# Sentinel put in the queue by the worker when the transcript is over
+_DONE = object()
+
+class _WorkerError():
+    def __init__(self, exception:BaseException) -> None:
+        self.exception = exception
+
+def transcript_windows(t_iter:TranscriptIter, start_idx:int=0) -> Iterator[Tuple[int, str]]:
+    """Yields (idx, frases) for each window of an already started TranscriptIter.
+    start_idx is the idx of its next window, when it was resumed."""
+    idx = start_idx
+    while True:
+        try:
+            frases, _ = next(t_iter)
+        except StopIteration:
+            return
+
+        yield idx, frases
+        idx += 1
+
+def sequential_prompts(t_iter:TranscriptIter, prompt_fn:Callable[[str], Any], start_idx:int=0) -> Iterator[Tuple[int, str, Any]]:
+    """Yields (idx, frases, prompt_fn(frases)) computing each prompt only when it is requested."""
+    for idx, frases in transcript_windows(t_iter, start_idx):
+        yield idx, frases, prompt_fn(frases)
+
+class PromptPipeline():
+    def __init__(self, t_iter:TranscriptIter, prompt_fn:Callable[[str], Any], lookahead:int=1, start_idx:int=0) -> None:
+        """Computes the text prompts of the next windows in a background worker, so the LLM request
+        for window idx+1 runs while MusicGen is generating window idx.
+
+        Parameters:
+            t_iter (TranscriptIter): An already started iterator (iter() was called on it).
+            prompt_fn (Callable): Receives the window frases and returns the text prompt. It is only
+                called from the worker thread, one window at a time and in order.
+            lookahead (int): How many computed prompts may wait in the queue.
+            start_idx (int): idx of the next window of t_iter, when it was resumed.
+
+        Yields:
+            (idx, frases, prompt_fn(frases)) in the transcript order.
+        """
+        assert lookahead >= 1
+
+        self.t_iter = t_iter
+        self.prompt_fn = prompt_fn
+        self.start_idx = start_idx
+        self.queue = queue.Queue(maxsize=lookahead)
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._worker, name="bardo-prompt-pipeline", daemon=True)
+
+    def _put(self, item) -> bool:
+        "Blocks until there is space in the queue, giving up if the pipeline was closed"
+        while not self._stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+
+        return False
+
+    def _worker(self):
+        try:
+            for idx, frases in transcript_windows(self.t_iter, self.start_idx):
+                if self._stop.is_set():
+                    return
+
+                text_prompt = self.prompt_fn(frases)
+
+                if not self._put((idx, frases, text_prompt)):
+                    return
+        except BaseException as e:
+            self._put(_WorkerError(e))
+        finally:
+            self._put(_DONE)
+
+    def __iter__(self) -> Iterator[Tuple[int, str, Any]]:
+        if not self._thread.is_alive():
+            self._thread.start()
+
+        try:
+            while True:
+                item = self.queue.get()
+
+                if item is _DONE:
+                    return
+
+                if isinstance(item, _WorkerError):
+                    raise item.exception
+
+                yield item
+        finally:
+            self.close()
+
+    def close(self):
+        "Stops the worker. A prompt request that is already running is allowed to finish"
+        self._stop.set()
+
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join()
@@ -0,0 +1,168 @@
+from time import perf_counter
+
+class WindowPlan():
+    def __init__(self, level:str, duration:float|None=None) -> None:
+        """
+            level: one of DeadlineScheduler.LEVELS
+            duration: MusicGen generation duration for the window, None keeps the model's default
+        """
+        self.level = level
+        self.duration = duration
+
+    @property
+    def use_llm(self) -> bool:
+        return self.level == 'normal'
+
+    @property
+    def continue_only(self) -> bool:
+        "Sends text_prompt=None, the same path used for Bardo3's 'CONTINUE.' answers"
+        return self.level in ('continue', 'shorten')
+
+    def __str__(self):
+        duration = '' if self.duration == None else f" ({self.duration:.1f}s)"
+        return f"{self.level}{duration}"
+
+class DeadlineScheduler():
+    # Degradation levels, from the best to the cheapest one
+    LEVELS = ('normal', 'reuse_prompt', 'continue', 'shorten')
+
+    def __init__(self, window_budget:float, full_duration:float, overlap:float, min_new_duration:float=1.0, safety_margin:float=0.1, smoothing:float=0.5) -> None:
+        """Keeps a live session on the wall-clock. Window idx must be done by start + (idx+1)*window_budget,
+        so time saved by fast windows is kept for the slow ones and late windows make the next ones degrade.
+
+        Before each window the LLM and MusicGen latencies (exponential moving averages) are used to pick
+        the first level in LEVELS that fits in the time left:
+            normal: asks the LLM for a new prompt
+            reuse_prompt: skips the LLM and reuses the previous prompt
+            continue: skips the LLM and continues the previous tokens with text_prompt=None
+            shorten: like continue, but generating fewer new seconds (at least min_new_duration)
+
+        Parameters:
+            window_budget (float): Wall-clock seconds available for each window.
+            full_duration (float): MusicGen generation duration (model.duration).
+            overlap (float): Seconds of the previous tokens used as prompt for the continuations.
+            min_new_duration (float): Minimum new seconds generated by a shortened window.
+            safety_margin (float): Fraction of the time left kept as a margin for estimation errors.
+            smoothing (float): Weight of the newest measure in the moving averages.
+        """
+        self.window_budget = window_budget
+        self.full_duration = full_duration
+        self.overlap = overlap
+        self.min_new_duration = min_new_duration
+        self.safety_margin = safety_margin
+        self.smoothing = smoothing
+
+        self.llm_latency = None # seconds per request
+        self.ttm_rate = {'text': None, 'none': None} # seconds per new generated second
+
+        self.idx = -1
+        self.plan = None
+        self.previous_prompt = None
+        self.windows = [] # one dict per finished window
+
+    def _smooth(self, current:float|None, value:float) -> float:
+        if current == None:
+            return value
+
+        return self.smoothing * value + (1 - self.smoothing) * current
+
+    def start(self, start_idx:int=0):
+        """Starts the session clock. start_idx is the first window, when a session is resumed"""
+        self.idx = start_idx - 1
+        self.t0 = perf_counter() - start_idx * self.window_budget
+
+    def deadline(self, idx:int) -> float:
+        return self.t0 + (idx + 1) * self.window_budget
+
+    def time_left(self, idx:int) -> float:
+        return self.deadline(idx) - perf_counter()
+
+    def _new_duration(self, idx:int, duration:float) -> float:
+        if idx == 0:
+            return duration
+
+        return duration - self.overlap
+
+    def _ttm_estimate(self, idx:int, duration:float, text:bool) -> float:
+        rate = self.ttm_rate['text'] if text else self.ttm_rate['none']
+
+        if rate == None:
+            rate = self.ttm_rate['text'] if self.ttm_rate['text'] != None else 0
+
+        return rate * self._new_duration(idx, duration)
+
+    def next_plan(self, has_llm:bool=True) -> WindowPlan:
+        """Plans the next window. has_llm is False for templates that don't ask the LLM for prompts"""
+        self.idx += 1
+        idx = self.idx
+
+        budget = self.time_left(idx) * (1 - self.safety_margin)
+        llm = self.llm_latency if has_llm and self.llm_latency != None else 0
+        can_continue = idx > 0
+
+        if llm + self._ttm_estimate(idx, self.full_duration, True) <= budget:
+            self.plan = WindowPlan('normal')
+        elif self.previous_prompt != None and self._ttm_estimate(idx, self.full_duration, True) <= budget:
+            self.plan = WindowPlan('reuse_prompt')
+        elif can_continue and self._ttm_estimate(idx, self.full_duration, False) <= budget:
+            self.plan = WindowPlan('continue')
+        elif can_continue:
+            # Generate as many new seconds as the estimates say that fit
+            rate = self.ttm_rate['none'] if self.ttm_rate['none'] != None else self.ttm_rate['text']
+            new_duration = budget / rate if rate else self.min_new_duration
+            new_duration = max(self.min_new_duration, min(new_duration, self.full_duration - self.overlap))
+            self.plan = WindowPlan('shorten', duration=self.overlap + new_duration)
+        else:
+            # Nothing to reuse or continue from at the first window
+            self.plan = WindowPlan('normal')
+
+        return self.plan
+
+    def record_llm(self, seconds:float):
+        self.llm_latency = self._smooth(self.llm_latency, seconds)
+
+    def record_ttm(self, seconds:float, duration:float, text:bool):
+        """
+            seconds: wall-clock time spent generating and decoding the window
+            duration: generation duration used for the window
+            text: False if the window was generated with text_prompt=None
+        """
+        key = 'text' if text else 'none'
+        rate = seconds / self._new_duration(self.idx, duration)
+        self.ttm_rate[key] = self._smooth(self.ttm_rate[key], rate)
+
+    def finish(self, text_prompt:str|None) -> bool:
+        """Closes the current window, returning True if it met its deadline"""
+        lateness = -self.time_left(self.idx)
+        hit = lateness <= 0
+
+        self.previous_prompt = text_prompt
+        self.windows.append({
+            'idx': self.idx,
+            'level': self.plan.level,
+            'duration': self.plan.duration,
+            'hit': hit,
+            'lateness': lateness,
+        })
+
+        return hit
+
+    def report(self) -> dict:
+        hits = sum(window['hit'] for window in self.windows)
+        levels = {level: sum(window['level'] == level for window in self.windows) for level in self.LEVELS}
+        lateness = [window['lateness'] for window in self.windows]
+
+        return {
+            'windows': len(self.windows),
+            'hits': hits,
+            'misses': len(self.windows) - hits,
+            'levels': levels,
+            'max_lateness': max(lateness) if len(lateness) > 0 else 0,
+            'llm_latency': self.llm_latency,
+            'ttm_rate': dict(self.ttm_rate),
+        }
+
+    def __str__(self):
+        report = self.report()
+        levels = ', '.join(f"{level}: {count}" for level, count in report['levels'].items())
+        return f"deadline hits: {report['hits']}/{report['windows']}, misses: {report['misses']}, max lateness: {report['max_lateness']:.2f}s \nlevels: {levels}"
@@ -0,0 +1,95 @@
+import os
+import json
+
+import numpy as np
+import torch
+
+def synchronize(device:torch.device|str):
+    "Waits for the queued CUDA work, so perf_counter measures it"
+    if torch.device(device).type == 'cuda':
+        torch.cuda.synchronize(device)
+
+class SessionTrace():
+    def __init__(self, trace_file:str, summary_file:str, resume_idx:int|None=None) -> None:
+        """Machine readable timings of a play session. Each window is a line of trace_file (JSONL) with
+        the seconds spent on each stage, and close() writes the p50/p95/max of each stage to summary_file.
+
+        If resume_idx is given the trace of the crashed session is continued instead of overwritten,
+        dropping the windows after resume_idx (the checkpoint), since they will run again.
+        """
+        self.trace_file = str(trace_file)
+        self.summary_file = str(summary_file)
+
+        if resume_idx != None:
+            self._truncate(resume_idx)
+
+        # Kept open for the whole session, one flushed line per window
+        self._file = open(self.trace_file, 'a' if resume_idx != None else 'w')
+
+    def _truncate(self, last_idx:int):
+        "Keeps the windows up to last_idx"
+        if not os.path.isfile(self.trace_file):
+            return
+
+        windows = [window for window in self._load() if window['idx'] <= last_idx]
+
+        tmp_file = self.trace_file + '.tmp'
+        with open(tmp_file, 'w') as trace_file:
+            trace_file.writelines(json.dumps(window) + '\n' for window in windows)
+
+        os.replace(tmp_file, self.trace_file)
+
+    def record(self, idx:int, **values):
+        self._file.write(json.dumps({'idx': idx, **values}) + '\n')
+        self._file.flush()
+
+    def _load(self) -> list[dict]:
+        with open(self.trace_file, 'r') as trace_file:
+            return [json.loads(line) for line in trace_file if line.strip() != '']
+
+    def summary(self) -> dict:
+        "p50, p95, max and mean of every numeric stage of the session"
+        windows = self._load()
+
+        stages = {}
+        for window in windows:
+            for stage, value in window.items():
+                if stage == 'idx' or isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+
+                stages.setdefault(stage, []).append(value)
+
+        summary = {'windows': len(windows)}
+        for stage, values in stages.items():
+            values = np.array(values, dtype=np.float64)
+            summary[stage] = {
+                'p50': float(np.percentile(values, 50)),
+                'p95': float(np.percentile(values, 95)),
+                'max': float(values.max()),
+                'mean': float(values.mean()),
+            }
+
+        return summary
+
+    def close(self) -> dict:
+        self._file.close()
+
+        summary = self.summary()
+
+        tmp_file = self.summary_file + '.tmp'
+        with open(tmp_file, 'w') as json_file:
+            json.dump(summary, json_file, indent=4)
+        os.replace(tmp_file, self.summary_file)
+
+        return summary
+
+def format_summary(summary:dict) -> str:
+    lines = [f"{'stage':<20} {'p50':>10} {'p95':>10} {'max':>10}"]
+
+    for stage, stats in summary.items():
+        if not isinstance(stats, dict):
+            continue
+
+        lines.append(f"{stage:<20} {stats['p50']:>10.3f} {stats['p95']:>10.3f} {stats['max']:>10.3f}")
+
+    return '\n'.join(lines)
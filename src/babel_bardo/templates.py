@@ -4,7 +4,7 @@ from abc import ABC, abstractmethod
 import random
 
 from babel_bardo.ollama_api import PromptConfig, OllamaType
-from babel_bardo.constants import SEED
+from babel_bardo.constants import SEED, TRANSCRIPTS_CACHE, OLLAMA_MODEL, OLLAMA_FALLBACK_MODEL, EMOTIONS
 
 # Bardo and fit_audio_in_video will follow the following directory structure:
 # |_original
@@ -18,9 +18,13 @@ from babel_bardo.constants import SEED
 # bardoX
 # |_logs
 # .  |_bardoX_VID-N.txt
+# .  |_bardoX_VID-N_trace.jsonl
 # |_audios
 # .  |_generated
 # .  .  |_bardoX_VID-N.wav
+# .  |_tokens
+# .  .  |_bardoX_VID-N.tokens
+# .  .  |_bardoX_VID-N.json
 # |_videos
 # .  |_generated
 # .  .  |_bardoX_VID-N.mp4
@@ -42,6 +46,18 @@ class BardoTemplate(ABC):
         self.start_time = 0
         self.end_time = None
 
+        # Where TranscriptIter looks for <video_id>.json before calling the YouTube API
+        self.transcripts_cache = TRANSCRIPTS_CACHE
+        # If True the Ollama answers are cached on disk and reused by reruns, see LLMCache
+        self.llm_cache = True
+        # OllamaChat history strategy, 'sliding' reproduces the paper runs. Set it to 'block' to keep
+        # Ollama's evaluated prompt between evictions, see OllamaChat
+        self.chat_history = 'sliding'
+        # Ollama models, from the primary to the fallbacks, and the latency that makes Bardo fall back.
+        # None falls back only in live mode, when the LLM alone takes longer than the window budget
+        self.llm_models = [OLLAMA_MODEL, OLLAMA_FALLBACK_MODEL]
+        self.llm_latency_budget = None
+
         # PATHS
         self.root_path = root_path
 
@@ -71,6 +87,7 @@ class BardoTemplate(ABC):
 
         self.bardo_audios_path = os.path.join(self.bardo_path, 'audios')
         self.generated_audios_path = os.path.join(self.bardo_audios_path, 'generated')
+        self.tokens_path = os.path.join(self.bardo_audios_path, 'tokens')
 
         self.bardo_videos_path = os.path.join(self.bardo_path, 'videos')
         self.generated_videos_path = os.path.join(self.bardo_videos_path, 'generated')
@@ -80,6 +97,7 @@ class BardoTemplate(ABC):
     def dirs_to_create(self) -> list[str]:
         return [
             self.generated_audios_path,
+            self.tokens_path,
             self.original_audios_path,
             self.original_vocals_path,
             self.original_videos_path,
@@ -99,6 +117,18 @@ class BardoTemplate(ABC):
     def log_file(self) -> str:
         return os.path.join(self.log_path, f"{self.bardo_name}_{self.video_id}.txt")
 
+    @property
+    def trace_file(self) -> str:
+        return os.path.join(self.log_path, f"{self.bardo_name}_{self.video_id}_trace.jsonl")
+
+    @property
+    def trace_summary_file(self) -> str:
+        return os.path.join(self.log_path, f"{self.bardo_name}_{self.video_id}_trace_summary.json")
+
+    @property
+    def checkpoint_file(self) -> str:
+        return os.path.join(self.log_path, f"{self.bardo_name}_{self.video_id}.ckpt")
+
     @property
     def original_vocals_file(self) -> str:
         return os.path.join(self.original_vocals_path, f"vocals_{self.video_id}.wav")
@@ -115,6 +145,10 @@ class BardoTemplate(ABC):
     def generated_audio_file_no_ext(self) -> str:
         return os.path.join(self.generated_audios_path, f"{self.bardo_name}_{self.video_id}")
 
+    @property
+    def token_archive_no_ext(self) -> str:
+        return os.path.join(self.tokens_path, f"{self.bardo_name}_{self.video_id}")
+
     @property
     def original_video_file_name(self) -> str:
         return f"{self.video_id}.mp4"
@@ -182,7 +216,7 @@ class Bardo0(BardoTemplate):
         task_setup = "You will classify each dialog into one of the following emotions: Happy, Calm, Agitated, or Suspenseful. Your answer will be just one word, that is, one of those emotions."
         prompt_setup = self.common_setup + task_setup
 
-        return PromptConfig(start=start, setup=prompt_setup)
+        return PromptConfig(start=start, setup=prompt_setup, choices=EMOTIONS)
 
     @property
     def log_header(self) -> str:
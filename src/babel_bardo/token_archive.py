@@ -0,0 +1,177 @@
+import os
+import json
+import argparse
+
+import numpy as np
+import torch
+from audiocraft.models import MusicGen
+
+from .audio_sink import AudioSink
+from .model_registry import get_model
+from .music_gen_bypass import encodec_tailfade_batch
+from .constants import CROSSFADE_DURATION
+
+class TokenArchiveWriter():
+    def __init__(self, archive_no_ext:str, model_name:str, sample_rate:int, frame_rate:int, seed:int) -> None:
+        """Saves the EnCodec codes ([1, K, T]) of each generated segment, so the session audio can be
+        re-rendered later (see rerender) without running the language model again.
+
+        A session is stored as two files:
+            <archive_no_ext>.tokens: the codes of every segment, as int16, one after the other
+            <archive_no_ext>.json: the session and per segment metadata (prompt, seed, timings and the
+                offset of the segment in the .tokens file)
+        """
+        self.archive_no_ext = str(archive_no_ext)
+        self.tokens_file = self.archive_no_ext + '.tokens'
+        self.meta_file = self.archive_no_ext + '.json'
+
+        self.meta = {
+            'model': model_name,
+            'sample_rate': sample_rate,
+            'frame_rate': frame_rate,
+            'seed': seed,
+            'segments': [],
+        }
+
+        self._file = None # opened by the first append, so a resumed archive isn't truncated
+        self._offset = 0 # in int16 elements
+
+    def _write_meta(self):
+        tmp_file = self.meta_file + '.tmp'
+
+        with open(tmp_file, 'w') as json_file:
+            json.dump(self.meta, json_file, indent=4)
+
+        os.replace(tmp_file, self.meta_file)
+
+    def append(self, tokens:torch.Tensor, idx:int, prompt:str|None, duration:float, timings:dict|None=None):
+        """
+            tokens: codes of one segment, [1, K, T]
+            idx: window of the segment
+            prompt: text prompt used to generate the segment
+            duration: generation duration used for the segment
+            timings: seconds spent on each step of the segment
+        """
+        assert tokens.dim() == 3 and tokens.shape[0] == 1, "tokens should be [B=1, K, T]"
+
+        # EnCodec codebooks have 2048 entries, so the codes fit in int16
+        codes = tokens[0].detach().cpu().numpy().astype(np.int16)
+
+        if self._file == None:
+            self._file = open(self.tokens_file, 'wb')
+
+        self._file.write(codes.tobytes())
+        self._file.flush()
+
+        n_q, length = codes.shape
+
+        self.meta['segments'].append({
+            'idx': idx,
+            'offset': self._offset,
+            'n_q': n_q,
+            'length': length,
+            'prompt': prompt,
+            'duration': duration,
+            'timings': timings if timings != None else {},
+        })
+        self._offset += codes.size
+
+        self._write_meta()
+
+    def state_dict(self) -> dict:
+        return {
+            'segments': len(self.meta['segments']),
+            'offset': self._offset,
+        }
+
+    def load_state_dict(self, state:dict):
+        """Reopens the archive of a crashed session, dropping the segments after state was taken"""
+        with open(self.meta_file, 'r') as json_file:
+            self.meta = json.load(json_file)
+
+        self.meta['segments'] = self.meta['segments'][:state['segments']]
+        self._offset = state['offset']
+
+        self._file = open(self.tokens_file, 'r+b')
+        self._file.truncate(self._offset * np.dtype(np.int16).itemsize)
+        self._file.seek(0, os.SEEK_END)
+
+        self._write_meta()
+
+    def close(self):
+        if self._file != None:
+            self._file.close()
+            self._file = None
+
+class TokenArchive():
+    def __init__(self, archive_no_ext:str) -> None:
+        """Reads a session saved by TokenArchiveWriter, memory-mapping its .tokens file"""
+        self.archive_no_ext = str(archive_no_ext)
+
+        with open(self.archive_no_ext + '.json', 'r') as json_file:
+            self.meta = json.load(json_file)
+
+        self.segments = self.meta['segments']
+        self.codes = np.memmap(self.archive_no_ext + '.tokens', dtype=np.int16, mode='r')
+
+    def __len__(self):
+        return len(self.segments)
+
+    def __getitem__(self, i:int) -> torch.Tensor:
+        "Tokens [1, K, T] of the i-th segment"
+        segment = self.segments[i]
+        start = segment['offset']
+        end = start + segment['n_q'] * segment['length']
+
+        codes = np.array(self.codes[start:end]).reshape(segment['n_q'], segment['length'])
+
+        return torch.from_numpy(codes.astype(np.int64))[None]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+def rerender(archive_no_ext:str, out_file_no_ext:str, model:MusicGen|None=None, crossfade_duration:int=CROSSFADE_DURATION,
+             strategy:str|None='loudness', loudness_compressor:bool=True, loudness_headroom_db:float=14,
+             max_file_duration:float|None=None, batch_size:int=8) -> list[str]:
+    """Rebuilds the session audio from a token archive, with the same crossfade used by Bardo.play.
+    Only the EnCodec decoder runs, batch_size segments at a time, so it takes seconds instead of
+    the full language model time.
+
+    Returns:
+        The rendered files.
+    """
+    archive = TokenArchive(archive_no_ext)
+
+    if model == None:
+        model = get_model(archive.meta['model'])
+
+    sink = AudioSink(out_file_no_ext, model.sample_rate, channels=model.audio_channels, max_file_duration=max_file_duration)
+
+    tokens_iter = (tokens.to(model.device) for tokens in archive)
+
+    for current_wav in encodec_tailfade_batch(model, crossfade_duration, tokens_iter, batch_size=batch_size):
+        sink.write(current_wav)
+
+    return sink.close(strategy=strategy, loudness_compressor=loudness_compressor, loudness_headroom_db=loudness_headroom_db)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Re-renders the audio of a Bardo session from its token archive")
+
+    parser.add_argument("archive", help="Token archive path, without extension")
+    parser.add_argument("out", help="Output audio path, without extension")
+    parser.add_argument("-cf", "--CrossfadeDuration", help="Crossfade duration in seconds", type=int, default=CROSSFADE_DURATION)
+    parser.add_argument("-s", "--Strategy", help="Normalization strategy (loudness, peak, rms, clip or none)", default='loudness')
+    parser.add_argument("-lh", "--LoudnessHeadroom", help="Loudness headroom in dB", type=float, default=14)
+    parser.add_argument("-nc", "--NoCompressor", help="Disables the loudness compressor", action='store_true')
+    parser.add_argument("-bs", "--BatchSize", help="How many segments are decoded at once", type=int, default=8)
+
+    args = parser.parse_args()
+
+    strategy = None if args.Strategy == 'none' else args.Strategy
+
+    files = rerender(args.archive, args.out, crossfade_duration=args.CrossfadeDuration, strategy=strategy,
+                     loudness_compressor=not args.NoCompressor, loudness_headroom_db=args.LoudnessHeadroom,
+                     batch_size=args.BatchSize)
+
+    print("Rendered", *files)
@@ -3,6 +3,7 @@ import math
 import json
 import os
 import shutil
+from pathlib import Path
 
 from .constants import TRANSCRIPTS_CACHE
 
@@ -10,7 +11,8 @@ from youtube_transcript_api import YouTubeTranscriptApi as ytta
 
 class TranscriptIter():
 
-    def __init__(self, video_id:str, language:str='en', tgt_duration:int=30, join:bool=True, start_time:int=0, end_time:int|None=None) -> None:
+    def __init__(self, video_id:str, language:str='en', tgt_duration:int=30, join:bool=True, start_time:int=0, end_time:int|None=None,
+                 cache_dir:str|Path=TRANSCRIPTS_CACHE) -> None:
         """An iterator that goes over the video transcription returning the frases 
         that fit in the interval specified by the tgt_duration parameter 
         e.g., if tgt_duration = 30, the first iteration will return frases between 0 and 30s.
@@ -22,6 +24,8 @@ class TranscriptIter():
             join (bool): If false return a list of frases, returns a single string otherwise.
             start (int): From which second the iterator should start
             end (int or none): Until which second the iterator should go. If none it will go until the end.
+            cache_dir (str or Path): Where the transcripts are cached. A <video_id>.json placed there is used
+                instead of the YouTube API, e.g. a synthetic transcript for the benchmarks.
 
         Yields:
             frases (Tuple[str, float]): A tuple containing a the frases and the duration from the start of the first frase to the end of the last one.
@@ -32,6 +36,7 @@ class TranscriptIter():
         self.join = join
         self.start_time = start_time
         self.end_time = end_time
+        self.cache_dir = Path(cache_dir)
 
         self.iter_len = -1 # init as an invalid value, gets setted at __iter__
 
@@ -53,12 +58,12 @@ class TranscriptIter():
     def _load_transcript(self) -> None:
         "Gets transcript from cache if it exists, else pulls it from the YouTube API. Transcription is stored in self.transcription"
 
-        if not os.path.isdir(TRANSCRIPTS_CACHE):
-            os.makedirs(TRANSCRIPTS_CACHE)
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
 
-        cached_transcripts = os.listdir(TRANSCRIPTS_CACHE)
+        cached_transcripts = os.listdir(self.cache_dir)
         transcript_file = self.video_id + ".json"
-        transcript_file_path = TRANSCRIPTS_CACHE.joinpath(transcript_file)
+        transcript_file_path = self.cache_dir.joinpath(transcript_file)
 
         if(transcript_file in cached_transcripts):
             with open(transcript_file_path, 'r') as json_file:
@@ -83,6 +88,17 @@ class TranscriptIter():
         print("Cleared transcript cache")
         shutil.rmtree(TRANSCRIPTS_CACHE)
 
+    def state_dict(self) -> dict:
+        "Position of the iterator, to resume it with load_state_dict after calling iter()"
+        return {
+            'frase_pointer': self.frase_pointer,
+            'current_tgt': self.current_tgt,
+        }
+
+    def load_state_dict(self, state:dict) -> None:
+        self.frase_pointer = state['frase_pointer']
+        self.current_tgt = state['current_tgt']
+
     def __iter__(self) -> Tuple[List[str], float]:
         self._load_transcript()
 
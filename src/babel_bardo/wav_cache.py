@@ -0,0 +1,92 @@
+import os
+import shutil
+import threading
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import ffmpeg
+
+from .constants import WAV_CACHE
+from .file_hash import content_hash
+
+def _convert(audio_file:str, out_path:str, sr:int, channels:int, segment:int):
+    "ffmpeg conversion of audio_file to out_path (a directory of segment seconds long wavs if segment > 0)"
+    # Converts to a temporary path and moves it in place, so the cache never has half converted audios
+    tmp_path = f"{out_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    stream = ffmpeg.input(audio_file)
+
+    if segment > 0:
+        os.makedirs(tmp_path, exist_ok=True)
+        stream = ffmpeg.output(stream, os.path.join(tmp_path, '%03d.wav'), f='segment', segment_time=segment, ar=sr, ac=channels)
+    else:
+        tmp_path += '.wav'
+        stream = ffmpeg.output(stream, tmp_path, ar=sr, ac=channels)
+
+    ffmpeg.run(stream, overwrite_output=True, quiet=True)
+
+    try:
+        os.replace(tmp_path, out_path)
+    except OSError:
+        # Another process converted it first
+        shutil.rmtree(tmp_path) if os.path.isdir(tmp_path) else os.remove(tmp_path)
+
+class WavCache():
+    def __init__(self, cache_dir:str|Path=WAV_CACHE, workers:int|None=None) -> None:
+        """Persistent cache of audios converted to wav, so the metrics convert an original audio only
+        once across templates and reruns. Conversions are keyed by the content hash of the source and
+        the sample rate, channels and segmentation, and only the requested audios are converted.
+
+        get converts a single audio, convert_many converts several in a pool of workers processes
+        (None uses one per CPU).
+        """
+        self.cache_dir = Path(cache_dir)
+        self.workers = workers
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def path(self, audio_file:str|Path, sr:int=32000, channels:int=1, segment:int=0) -> Path:
+        "Where the conversion of audio_file is cached: a wav, or a directory of wavs if segment > 0"
+        name = f"{content_hash(audio_file)}_{sr}_{channels}"
+        return self.cache_dir.joinpath(f"{name}_{segment}" if segment > 0 else f"{name}.wav")
+
+    def get(self, audio_file:str|Path, sr:int=32000, channels:int=1, segment:int=0) -> Path:
+        """
+            Returns the audio_file converted to sr and channels, converting it if it isn't cached.
+            segment: when > 0, the audio is split in segment seconds long wavs and their directory is returned
+        """
+        return self.convert_many([audio_file], sr, channels, segment)[0]
+
+    def convert_many(self, audio_files:list[str|Path], sr:int=32000, channels:int=1, segment:int=0) -> list[Path]:
+        "get for several audios, converting the ones that aren't cached in parallel"
+        out_paths = [self.path(audio_file, sr, channels, segment) for audio_file in audio_files]
+        to_convert = {out_path: audio_file for audio_file, out_path in zip(audio_files, out_paths) if not out_path.exists()}
+
+        self.hits += len(out_paths) - len(to_convert)
+        self.misses += len(to_convert)
+
+        if len(to_convert) == 1:
+            # Not worth starting the processes
+            (out_path, audio_file), = to_convert.items()
+            _convert(str(audio_file), str(out_path), sr, channels, segment)
+        elif len(to_convert) > 1:
+            with ProcessPoolExecutor(self.workers) as executor:
+                futures = [executor.submit(_convert, str(audio_file), str(out_path), sr, channels, segment)
+                           for out_path, audio_file in to_convert.items()]
+
+                for future in futures:
+                    future.result()
+
+        return out_paths
+
+    def clear(self):
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_dir():
+                shutil.rmtree(entry.path)
+            else:
+                os.remove(entry.path)
+
+    def __str__(self):
+        return f"Wav cache: {self.hits} hits, {self.misses} misses"
@@ -0,0 +1,60 @@
+import os
+
+import soundfile as sf
+import torch
+
+from babel_bardo.audio_sink import AudioSink
+
+SAMPLE_RATE = 10
+
+def segment(frames:int, value:float) -> torch.Tensor:
+    return torch.full((1, 1, frames), value)
+
+def test_rotates_into_files_of_max_file_duration(tmp_path):
+    sink = AudioSink(tmp_path.joinpath('session'), SAMPLE_RATE, max_file_duration=1)
+
+    sink.write(segment(15, 0.1))
+    sink.write(segment(10, 0.2))
+    files = sink.close(strategy=None)
+
+    assert [os.path.basename(file) for file in files] == ['session_000.wav', 'session_001.wav', 'session_002.wav']
+    assert [sf.info(file).frames for file in files] == [10, 10, 5]
+    assert sink.duration == 2.5
+
+    wav, _ = sf.read(files[1], dtype='float32')
+    assert abs(wav[4] - 0.1) < 1e-6
+    assert abs(wav[5] - 0.2) < 1e-6
+
+def test_resume_drops_what_was_written_after_the_checkpoint(tmp_path):
+    sink = AudioSink(tmp_path.joinpath('session'), SAMPLE_RATE, max_file_duration=1)
+    sink.write(segment(15, 0.1))
+    sink.flush()
+    state = sink.state_dict()
+
+    # Written after the checkpoint, then the session crashed
+    sink.write(segment(10, 0.9))
+    sink.flush()
+    assert os.path.isfile(sink.partial_file(2))
+
+    resumed = AudioSink(tmp_path.joinpath('session'), SAMPLE_RATE, max_file_duration=1)
+    resumed.load_state_dict(state)
+    assert not os.path.isfile(resumed.partial_file(2))
+
+    resumed.write(segment(10, 0.2))
+    files = resumed.close(strategy=None)
+
+    assert [sf.info(file).frames for file in files] == [10, 10, 5]
+
+    wav, _ = sf.read(files[1], dtype='float32')
+    assert abs(wav[4] - 0.1) < 1e-6
+    assert abs(wav[5] - 0.2) < 1e-6
+
+def test_resume_before_anything_was_written(tmp_path):
+    sink = AudioSink(tmp_path.joinpath('session'), SAMPLE_RATE)
+    state = sink.state_dict()
+
+    resumed = AudioSink(tmp_path.joinpath('session'), SAMPLE_RATE)
+    resumed.load_state_dict(state)
+    resumed.write(segment(5, 0.1))
+
+    assert [sf.info(file).frames for file in resumed.close(strategy=None)] == [5]
@@ -0,0 +1,73 @@
+from types import SimpleNamespace
+
+import pytest
+import torch
+from audiocraft.modules.conditioners import T5Conditioner
+
+from babel_bardo.conditioning_cache import ConditioningCache, conditioning_cache
+
+class TinyT5(T5Conditioner):
+    "A T5Conditioner with a character tokenizer and an embedding table instead of T5"
+    def __init__(self) -> None:
+        torch.nn.Module.__init__(self)
+        self.t5_tokenizer = SimpleNamespace(pad_token_id=0)
+        self.embedding = torch.nn.Embedding(128, 8)
+        self.encoded = 0 # texts that went through the encoder
+
+    def tokenize(self, x:list[str|None]) -> dict:
+        texts = [xi if xi != None else "" for xi in x]
+        # Every text ends with an EOS token, like T5's
+        ids = [[ord(c) % 126 + 2 for c in text] + [1] for text in texts]
+        max_length = max(len(text_ids) for text_ids in ids)
+
+        input_ids = torch.zeros((len(ids), max_length), dtype=torch.long)
+        attention_mask = torch.zeros((len(ids), max_length), dtype=torch.long)
+        for i, text_ids in enumerate(ids):
+            input_ids[i, :len(text_ids)] = torch.tensor(text_ids)
+            attention_mask[i, :len(text_ids)] = 1
+
+        return {'input_ids': input_ids, 'attention_mask': attention_mask}
+
+    def forward(self, inputs:dict) -> tuple[torch.Tensor, torch.Tensor]:
+        self.encoded += inputs['input_ids'].shape[0]
+        mask = inputs['attention_mask']
+        embeds = self.embedding(inputs['input_ids']) * mask[..., None]
+        return embeds, mask
+
+def music_gen(conditioners:dict) -> SimpleNamespace:
+    "The part of MusicGen conditioning_cache looks at"
+    condition_provider = SimpleNamespace(conditioners=torch.nn.ModuleDict(conditioners))
+    return SimpleNamespace(lm=SimpleNamespace(condition_provider=condition_provider))
+
+def test_cached_embeddings_equal_uncached_ones():
+    torch.manual_seed(0)
+    conditioner = TinyT5()
+    uncached = TinyT5()
+    uncached.load_state_dict(conditioner.state_dict())
+
+    cache = conditioning_cache(music_gen({'description': conditioner}))
+    assert isinstance(cache, ConditioningCache)
+    assert conditioning_cache(music_gen({'description': conditioner})) is cache
+
+    batches = [
+        ["A calm forest", "Battle"],
+        ["Battle", None],
+        ["A calm forest", "A much longer description of a battle"],
+        ["Battle", "Battle"],
+    ]
+
+    with torch.no_grad():
+        for batch in batches:
+            embeds, mask = conditioner(conditioner.tokenize(batch))
+            expected_embeds, expected_mask = uncached(uncached.tokenize(batch))
+
+            assert torch.equal(embeds, expected_embeds)
+            assert torch.equal(mask, expected_mask)
+
+    # Each distinct description was only encoded once
+    assert conditioner.encoded == 4
+    assert (cache.hits, cache.misses) == (4, 4)
+
+def test_models_without_a_t5_description_arent_cached():
+    assert conditioning_cache(music_gen({})) == None
+    assert conditioning_cache(music_gen({'description': torch.nn.Identity()})) == None
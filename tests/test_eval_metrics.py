@@ -0,0 +1,129 @@
+import math
+import os
+from types import SimpleNamespace
+
+import pytest
+import soundfile as sf
+import torch
+
+from babel_bardo import eval_metrics
+from babel_bardo.eval_metrics import EpisodeEvaluator, _binary_kld, get_kld, get_kld_for_segments_transitions, get_kld_for_transitions
+
+SR = 32000
+
+def loop_kld(background_probs:torch.Tensor, eval_probs:torch.Tensor) -> float:
+    "The per-class KLD loop the metrics used before _binary_kld"
+    total = 0
+
+    for background_prob, eval_prob in zip(background_probs, eval_probs):
+        background = torch.tensor([background_prob, 1 - background_prob], dtype=torch.float64)
+        eval = torch.tensor([eval_prob, 1 - eval_prob], dtype=torch.float64)
+
+        total += torch.sum(background * (background.log() - eval.log())).item()
+
+    return total
+
+def test_binary_kld_matches_the_loop():
+    torch.manual_seed(0)
+    background = torch.rand(4, 183)
+    eval = torch.rand(4, 183)
+
+    klds = _binary_kld(background, eval).sum(1)
+
+    for window in range(4):
+        assert klds[window].item() == pytest.approx(loop_kld(background[window], eval[window]), rel=1e-6)
+
+def test_binary_kld_of_saturated_probabilities():
+    eps = 1e-6
+    background = torch.tensor([[0.0, 1.0, 0.0, 1.0, 0.5, 0.3]])
+    eval = torch.tensor([[0.0, 1.0, 1.0, 0.0, 0.0, 0.3]])
+
+    klds = _binary_kld(background, eval, eps=eps)
+
+    # The loop gives nan or inf for 0 and 1, _binary_kld gives what it gives for eps and 1-eps
+    assert torch.isfinite(klds).all()
+    assert klds.sum(1).item() == pytest.approx(loop_kld(background[0].double().clamp(eps, 1 - eps), eval[0].double().clamp(eps, 1 - eps)), rel=1e-9)
+
+    # Equal distributions have no divergence
+    assert klds[0, [0, 1, 5]].abs().max().item() == pytest.approx(0, abs=1e-12)
+
+class StubPasst(torch.nn.Module):
+    "Probabilities from a few statistics of each window, remembering the windows it was given"
+    def __init__(self) -> None:
+        super().__init__()
+        torch.manual_seed(0)
+        self.linear = torch.nn.Linear(3, 16)
+        self.windows = []
+
+    def forward(self, audio:torch.Tensor) -> torch.Tensor:
+        self.windows += [(window.shape[-1], round(window.double().sum().item(), 3)) for window in audio]
+        features = torch.stack([audio.mean(1), audio.std(1), audio.abs().amax(1)], 1)
+        return torch.sigmoid(self.linear(features * 10))
+
+class PathWavCache():
+    "The audios are already mono wavs at 32KHz"
+    def get(self, audio_file:str, *args, **kwargs) -> str:
+        return audio_file
+
+@pytest.fixture
+def episode(tmp_path, monkeypatch):
+    passt = StubPasst()
+    monkeypatch.setattr(eval_metrics, 'get_passt', lambda **kwargs: passt)
+    monkeypatch.setattr(eval_metrics, 'WavCache', PathWavCache)
+    monkeypatch.setattr(eval_metrics, 'ffmpeg', SimpleNamespace(probe=lambda file: {'streams': [{'duration': sf.info(file).duration}]}))
+
+    rand = torch.Generator().manual_seed(1)
+    background_path = str(tmp_path.joinpath('original'))
+    os.makedirs(background_path)
+    background_audio = os.path.join(background_path, 'VID.wav')
+    eval_audio = str(tmp_path.joinpath('bardo_VID.wav'))
+
+    def noise(seconds:float) -> torch.Tensor:
+        "Noise with a different loudness each second, so the windows get different probabilities"
+        samples = int(SR * seconds)
+        loudness = torch.rand(math.ceil(seconds), generator=rand).repeat_interleave(SR)[:samples]
+        return (torch.rand(samples, generator=rand) - 0.5) * loudness
+
+    # Neither of them ends at a window boundary
+    sf.write(background_audio, noise(100.5).numpy(), SR, subtype='FLOAT')
+    sf.write(eval_audio, noise(92.5).numpy(), SR, subtype='FLOAT')
+
+    return SimpleNamespace(passt=passt, background_path=background_path, background_audio=background_audio, eval_audio=eval_audio)
+
+def test_episode_evaluator_matches_the_kld_functions(episode, tmp_path):
+    expected = {
+        'kld': get_kld(episode.background_path, episode.background_audio, episode.eval_audio, cache=False),
+        't_kld': get_kld_for_transitions(episode.background_path, episode.background_audio, episode.eval_audio, None, cache=False),
+        's_t_kld': get_kld_for_segments_transitions(episode.eval_audio, cache=False),
+    }
+    expected_windows = set(episode.passt.windows)
+    episode.passt.windows.clear()
+
+    result = EpisodeEvaluator(cache=False).evaluate(episode.background_path, episode.background_audio, episode.eval_audio)
+
+    # The same windows, each one evaluated once
+    assert set(episode.passt.windows) == expected_windows
+    assert len(episode.passt.windows) == len(expected_windows)
+
+    for metric in EpisodeEvaluator.METRICS:
+        assert max(expected[metric]['list']) > 1e-3
+        assert len(result[metric]['list']) == len(expected[metric]['list'])
+        assert result[metric]['list'] == pytest.approx(expected[metric]['list'], rel=1e-5)
+        assert result[metric]['mean'] == pytest.approx(expected[metric]['mean'], rel=1e-5)
+
+def test_episode_evaluator_saves_the_same_transitions(episode, tmp_path):
+    expected_path = tmp_path.joinpath('expected')
+    saved_path = tmp_path.joinpath('saved')
+    os.makedirs(expected_path)
+    os.makedirs(saved_path)
+
+    get_kld_for_transitions(episode.background_path, episode.background_audio, episode.eval_audio, str(expected_path), cache=False)
+    EpisodeEvaluator(cache=False).evaluate(episode.background_path, episode.background_audio, episode.eval_audio,
+                                           transitions_save_path=saved_path, metrics=('t_kld',))
+
+    assert sorted(os.listdir(saved_path)) == sorted(os.listdir(expected_path))
+
+    for file in os.listdir(expected_path):
+        saved, _ = sf.read(saved_path.joinpath(file), dtype='float32')
+        expected, _ = sf.read(expected_path.joinpath(file), dtype='float32')
+        assert (saved == expected).all()
@@ -0,0 +1,88 @@
+import os
+import threading
+import time
+
+from babel_bardo.llm_cache import LLMCache
+
+def test_put_and_get(tmp_path):
+    cache = LLMCache(tmp_path)
+    key = LLMCache.key('model', {'seed': 0}, [{'role': 'user', 'content': "hello"}])
+
+    assert cache.get(key) is None
+    cache.put(key, "Calm", prompt="hello")
+
+    assert cache.get(key) == "Calm"
+    assert LLMCache(tmp_path).get(key) == "Calm"
+    assert list(cache.entries()) == [{'answer': "Calm", 'prompt': "hello"}]
+
+def test_evicts_the_least_recently_used(tmp_path):
+    cache = LLMCache(tmp_path, max_bytes=10**6)
+    size = len('{"answer": "' + 'x' * 100 + '", "prompt": null}')
+    cache.max_bytes = 5 * size
+
+    for i in range(5):
+        cache.put(str(i), 'x' * 100)
+        # Distinct modification times
+        os.utime(cache._file(str(i)), (time.time() - 100 + i, time.time() - 100 + i))
+
+    # Used now, so it's the most recent one
+    assert cache.get('0') != None
+
+    cache.put('5', 'x' * 100)
+
+    assert cache.get('1') is None
+    assert cache.get('0') != None
+    assert cache.get('5') != None
+    assert cache._bytes == sum(entry.stat().st_size for entry in cache._scan())
+    assert cache._bytes <= 0.9 * cache.max_bytes
+
+def test_put_doesnt_scan_under_the_cap(tmp_path, monkeypatch):
+    cache = LLMCache(tmp_path)
+    scans = []
+    monkeypatch.setattr(cache, '_scan', lambda: scans.append(1) or [])
+
+    for i in range(10):
+        cache.put(str(i), "answer")
+
+    assert scans == []
+
+def test_clear(tmp_path):
+    cache = LLMCache(tmp_path)
+    cache.put('key', "answer")
+    cache.clear()
+
+    assert cache.get('key') is None
+    assert cache._bytes == 0
+
+def test_get_of_an_entry_evicted_while_reading(tmp_path, monkeypatch):
+    cache = LLMCache(tmp_path)
+    cache.put('key', "Calm")
+
+    def evicted(file, *args, **kwargs):
+        raise FileNotFoundError(file)
+
+    # Another process evicts the entry between the read and the touch
+    monkeypatch.setattr(os, 'utime', evicted)
+
+    assert cache.get('key') == "Calm"
+
+def test_caches_on_the_same_directory_write_concurrently(tmp_path):
+    caches = [LLMCache(tmp_path), LLMCache(tmp_path)]
+    errors = []
+
+    def put(cache:LLMCache, answer:str):
+        try:
+            for _ in range(200):
+                cache.put('key', answer)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=put, args=(cache, answer)) for cache, answer in zip(caches, ["Calm", "Happy"])]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert LLMCache(tmp_path).get('key') in ("Calm", "Happy")
+    assert [file for file in os.listdir(tmp_path) if file.endswith('.tmp')] == []
@@ -0,0 +1,43 @@
+from types import SimpleNamespace
+
+from tqdm import tqdm
+
+from babel_bardo.log import log_offset, open_log, truncate_log, write_log_description
+
+def test_truncate_log_to_the_checkpoint_offset(tmp_path):
+    log_file = tmp_path.joinpath('log.txt')
+    log_file.write_text("header\nwindow 0\n")
+
+    offset = log_offset(log_file)
+    with open(log_file, 'a') as file:
+        file.write("window 1\n")
+
+    truncate_log(log_file, offset)
+
+    assert log_file.read_text() == "header\nwindow 0\n"
+
+def test_log_offset_of_a_missing_log(tmp_path):
+    assert log_offset(tmp_path.joinpath('missing.txt')) == 0
+
+def test_session_log_is_on_disk_after_each_flush(tmp_path):
+    log_file = tmp_path.joinpath('log.txt')
+    log_file.write_text("header\n")
+    model = SimpleNamespace(duration=30)
+    tqdm_iter = tqdm(range(2), disable=True)
+
+    with open_log(log_file) as log:
+        write_log_description(model, log, "Hello there", "A calm forest", 0, 0, tqdm_iter)
+        log.flush()
+        offset = log_offset(log_file)
+
+        write_log_description(model, log, "To arms!", "A battle", 1, 0, tqdm_iter)
+        log.flush()
+
+    lines = log_file.read_text().splitlines()
+    assert lines[0] == "header"
+    assert "text_prompt:" in lines and " A calm forest" in lines and " A battle" in lines
+
+    # Truncating to a flushed offset keeps the first window only
+    truncate_log(log_file, offset)
+    assert " A battle" not in log_file.read_text().splitlines()
+    assert " A calm forest" in log_file.read_text().splitlines()
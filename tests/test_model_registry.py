@@ -0,0 +1,80 @@
+import pytest
+import torch
+
+from babel_bardo import model_registry
+from babel_bardo.bardo import Bardo
+from babel_bardo.multi_bardo import MultiBardo
+from babel_bardo.templates import Bardo1
+
+class PretrainedMusicGen():
+    "Stands in for MusicGen, counting the weights loaded with get_pretrained"
+    loads = []
+
+    def __init__(self, name:str, device:str|None) -> None:
+        self.name = name
+        self.device = device
+        self.lm = torch.nn.Linear(256, 256)
+        self.compression_model = torch.nn.Linear(256, 256)
+        self.generation_params = {}
+
+    @classmethod
+    def get_pretrained(cls, name:str, device:str|None=None) -> 'PretrainedMusicGen':
+        cls.loads.append((name, device))
+        return cls(name, device)
+
+    def set_generation_params(self, **generation_params):
+        self.generation_params = generation_params
+
+@pytest.fixture(autouse=True)
+def registry(monkeypatch):
+    monkeypatch.setattr(model_registry, 'MusicGen', PretrainedMusicGen)
+    monkeypatch.setattr(PretrainedMusicGen, 'loads', [])
+    model_registry.clear()
+    yield model_registry
+    model_registry.set_memory_cap(None)
+    model_registry.clear()
+
+def test_bardos_share_the_loaded_model(tmp_path):
+    first = Bardo(Bardo1("rpg", tmp_path, "first", translate=False))
+    second = Bardo(Bardo1("rpg", tmp_path, "second", translate=False))
+    multi = MultiBardo([Bardo1("rpg", tmp_path, "multi", translate=False), Bardo1("rpg", tmp_path, "multi", translate=False)])
+
+    assert second.model is first.model
+    assert multi.model is first.model
+    assert all(bardo.model is first.model for bardo in multi.bardos)
+    assert len(PretrainedMusicGen.loads) == 1
+
+def test_names_and_devices_get_their_own_weights(registry):
+    small = registry.get_model('small')
+    medium = registry.get_model('medium')
+    small_cpu = registry.get_model('small', device='cpu')
+
+    assert PretrainedMusicGen.loads == [('small', None), ('medium', None), ('small', 'cpu')]
+    assert small is not medium and small is not small_cpu
+    assert small.lm is not small_cpu.lm
+
+def test_generation_params_share_the_weights(registry):
+    short = registry.get_model('small', duration=10)
+    long = registry.get_model('small', duration=30)
+
+    assert short is not long
+    assert short.lm is long.lm
+    assert (short.generation_params, long.generation_params) == ({'duration': 10}, {'duration': 30})
+    assert registry.get_model('small', duration=10) is short
+    assert len(PretrainedMusicGen.loads) == 1
+
+def test_memory_cap_evicts_the_least_recently_used(registry):
+    registry.get_model('small')
+    weights_bytes = registry.loaded_bytes()
+    registry.get_model('medium')
+    # small is used again, so medium is now the least recently used
+    registry.get_model('small')
+
+    registry.set_memory_cap(2 * weights_bytes)
+    registry.get_model('large')
+
+    assert list(registry._weights.keys()) == [('small', None), ('large', None)]
+    assert registry.loaded_bytes() <= 2 * weights_bytes
+
+    registry.get_model('medium')
+    assert PretrainedMusicGen.loads.count(('medium', None)) == 2
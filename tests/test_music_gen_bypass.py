@@ -0,0 +1,49 @@
+import pytest
+import torch
+
+from babel_bardo.music_gen_bypass import encodec_tailfade, encodec_tailfade_batch
+
+class DecoderModel():
+    "The part of MusicGen used by the crossfades, with a decoder whose output depends on the previous frames"
+    duration = 4
+    frame_rate = 5
+    sample_rate = 20
+
+    def generate_audio(self, tokens:torch.Tensor) -> torch.Tensor:
+        frames = tokens.double().sum(1, keepdim=True).cumsum(2)
+        return frames.repeat_interleave(self.sample_rate // self.frame_rate, 2)
+
+def sequential(model:DecoderModel, fade_duration:int, windows:list[torch.Tensor]) -> list[torch.Tensor]:
+    "What Bardo.play decodes window by window in the generation loop"
+    wavs = [model.generate_audio(windows[0])[:, :, :-fade_duration*model.sample_rate]]
+
+    for previous_tokens, current_tokens in zip(windows, windows[1:]):
+        wavs.append(encodec_tailfade(model, fade_duration, previous_tokens, current_tokens))
+
+    return wavs
+
+@pytest.mark.parametrize("batch_size", [1, 3, 8])
+def test_batched_tailfade_matches_the_sequential_one(batch_size):
+    torch.manual_seed(0)
+    model = DecoderModel()
+    frames = model.duration * model.frame_rate
+    # The last window was shortened
+    windows = [torch.randint(0, 2048, (1, 4, frames)) for _ in range(6)] + [torch.randint(0, 2048, (1, 4, 13))]
+
+    batched = list(encodec_tailfade_batch(model, 1, iter(windows), batch_size=batch_size))
+    expected = sequential(model, 1, windows)
+
+    assert len(batched) == len(expected)
+    for wav, expected_wav in zip(batched, expected):
+        assert wav.shape == expected_wav.shape
+        assert torch.allclose(wav, expected_wav)
+
+def test_batched_tailfade_of_a_shortened_window_in_the_middle():
+    torch.manual_seed(1)
+    model = DecoderModel()
+    windows = [torch.randint(0, 2048, (1, 4, length)) for length in [20, 20, 15, 20, 20]]
+
+    batched = list(encodec_tailfade_batch(model, 1, iter(windows)))
+
+    for wav, expected_wav in zip(batched, sequential(model, 1, windows)):
+        assert torch.equal(wav, expected_wav)
@@ -0,0 +1,230 @@
+import json
+import math
+from time import perf_counter
+
+import pytest
+
+from babel_bardo.constants import OLLAMA_MODEL
+from babel_bardo.ollama_api import CircuitBreaker, ModelTiers, OllamaChat
+from babel_bardo.ollama_stub import OllamaStub
+from babel_bardo.llm_cache import LLMCache
+from babel_bardo.prompt_engine import OllamaEngine
+
+@pytest.fixture
+def chat(monkeypatch):
+    # Nothing listens there, requests that get through fail right away
+    monkeypatch.setenv('OLLAMA_ADDRES', '127.0.0.1:9')
+    return OllamaChat(0, max_retries=0, models=['big', 'small'], latency_budget=1)
+
+def open_breaker(chat:OllamaChat):
+    chat.breaker.failures = chat.breaker.threshold
+    chat.breaker.opened_at = perf_counter()
+
+def test_tiers_fall_back_when_too_slow():
+    tiers = ModelTiers(['big', 'small'], budget=1, min_samples=3)
+
+    for _ in range(2):
+        tiers.record(tiers.choose(), 2)
+    assert tiers.tier == 0
+
+    tiers.record(tiers.choose(), 2)
+    assert tiers.tier == 1
+
+def test_tiers_stay_without_budget():
+    tiers = ModelTiers(['big', 'small'], budget=None)
+
+    for _ in range(10):
+        tiers.record(tiers.choose(), 100)
+
+    assert tiers.tier == 0
+
+def test_tiers_probe_recovers_only_when_fast():
+    tiers = ModelTiers(['big', 'small'], budget=1, min_samples=1, probe_every=2)
+    tiers.record(0, 2)
+    assert tiers.tier == 1
+
+    tiers.record(tiers.choose(), 0.1)
+    tiers.record(tiers.choose(), 0.1)
+    # Every probe_every requests the previous tier is probed
+    assert tiers.choose() == 0
+
+    tiers.record(0, math.inf)
+    assert tiers.tier == 1
+
+    tiers.record(tiers.choose(), 0.1)
+    tiers.record(tiers.choose(), 0.1)
+    tiers.record(tiers.choose(), 0.5)
+    assert tiers.tier == 0
+
+def test_tiers_failures_count_as_over_budget():
+    tiers = ModelTiers(['big', 'small'], budget=1, min_samples=3)
+
+    for _ in range(3):
+        tiers.record(0, math.inf)
+
+    assert tiers.tier == 1
+
+def test_chats_dont_share_the_default_models(chat):
+    first = OllamaChat(0)
+    second = OllamaChat(0)
+    first.tiers.models.append('small')
+
+    assert second.tiers.models == [OLLAMA_MODEL]
+
+def test_breaker_opens_after_threshold_and_closes_on_success():
+    breaker = CircuitBreaker(threshold=2, cooldown=60)
+
+    breaker.record_failure()
+    assert breaker.allow()
+
+    breaker.record_failure()
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert breaker.allow()
+    assert breaker.failures == 0
+
+def test_breaker_half_opens_after_cooldown():
+    breaker = CircuitBreaker(threshold=1, cooldown=0)
+    breaker.record_failure()
+
+    assert breaker.allow()
+
+def test_send_with_open_breaker_keeps_tiers(chat):
+    chat.last_answer = "previous"
+    open_breaker(chat)
+
+    for _ in range(5):
+        assert chat.send("hello") == "previous"
+
+    # Refused requests never reached the model, so they aren't latencies
+    assert all(len(latencies) == 0 for latencies in chat.tiers.latencies)
+    assert chat.tiers.tier == 0
+
+def test_send_probe_with_open_breaker_doesnt_recover(chat):
+    chat.tiers._switch(1)
+    chat.tiers._since_switch = chat.tiers.probe_every
+    assert chat.tiers.choose() == 0
+
+    open_breaker(chat)
+    chat.send("hello")
+
+    assert chat.tiers.tier == 1
+
+def test_send_failed_request_is_over_budget(chat):
+    chat.tiers.min_samples = 1
+    chat.send("hello")
+
+    assert chat.tiers.latencies[0][0] == math.inf
+    assert chat.tiers.tier == 1
+
+def test_only_live_mode_sets_a_deadline(chat):
+    # Offline runs wait for the model loads and slow answers
+    assert OllamaChat(0).deadline == None
+
+    OllamaEngine(chat).set_latency_budget(10)
+    assert chat.deadline == 10
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_send_deadline_covers_the_retries(monkeypatch, stream):
+    with OllamaStub(latency=0, hang_rate=1, hang_seconds=3) as ollama:
+        monkeypatch.setenv('OLLAMA_ADDRES', ollama.address)
+        chat = OllamaChat(0, deadline=0.5, max_retries=3, backoff=0.1, stream=stream)
+        chat.last_answer = "previous"
+
+        start = perf_counter()
+        assert chat.send("hello") == "previous"
+        assert perf_counter() - start < 1.5
+
+def test_send_deadline_stops_a_slow_stream(monkeypatch):
+    with OllamaStub(latency=0, tokens_per_second=2, answers=["a slow answer with many words"]) as ollama:
+        monkeypatch.setenv('OLLAMA_ADDRES', ollama.address)
+        chat = OllamaChat(0, deadline=0.5, stream=True)
+        chat.last_answer = "previous"
+
+        start = perf_counter()
+        assert chat.send("hello") == "previous"
+        assert perf_counter() - start < 1.5
+
+class StreamResponse():
+    "The part of requests.Response read by OllamaChat._read_stream"
+    def __init__(self, lines:list[str]) -> None:
+        self.lines = lines
+
+    def iter_lines(self):
+        for line in self.lines:
+            yield line.encode('utf-8')
+
+    def close(self):
+        pass
+
+def chunk(content:str, done:bool=False) -> str:
+    return json.dumps({'message': {'role': 'assistant', 'content': content}, 'done': done})
+
+@pytest.mark.parametrize("lines", [
+    [chunk("Cal"), "{not json"],
+    [chunk("Cal"), "[1, 2]"],
+    # Ends without the final chunk
+    [chunk("A calm"), chunk(" forest")],
+])
+def test_broken_streams_are_failed_requests(chat, tmp_path, lines):
+    chat.stream = True
+    chat.cache = LLMCache(tmp_path)
+    chat.last_answer = "previous"
+    chat._post = lambda *args, **kwargs: StreamResponse(lines)
+
+    assert chat.send("hello") == "previous"
+    assert chat.breaker.failures == 1
+    assert list(chat.cache.entries()) == []
+
+class AnswerResponse():
+    "The part of requests.Response read by OllamaChat._read_answer"
+    def __init__(self, body:str) -> None:
+        self.content = body.encode('utf-8')
+
+@pytest.mark.parametrize("body", [
+    "{not json",
+    "[1, 2]",
+    json.dumps({'done': True}),
+    json.dumps({'message': {'role': 'assistant'}}),
+    json.dumps({'message': {'role': 'assistant', 'content': None}}),
+])
+def test_malformed_answers_are_failed_requests(chat, tmp_path, body):
+    chat.cache = LLMCache(tmp_path)
+    chat.last_answer = "previous"
+    chat._post = lambda *args, **kwargs: AnswerResponse(body)
+
+    assert chat.send("hello") == "previous"
+    assert chat.breaker.failures == 1
+    assert list(chat.cache.entries()) == []
+
+def test_whole_answer(chat):
+    chat._post = lambda *args, **kwargs: AnswerResponse(json.dumps({'message': {'role': 'assistant', 'content': "A calm forest"}, 'done': True}))
+
+    assert chat.send("hello") == "A calm forest"
+    assert chat.breaker.failures == 0
+
+def test_complete_and_early_stopped_streams_are_answers(chat, tmp_path):
+    chat.stream = True
+    chat.cache = LLMCache(tmp_path)
+
+    chat._post = lambda *args, **kwargs: StreamResponse([chunk("A calm"), chunk(" forest"), chunk("", done=True)])
+    assert chat.send("hello") == "A calm forest"
+
+    chat._post = lambda *args, **kwargs: StreamResponse([chunk("Ca"), chunk("lm"), chunk(" because")])
+    assert chat.send("again", choices=["Happy", "Calm"]) == "Calm"
+
+    assert chat.breaker.failures == 0
+    assert len(list(chat.cache.entries())) == 2
+
+@pytest.mark.parametrize("content, choices, expected", [
+    ("Calm", ["Happy", "Calm"], "Calm"),
+    (" \"calm.\" ", ["Happy", "Calm"], "Calm"),
+    ("Ca", ["Happy", "Calm"], None),
+    ("", ["Happy", "Calm"], None),
+    # A longer choice could still follow
+    ("Calm", ["Calm", "Calmer"], None),
+    ("Calmer", ["Calm", "Calmer"], "Calmer"),
+])
+def test_complete_choice(content, choices, expected):
+    assert OllamaChat._complete_choice(content, choices) == expected
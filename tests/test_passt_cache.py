@@ -0,0 +1,39 @@
+import torch
+
+from babel_bardo.passt_cache import PasstCache
+
+def test_cold_and_warm_cache_give_the_same_probabilities(tmp_path):
+    audio_file = tmp_path.joinpath('audio.wav')
+    audio_file.write_bytes(b'not really a wav')
+
+    probs = torch.rand(183)
+    probs[:3] = torch.tensor([0.0, 1.0, 0.99999])
+
+    cold = PasstCache(tmp_path.joinpath('cache'), model_id='test').put(audio_file, 32000, 0, 320000, probs)
+
+    cache = PasstCache(tmp_path.joinpath('cache'), model_id='test')
+    assert cache.get(audio_file, 32000, 0, 320000) is None
+    cache.put(audio_file, 32000, 0, 320000, probs)
+    cache.flush()
+
+    warm = PasstCache(tmp_path.joinpath('cache'), model_id='test').get(audio_file, 32000, 0, 320000)
+
+    assert torch.equal(cold, warm)
+    assert torch.allclose(warm, probs, atol=1e-3)
+
+def test_windows_are_keyed_by_content(tmp_path):
+    cache = PasstCache(tmp_path.joinpath('cache'), model_id='test')
+
+    first = tmp_path.joinpath('first.wav')
+    first.write_bytes(b'first')
+    copy = tmp_path.joinpath('copy.wav')
+    copy.write_bytes(b'first')
+    other = tmp_path.joinpath('other.wav')
+    other.write_bytes(b'other')
+
+    cache.put(first, 32000, 0, 320000, torch.rand(183))
+
+    assert cache.get(copy, 32000, 0, 320000) is not None
+    assert cache.get(other, 32000, 0, 320000) is None
+    assert cache.get(first, 16000, 0, 320000) is None
+    assert cache.get(first, 32000, 320000, 320000) is None
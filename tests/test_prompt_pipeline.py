@@ -0,0 +1,79 @@
+import threading
+from time import sleep
+
+import pytest
+
+from babel_bardo.prompt_pipeline import PromptPipeline, sequential_prompts
+
+def windows(n:int):
+    "Stands in for a started TranscriptIter, which yields (frases, time) tuples"
+    return iter([(f"frases {i}", None) for i in range(n)])
+
+def slow_prompt(frases:str) -> str:
+    sleep(0.01)
+    return frases.upper()
+
+def test_pipeline_keeps_the_transcript_order():
+    pipeline = PromptPipeline(windows(10), slow_prompt, lookahead=3)
+
+    assert list(pipeline) == list(sequential_prompts(windows(10), slow_prompt))
+    assert [idx for idx, _, _ in PromptPipeline(windows(3), slow_prompt)] == [0, 1, 2]
+
+def test_pipeline_starts_at_start_idx():
+    assert [idx for idx, _, _ in PromptPipeline(windows(3), slow_prompt, start_idx=5)] == [5, 6, 7]
+
+def test_pipeline_doesnt_run_ahead_of_lookahead():
+    calls = []
+
+    def prompt_fn(frases:str) -> str:
+        calls.append(frases)
+        return frases
+
+    pipeline = PromptPipeline(windows(100), prompt_fn, lookahead=2)
+    iterator = iter(pipeline)
+    next(iterator)
+    sleep(0.2)
+
+    # The one consumed, two in the queue and one waiting for space
+    assert len(calls) <= 4
+
+    pipeline.close()
+    assert not pipeline._thread.is_alive()
+
+def test_breaking_out_of_the_loop_stops_the_worker():
+    pipeline = PromptPipeline(windows(100), slow_prompt)
+
+    for idx, _, _ in pipeline:
+        if idx == 2:
+            break
+
+    assert not pipeline._thread.is_alive()
+
+def test_close_lets_the_running_prompt_finish():
+    started = threading.Event()
+    finished = []
+
+    def prompt_fn(frases:str) -> str:
+        started.set()
+        sleep(0.1)
+        finished.append(frases)
+        return frases
+
+    pipeline = PromptPipeline(windows(100), prompt_fn)
+    pipeline._thread.start()
+    started.wait()
+
+    pipeline.close()
+
+    assert finished == ["frases 0"]
+    assert not pipeline._thread.is_alive()
+
+def test_worker_errors_are_raised_in_the_loop():
+    def prompt_fn(frases:str) -> str:
+        if frases == "frases 2":
+            raise RuntimeError("Ollama is down")
+        return frases
+
+    with pytest.raises(RuntimeError, match="Ollama is down"):
+        for _ in PromptPipeline(windows(5), prompt_fn):
+            pass
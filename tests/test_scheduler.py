@@ -0,0 +1,105 @@
+from time import perf_counter
+
+import pytest
+
+from babel_bardo.scheduler import DeadlineScheduler
+
+def scheduler(**kwargs) -> DeadlineScheduler:
+    scheduler = DeadlineScheduler(window_budget=30, full_duration=30, overlap=10, safety_margin=0, **kwargs)
+    scheduler.start()
+    return scheduler
+
+def next_plan_with_time_left(scheduler:DeadlineScheduler, seconds:float, **kwargs):
+    "Moves the session clock so the next window has seconds left"
+    idx = scheduler.idx + 1
+    scheduler.t0 = perf_counter() + seconds - (idx + 1) * scheduler.window_budget
+    return scheduler.next_plan(**kwargs)
+
+def test_first_window_without_estimates_is_normal():
+    assert scheduler().next_plan().level == 'normal'
+
+def test_normal_when_everything_fits():
+    s = scheduler()
+    s.record_llm(5)
+    s.ttm_rate['text'] = 0.5 # 10s for the 20 new seconds
+
+    s.idx = 1
+    assert next_plan_with_time_left(s, 20).level == 'normal'
+
+def test_reuses_the_prompt_when_the_llm_doesnt_fit():
+    s = scheduler()
+    s.record_llm(15)
+    s.ttm_rate['text'] = 0.5
+    s.previous_prompt = "A calm forest"
+
+    s.idx = 1
+    plan = next_plan_with_time_left(s, 20)
+
+    assert plan.level == 'reuse_prompt'
+    assert not plan.use_llm
+
+def test_continues_without_a_previous_prompt():
+    s = scheduler()
+    s.record_llm(15)
+    s.ttm_rate['text'] = 0.5
+    s.ttm_rate['none'] = 0.4 # 8s for the 20 new seconds
+
+    s.idx = 1
+    plan = next_plan_with_time_left(s, 9)
+
+    assert plan.level == 'continue'
+    assert plan.continue_only
+
+def test_shortens_when_nothing_fits():
+    s = scheduler()
+    s.ttm_rate['text'] = 1
+    s.ttm_rate['none'] = 1
+
+    s.idx = 1
+    plan = next_plan_with_time_left(s, 5)
+
+    assert plan.level == 'shorten'
+    # overlap + the 5 new seconds that fit
+    assert plan.duration == pytest.approx(15, abs=0.1)
+
+    plan = next_plan_with_time_left(s, -10)
+    assert plan.duration == s.overlap + s.min_new_duration
+
+def test_late_first_window_is_still_normal():
+    s = scheduler()
+    s.ttm_rate['text'] = 10
+
+    assert next_plan_with_time_left(s, 1).level == 'normal'
+
+def test_templates_without_llm_ignore_its_latency():
+    s = scheduler()
+    s.record_llm(100)
+    s.ttm_rate['text'] = 0.5
+
+    s.idx = 1
+    assert next_plan_with_time_left(s, 20, has_llm=False).level == 'normal'
+
+def test_finish_reports_hits_and_misses():
+    s = scheduler()
+
+    next_plan_with_time_left(s, 10)
+    assert s.finish("A calm forest")
+
+    next_plan_with_time_left(s, -1)
+    assert not s.finish(None)
+
+    report = s.report()
+    assert (report['hits'], report['misses']) == (1, 1)
+    assert s.previous_prompt == None
+
+def test_resumed_session_starts_at_start_idx():
+    s = DeadlineScheduler(window_budget=30, full_duration=30, overlap=10, safety_margin=0)
+    s.start(start_idx=3)
+    s.ttm_rate['text'] = 10
+
+    plan = s.next_plan()
+
+    assert s.idx == 3
+    assert s.time_left(3) == pytest.approx(30, abs=1)
+    # Window 3 continues the tokens of the checkpoint instead of being a first window
+    assert plan.level == 'shorten'
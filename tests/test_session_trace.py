@@ -0,0 +1,36 @@
+import json
+
+from babel_bardo.session_trace import SessionTrace
+
+def trace_files(tmp_path):
+    return tmp_path.joinpath('trace.jsonl'), tmp_path.joinpath('summary.json')
+
+def test_resume_drops_the_windows_after_the_checkpoint(tmp_path):
+    trace = SessionTrace(*trace_files(tmp_path))
+    for idx in range(5):
+        trace.record(idx, generation=1.0)
+    trace._file.close() # crash after window 4
+
+    # The checkpoint was taken at window 2, windows 3 and 4 run again
+    trace = SessionTrace(*trace_files(tmp_path), resume_idx=2)
+    for idx in range(3, 6):
+        trace.record(idx, generation=3.0)
+    summary = trace.close()
+
+    with open(trace_files(tmp_path)[0], 'r') as trace_file:
+        idxs = [json.loads(line)['idx'] for line in trace_file]
+
+    assert idxs == [0, 1, 2, 3, 4, 5]
+    assert summary['windows'] == 6
+    assert summary['generation']['max'] == 3.0
+    assert summary['generation']['p50'] == 2.0
+
+def test_new_session_overwrites_the_trace(tmp_path):
+    trace = SessionTrace(*trace_files(tmp_path))
+    trace.record(0, generation=1.0)
+    trace.close()
+
+    trace = SessionTrace(*trace_files(tmp_path))
+    summary = trace.close()
+
+    assert summary['windows'] == 0
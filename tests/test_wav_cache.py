@@ -0,0 +1,102 @@
+import os
+import shutil
+
+import pytest
+
+from babel_bardo import wav_cache
+from babel_bardo.wav_cache import WavCache
+
+class CopyFfmpeg():
+    "Stands in for ffmpeg-python, copying the input instead of converting it"
+    def __init__(self) -> None:
+        self.runs = []
+
+    def input(self, audio_file:str) -> dict:
+        return {'input': audio_file}
+
+    def output(self, stream:dict, out_file:str, **kwargs) -> dict:
+        return {**stream, 'output': out_file, **kwargs}
+
+    def run(self, stream:dict, **kwargs):
+        self.runs.append(stream['input'])
+        out_file = stream['output'] % 0 if stream.get('f') == 'segment' else stream['output']
+        shutil.copy(stream['input'], out_file)
+
+class CrashingFfmpeg(CopyFfmpeg):
+    "Dies after writing half of the output"
+    def run(self, stream:dict, **kwargs):
+        with open(stream['output'], 'wb') as out_file:
+            out_file.write(b'RIFF')
+
+        raise RuntimeError("ffmpeg was killed")
+
+@pytest.fixture
+def ffmpeg(monkeypatch):
+    ffmpeg = CopyFfmpeg()
+    monkeypatch.setattr(wav_cache, 'ffmpeg', ffmpeg)
+    return ffmpeg
+
+def audio(path, content:bytes) -> str:
+    path.write_bytes(content)
+    return str(path)
+
+def test_converts_each_audio_once(tmp_path, ffmpeg):
+    cache = WavCache(tmp_path.joinpath('cache'))
+    original = audio(tmp_path.joinpath('VID.mp4'), b'original audio')
+
+    converted = cache.get(original)
+    assert cache.get(original) == converted
+    assert WavCache(tmp_path.joinpath('cache')).get(original) == converted
+
+    assert ffmpeg.runs == [original]
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert converted.read_bytes() == b'original audio'
+
+def test_conversions_are_keyed_by_content(tmp_path, ffmpeg):
+    cache = WavCache(tmp_path.joinpath('cache'))
+    original = audio(tmp_path.joinpath('VID.mp4'), b'original audio')
+    copy = audio(tmp_path.joinpath('copy.mp4'), b'original audio')
+
+    converted = cache.get(original)
+    # The same content somewhere else is the same audio
+    assert cache.get(copy) == converted
+
+    # A new audio with the old name isn't
+    audio(tmp_path.joinpath('VID.mp4'), b'another audio')
+    reconverted = cache.get(original)
+
+    assert reconverted != converted
+    assert reconverted.read_bytes() == b'another audio'
+    assert len(ffmpeg.runs) == 2
+
+    # Other sample rates, channels or segmentations are other conversions
+    assert cache.path(original, sr=16000) != reconverted
+    assert cache.path(original, channels=2) != reconverted
+    assert cache.get(original, segment=10).joinpath('000.wav').read_bytes() == b'another audio'
+
+def test_failed_conversions_arent_cached(tmp_path, monkeypatch):
+    cache = WavCache(tmp_path.joinpath('cache'))
+    original = audio(tmp_path.joinpath('VID.mp4'), b'original audio')
+    monkeypatch.setattr(wav_cache, 'ffmpeg', CrashingFfmpeg())
+
+    with pytest.raises(RuntimeError):
+        cache.get(original)
+
+    # The half written conversion never got the cached name
+    assert not cache.path(original).exists()
+
+    monkeypatch.setattr(wav_cache, 'ffmpeg', CopyFfmpeg())
+    assert cache.get(original).read_bytes() == b'original audio'
+
+def test_segments_converted_by_another_process(tmp_path, ffmpeg):
+    cache = WavCache(tmp_path.joinpath('cache'))
+    original = audio(tmp_path.joinpath('VID.mp4'), b'original audio')
+    out_path = cache.path(original, segment=10)
+
+    # Another process moved its segments in place while this one was converting
+    os.makedirs(out_path)
+    out_path.joinpath('000.wav').write_bytes(b'other process')
+    wav_cache._convert(original, str(out_path), 32000, 1, 10)
+
+    assert os.listdir(cache.cache_dir) == [out_path.name]
+    assert out_path.joinpath('000.wav').read_bytes() == b'other process'